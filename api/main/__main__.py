@@ -2,19 +2,40 @@
 
 import requests
 import time
+import uuid
 from typing import Dict, Any, Optional, List
 
 class PiApiClient:
     """Client for interacting with the Raspberry Pi API."""
 
-    def __init__(self, base_url: str = "http://localhost:8000"):
+    def __init__(self, base_url: str = "http://localhost:8000", timeout: float = 10.0, retries: int = 2):
         """
         Initialize the Pi API client.
 
         Args:
             base_url: Base URL of the Pi API, including protocol and port
+            timeout: Seconds to wait for each request
+            retries: How many times to retry a pump command after a timeout or connection error
         """
         self.base_url = base_url
+        self.timeout = timeout
+        self.retries = retries
+        self._pump_config: Optional[Dict[str, Any]] = None
+        self._pump_config_etag: Optional[str] = None
+
+    def _command(self, path: str) -> Dict[str, Any]:
+        """POST a pump command, retrying with the same Idempotency-Key so it runs at most once"""
+        headers = {"Idempotency-Key": str(uuid.uuid4())}
+        for attempt in range(self.retries + 1):
+            try:
+                response = requests.post(f"{self.base_url}{path}", headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
+                continue
+            response.raise_for_status()
+            return response.json()
 
     def health_check(self) -> Dict[str, str]:
         """Check if the Pi API is healthy."""
@@ -22,6 +43,25 @@ class PiApiClient:
         response.raise_for_status()
         return response.json()
 
+    def pump_config(self) -> Dict[str, Any]:
+        """
+        Get the Pi's versioned pump name -> pin map.
+
+        The map is cached and revalidated with If-None-Match, so polling it is
+        cheap. Sync it to the database with crud.initialize_pumps_from_config(db, config["pumps"]).
+
+        Returns:
+            {"version": ..., "pumps": {name: pin}, "source": ...}
+        """
+        headers = {"If-None-Match": self._pump_config_etag} if self._pump_config_etag else {}
+        response = requests.get(f"{self.base_url}/pumps/config", headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and self._pump_config is not None:
+            return self._pump_config
+        response.raise_for_status()
+        self._pump_config = response.json()
+        self._pump_config_etag = response.headers.get("ETag")
+        return self._pump_config
+
     def pump_on(self, name: str) -> Dict[str, Any]:
         """
         Turn on a pump.
@@ -32,9 +72,7 @@ class PiApiClient:
         Returns:
             Response from the API
         """
-        response = requests.post(f"{self.base_url}/pump/{name}/on")
-        response.raise_for_status()
-        return response.json()
+        return self._command(f"/pump/{name}/on")
 
     def pump_off(self, name: str) -> Dict[str, Any]:
         """
@@ -46,9 +84,7 @@ class PiApiClient:
         Returns:
             Response from the API
         """
-        response = requests.post(f"{self.base_url}/pump/{name}/off")
-        response.raise_for_status()
-        return response.json()
+        return self._command(f"/pump/{name}/off")
 
 def test_pi_api_connection(pi_api_url: str = "http://localhost:8000") -> None:
     """
@@ -67,12 +103,11 @@ def test_pi_api_connection(pi_api_url: str = "http://localhost:8000") -> None:
         print(f"Health check failed: {e}")
         return
 
-    # List of available pumps (from pump_config.py)
-    available_pumps = [
-        "calcium_nitrate", "magnesium_sulfate", "micronutrients",
-        "ph_down", "ph_up", "potassium", "flush_1", "flush_2",
-        "fill_1", "fill_2"
-    ]
+    # Pumps currently wired on the Pi
+    available_pumps = list(client.pump_config()["pumps"])
+    if not available_pumps:
+        print("No pumps configured on the Pi")
+        return
 
     # Test turning on and off a pump (using the first available pump)
     test_pump = available_pumps[0]
@@ -0,0 +1,39 @@
+# Streaming export endpoints for pump history
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+
+from packages.db import DEFAULT_SITE_ID, shards
+from packages.db import export
+
+router = APIRouter(prefix="/export", tags=["export"])
+
+def _stream(fmt: str, site: str, pump: Optional[str], start: Optional[datetime], end: Optional[datetime]):
+    # The session lives as long as the response body is being streamed
+    db = shards.session(site)
+    try:
+        yield from export.stream_pump_activities(db, fmt, pump, start, end)
+    finally:
+        db.close()
+
+@router.get("/pump-activities")
+def export_pump_activities(format: str = "csv", site: str = DEFAULT_SITE_ID, pump: Optional[str] = None,
+                           start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """Stream a site's pump activity history as CSV, NDJSON or Parquet.
+
+    Filters: `pump` (name) and a `start` (inclusive) / `end` (exclusive) time range.
+    """
+    try:
+        export.check_format(format)
+        shards.shard_for(site)
+    except (ValueError, KeyError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    filename = f"pump_activities{'_' + pump if pump else ''}.{format}"
+    return StreamingResponse(
+        _stream(format, site, pump, start, end),
+        media_type=export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -1,15 +1,55 @@
 # Health API for cloud deployment
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
 import logging
 import os
+import threading
 import uvicorn
+from packages.metrics import instrument_app
+from packages.db import QueryProfilingMiddleware, init_db, replicas
+from export_api import router as export_router
+from read_api import router as read_router
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Delay between schema creation attempts while the database is unreachable
+SCHEMA_INIT_RETRY_SECONDS = float(os.environ.get("SCHEMA_INIT_RETRY_SECONDS", "10"))
+
+stopping = threading.Event()
+
+def init_schema():
+    """Create the database schema, retrying until it succeeds (runs in a worker thread)"""
+    while not stopping.is_set():
+        try:
+            init_db()
+        except Exception as e:
+            logger.error(f"Schema init failed, retrying in {SCHEMA_INIT_RETRY_SECONDS}s: {e}")
+            stopping.wait(SCHEMA_INIT_RETRY_SECONDS)
+            continue
+        logger.info("Database schema ready")
+        return
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # In the background, so /health answers even while the database is down
+    stopping.clear()
+    threading.Thread(target=init_schema, name="schema-init", daemon=True).start()
+    yield
+    stopping.set()
+    replicas.close(timeout=1)
+
 # Create FastAPI app
-app = FastAPI(title="Verdant API Health Service")
+app = FastAPI(title="Verdant API Health Service", lifespan=lifespan)
+instrument_app(app)
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+# Opt-in: log requests that issue too many, repeated or lazy-loaded statements
+if os.environ.get("DB_QUERY_PROFILING", "").lower() in ("1", "true", "yes"):
+    app.add_middleware(QueryProfilingMiddleware, max_statements=int(os.environ.get("DB_QUERY_MAX_STATEMENTS", "20")))
+app.include_router(export_router)
+app.include_router(read_router)
 
 @app.get("/health")
 async def health_check():
@@ -0,0 +1,210 @@
+# Read-only endpoints over pumps and pump activities for dashboards
+#
+# Responses are serialized once and kept in an in-process cache for
+# READ_CACHE_TTL seconds. When an entry expires it is revalidated with one
+# cheap version query (crud.get_data_version); if nothing changed the
+# cached body is reused, so polling dashboards rarely re-run the real query.
+# Every response carries an ETag, and If-None-Match gets a 304.
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from datetime import date, datetime, timedelta, timezone
+from email.utils import format_datetime
+from typing import Any, Callable, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response
+from sqlalchemy.orm import Session
+
+from packages.db import DEFAULT_SITE_ID, crud, shards
+from packages.metrics import Counter
+from packages.web import etag_matches
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library
+    orjson = None
+
+READ_CACHE_TTL = float(os.environ.get("READ_CACHE_TTL", "5"))
+# Cached bodies are rebuilt at least this often even if the version is unchanged
+# (activity duration edits and deletes don't change the version)
+READ_CACHE_MAX_AGE = float(os.environ.get("READ_CACHE_MAX_AGE", "300"))
+READ_CACHE_MAX_ENTRIES = int(os.environ.get("READ_CACHE_MAX_ENTRIES", "256"))
+GZIP_MIN_SIZE = 1000
+
+READ_CACHE = Counter("read_cache_total", "Read API responses by cache result", ("result",))
+
+router = APIRouter(tags=["read"])
+
+def dumps(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"),
+                      default=lambda o: o.isoformat() if isinstance(o, (date, datetime)) else str(o)).encode()
+
+@dataclass(frozen=True)
+class _Entry:
+    body: bytes
+    gzipped: Optional[bytes]
+    etag: str
+    version: Optional[Tuple[Any, ...]]
+    last_modified: Optional[datetime]
+    created: float
+    expires: float
+
+class ResponseCache:
+    """Bounded LRU of serialized responses"""
+
+    def __init__(self, max_entries: int = READ_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: _Entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+cache = ResponseCache()
+
+def _build(data: Any, version, now: float) -> _Entry:
+    body = dumps(data)
+    last_modified = max((t for t in (version or ())[1:3] if isinstance(t, datetime)), default=None)
+    return _Entry(
+        body=body,
+        gzipped=gzip.compress(body, 6) if len(body) >= GZIP_MIN_SIZE else None,
+        etag=f'W/"{hashlib.sha1(body).hexdigest()[:20]}"',
+        version=version,
+        last_modified=last_modified,
+        created=now,
+        expires=now + READ_CACHE_TTL,
+    )
+
+def cached(request: Request, db: Session, compute: Callable[[], Any], versioned: bool = True, scope: str = "") -> Response:
+    """Serve compute()'s result as JSON through the response cache.
+
+    `versioned` responses depend only on the pump tables and are revalidated
+    against crud.get_data_version; others (e.g. live runtimes) just expire.
+    `scope` separates cache entries for anything else the result depends on.
+    """
+    key = f"{request.url.path}?{sorted(request.query_params.multi_items())}#{scope}"
+    now = time.monotonic()
+    entry = cache.get(key)
+
+    if entry is not None and entry.expires > now:
+        READ_CACHE.labels("hit").inc()
+    else:
+        version = crud.get_data_version(db) if versioned else None
+        if entry is not None and versioned and entry.version == version and now - entry.created < READ_CACHE_MAX_AGE:
+            entry = replace(entry, expires=now + READ_CACHE_TTL)
+            READ_CACHE.labels("revalidated").inc()
+        else:
+            entry = _build(compute(), version, now)
+            READ_CACHE.labels("miss").inc()
+        cache.put(key, entry)
+
+    headers = {"ETag": entry.etag, "Cache-Control": f"max-age={int(READ_CACHE_TTL)}", "Vary": "Accept-Encoding"}
+    if entry.last_modified is not None:
+        headers["Last-Modified"] = format_datetime(entry.last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    if entry.gzipped is not None and "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(entry.gzipped, media_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(entry.body, media_type="application/json", headers=headers)
+
+def get_site_db(site: str = DEFAULT_SITE_ID):
+    """Session on the shard holding `site`; crud calls on it are scoped to the site"""
+    try:
+        db = shards.session(site)
+    except KeyError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    try:
+        yield db
+    finally:
+        db.close()
+
+def pump_dict(pump) -> dict:
+    return {
+        "id": pump.id,
+        "site_id": pump.site_id,
+        "name": pump.name,
+        "pin": pump.pin,
+        "type": pump.type.value if pump.type else None,
+        "description": pump.description,
+        "is_active": bool(pump.is_active),
+        "created_at": pump.created_at,
+        "updated_at": pump.updated_at,
+    }
+
+def activity_dict(activity) -> dict:
+    return {
+        "id": activity.id,
+        "pump_id": activity.pump_id,
+        "site_id": activity.site_id,
+        "action": activity.action.value if activity.action else None,
+        "timestamp": activity.timestamp,
+        "duration": activity.duration,
+    }
+
+def _pump_or_404(db: Session, name: str):
+    pump = crud.get_pump_by_name(db, name)
+    if pump is None:
+        raise HTTPException(status_code=404, detail=f"Pump '{name}' not found")
+    return pump
+
+@router.get("/pumps")
+def list_pumps(request: Request, skip: int = 0, limit: int = Query(100, le=1000), db: Session = Depends(get_site_db)):
+    """All pumps"""
+    return cached(request, db, lambda: [pump_dict(p) for p in crud.get_pumps(db, skip, limit)])
+
+@router.get("/pumps/state")
+def pump_states(request: Request, db: Session = Depends(get_site_db)):
+    """Every pump's current state and runtime today"""
+    return cached(request, db, lambda: crud.get_pump_states(db), versioned=False)
+
+@router.get("/pumps/{name}")
+def get_pump(name: str, request: Request, db: Session = Depends(get_site_db)):
+    return cached(request, db, lambda: pump_dict(_pump_or_404(db, name)))
+
+@router.get("/pumps/{name}/activities")
+def pump_activities(name: str, request: Request, skip: int = 0, limit: int = Query(100, le=1000),
+                    db: Session = Depends(get_site_db)):
+    """Activities of one pump, newest first"""
+    def compute():
+        pump = _pump_or_404(db, name)
+        return [activity_dict(a) for a in crud.get_pump_activities_by_pump(db, pump.id, skip, limit)]
+    return cached(request, db, compute)
+
+@router.get("/activities")
+def list_activities(request: Request, skip: int = 0, limit: int = Query(100, le=1000), db: Session = Depends(get_site_db)):
+    """Activities of all pumps, newest first"""
+    return cached(request, db, lambda: [activity_dict(a) for a in crud.get_pump_activities(db, skip, limit)])
+
+@router.get("/rollups/daily")
+def daily_rollup(request: Request, days: int = Query(7, ge=1, le=366), pump: Optional[str] = None,
+                 db: Session = Depends(get_site_db)):
+    """Completed runs and runtime per pump per day for the last `days` days (UTC)"""
+    end = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+    def compute():
+        pump_id = _pump_or_404(db, pump).id if pump else None
+        return crud.get_daily_runtime(db, end - timedelta(days=days), end, pump_id)
+    return cached(request, db, compute, scope=end.date().isoformat())
@@ -0,0 +1 @@
+# Off-device benchmarks for Verdant OS (run from the repository root)
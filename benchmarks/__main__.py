@@ -0,0 +1,19 @@
+# Run the whole benchmark suite: python -m benchmarks
+from benchmarks import bench_api, bench_crud, bench_metrics, bench_startup, bench_tank_sim, bench_timeseries
+
+def main():
+    print("== crud (SQLite) ==")
+    bench_crud.main([])
+    print("\n== pump_api / pi_api (simulated MCP23017) ==")
+    bench_api.main([])
+    print("\n== pump_api cold start ==")
+    bench_startup.main([])
+    print("\n== metrics per-sample overhead ==")
+    bench_metrics.main(["--samples", "200000"])
+    print("\n== sensor time-series storage ==")
+    bench_timeseries.main(["--samples", "50000"])
+    print("\n== tank simulator ==")
+    bench_tank_sim.main([])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# bench_api.py - Load test pump_api and pi_api against a simulated MCP23017
+#
+# Both services run in-process under uvicorn on the loopback interface;
+# no hardware, network or database is needed.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.bench_api [--requests 2000] [--concurrency 8] [--i2c-latency-ms 0.3]
+import argparse
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import uvicorn
+
+from benchmarks.common import add_service_path, summarize
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def serve(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError(f"Server on port {port} did not start")
+        time.sleep(0.01)
+    return server
+
+def wait_ready(base_url: str, timeout: float = 10.0):
+    """Poll /ready until the relay board is initialized, so the load doesn't race lazy init"""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            if requests.get(f"{base_url}/ready", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        if time.time() > deadline:
+            raise RuntimeError(f"{base_url} did not become ready")
+        time.sleep(0.01)
+
+def load(base_url: str, pumps, total: int, concurrency: int):
+    """Alternate on/off commands across pumps from `concurrency` clients"""
+    per_worker = total // concurrency
+
+    def worker(index: int):
+        session = requests.Session()
+        latencies = []
+        for i in range(per_worker):
+            pump = pumps[(index + i // 2) % len(pumps)]
+            state = "on" if i % 2 == 0 else "off"
+            t0 = time.perf_counter()
+            session.post(f"{base_url}/pump/{pump}/{state}").raise_for_status()
+            latencies.append(time.perf_counter() - t0)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return [latency for result in results for latency in result], elapsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pump_api/pi_api load test")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--i2c-latency-ms", type=float, default=0.3)
+    args = parser.parse_args(argv)
+
+    pump_port, pi_port = free_port(), free_port()
+    os.environ["RELAY_BACKEND"] = "simulated"
+    os.environ["SIM_I2C_LATENCY_MS"] = str(args.i2c_latency_ms)
+    os.environ["PUMP_API_URL"] = f"http://127.0.0.1:{pump_port}"
+    os.environ.setdefault("SCHEDULE_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="verdant-bench-"), "schedules.db"))
+    add_service_path("rasp_pi", "water")
+    add_service_path("rasp_pi", "api")
+    logging.getLogger("pump_master").setLevel(logging.WARNING)
+
+    import pump_api
+    import pi_api
+    from pump_config import PUMPS
+
+    pump_server = serve(pump_api.app, pump_port)
+    pi_server = serve(pi_api.app, pi_port)
+    pumps = list(PUMPS)
+    results = {}
+    try:
+        wait_ready(f"http://127.0.0.1:{pump_port}")
+        for name, port in (("pump_api", pump_port), ("pi_api -> pump_api", pi_port)):
+            latencies, elapsed = load(f"http://127.0.0.1:{port}", pumps, args.requests, args.concurrency)
+            results[name] = summarize(f"{name} (c={args.concurrency})", latencies, elapsed)
+    finally:
+        pi_server.should_exit = True
+        pump_server.should_exit = True
+    return results
+
+if __name__ == "__main__":
+    main()
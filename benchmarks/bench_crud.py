@@ -0,0 +1,56 @@
+# bench_crud.py - packages.db crud throughput on SQLite
+#
+# Usage (from the repository root):
+#     python -m benchmarks.bench_crud [--ops 2000]
+import argparse
+import random
+import time
+
+from benchmarks.common import add_service_path, use_sqlite, summarize
+
+use_sqlite("crud.db")
+add_service_path("rasp_pi", "water")
+
+from packages.db import SessionLocal, crud, init_db  # noqa: E402
+from pump_config import PUMPS  # noqa: E402
+
+def run(name: str, ops: int, fn):
+    latencies = []
+    start = time.perf_counter()
+    for i in range(ops):
+        t0 = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - t0)
+    return summarize(name, latencies, time.perf_counter() - start)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="crud throughput on SQLite")
+    parser.add_argument("--ops", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    rnd = random.Random(42)
+    names = list(PUMPS)
+    results = {}
+    init_db()
+    with SessionLocal() as db:
+        crud.initialize_pumps_from_config(db, PUMPS)
+        pump_ids = [p.id for p in crud.get_pumps(db)]
+
+        results["record_pump_on/off"] = run(
+            "record_pump_on/off", args.ops,
+            lambda i: (crud.record_pump_on if i % 2 == 0 else crud.record_pump_off)(db, names[(i // 2) % len(names)])
+        )
+        results["get_pump_by_name"] = run(
+            "get_pump_by_name", args.ops, lambda i: crud.get_pump_by_name(db, rnd.choice(names))
+        )
+        results["get_pump_activities"] = run(
+            "get_pump_activities(limit=100)", args.ops // 10, lambda i: crud.get_pump_activities(db)
+        )
+        results["get_pump_activities_by_pump"] = run(
+            "get_pump_activities_by_pump", args.ops // 10,
+            lambda i: crud.get_pump_activities_by_pump(db, rnd.choice(pump_ids))
+        )
+    return results
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# bench_startup.py - Cold-start time of pump_api (process spawn to liveness/readiness)
+#
+# Usage (from the repository root):
+#     python -m benchmarks.bench_startup [--runs 10] [--i2c-latency-ms 0.3]
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmarks.common import ROOT, summarize
+from benchmarks.bench_api import free_port
+
+def wait_for(url: str, deadline: float) -> float:
+    """Poll url until it returns 200; returns the time it first did"""
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(url, timeout=0.5).status_code == 200:
+                return time.perf_counter()
+        except requests.RequestException:
+            pass
+        time.sleep(0.002)
+    raise RuntimeError(f"{url} did not become available")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pump_api cold start")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--i2c-latency-ms", type=float, default=0.3)
+    args = parser.parse_args(argv)
+
+    env = dict(
+        os.environ,
+        RELAY_BACKEND="simulated",
+        SIM_I2C_LATENCY_MS=str(args.i2c_latency_ms),
+        SCHEDULE_DB_PATH=os.path.join(tempfile.mkdtemp(prefix="verdant-bench-"), "schedules.db"),
+        PYTHONPATH=os.pathsep.join([ROOT, os.environ.get("PYTHONPATH", "")]),
+    )
+    live, ready = [], []
+    for _ in range(args.runs):
+        port = free_port()
+        start = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "pump_api:app", "--host", "127.0.0.1", "--port", str(port),
+             "--log-level", "warning"],
+            cwd=os.path.join(ROOT, "rasp_pi", "water"), env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            deadline = start + 30
+            live.append(wait_for(f"http://127.0.0.1:{port}/health", deadline) - start)
+            ready.append(wait_for(f"http://127.0.0.1:{port}/ready", deadline) - start)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    return {
+        "live": summarize("spawn -> /health 200", live, sum(live)),
+        "ready": summarize("spawn -> /ready 200", ready, sum(ready)),
+    }
+
+if __name__ == "__main__":
+    main()
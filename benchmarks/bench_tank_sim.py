@@ -0,0 +1,79 @@
+# bench_tank_sim.py - Tank simulator speed: scripted replay and closed-loop dosing
+#
+# Usage (from the repository root):
+#     python -m benchmarks.bench_tank_sim [--tanks 100] [--days 7] [--loop-tanks 20] [--loop-hours 6]
+import argparse
+import logging
+import random
+import time
+
+import numpy as np
+
+from models.water_para import fert_control
+from models.water_para.fert_control import DosingLoop, SimulatedClock, Tank
+from models.water_para.tank_sim import DEFAULT_PUMPS, SimulatorRelay, SimulatorSensors, TankSimulator, pulse
+
+DOSING_PUMPS = [name for name, spec in DEFAULT_PUMPS.items() if spec.flow_l_per_s < 0.01]
+
+def scripted_commands(tanks: int, days: int, seed: int = 0):
+    """A dosing pulse per tank every ~15 minutes and a daily flush and refill"""
+    rnd = random.Random(seed)
+    commands = []
+    for tank in range(tanks):
+        t = rnd.uniform(0, 900)
+        while t < days * 86400:
+            commands += pulse(t, tank, rnd.choice(DOSING_PUMPS), rnd.uniform(1, 5))
+            t += rnd.uniform(600, 1200)
+        for day in range(days):
+            start = day * 86400 + 3 * 3600 + tank
+            commands += pulse(start, tank, "flush_1", 600)
+            commands += pulse(start + 500, tank, "fill_1", 700)  # Overlaps the flush: sub-stepped
+    return commands
+
+def bench_replay(tanks: int, days: int):
+    commands = scripted_commands(tanks, days)
+    sim = TankSimulator(tanks)
+    simulated = days * 86400
+    start = time.perf_counter()
+    trace = sim.replay(commands, until=simulated, sample_every=3600)
+    elapsed = time.perf_counter() - start
+    print(f"{'replay':12} {tanks:>5} tanks {days:>3} days {len(commands):>8} commands "
+          f"{elapsed:>7.2f}s {simulated / elapsed:>10.0f}x real time {len(commands) / elapsed:>9.0f} commands/s")
+    print(f"{'':12} final pH {trace.ph[-1].min():.2f}-{trace.ph[-1].max():.2f}, "
+          f"EC {trace.ec[-1].min():.2f}-{trace.ec[-1].max():.2f} mS/cm")
+
+def bench_closed_loop(tanks: int, hours: float):
+    clock = SimulatedClock()
+    sim = TankSimulator(tanks)
+    sim.base_ph[:] = np.linspace(5.0, 7.5, tanks)  # Every tank starts off target
+    for tank in range(tanks):
+        sim.set_concentrations(tank, N=0.12, K=0.1, Ca=0.1, Mg=0.04, S=0.05)
+    loop = DosingLoop(SimulatorSensors(sim, clock), period=10.0, clock=clock, sleep=clock.sleep,
+                      relay_threads=False)
+    for name in sim.names:
+        loop.add_tank(Tank(name, SimulatorRelay(sim, name, clock)))
+
+    simulated = hours * 3600
+    start = time.perf_counter()
+    loop.run(until=simulated)
+    elapsed = time.perf_counter() - start
+    ph_error, ec_error = np.abs(sim.ph() - 6.0), np.abs(sim.ec() - 1.6)
+    print(f"{'closed loop':12} {tanks:>5} tanks {hours:>3.0f} hours {loop.stats['pulses']:>8} pulses "
+          f"{elapsed:>7.2f}s {simulated / elapsed:>10.0f}x real time")
+    print(f"{'':12} max |pH - 6.0| {ph_error.max():.2f}, max |EC - 1.6| {ec_error.max():.2f}, "
+          f"rate limited {loop.stats['rate_limited']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tank simulator speed")
+    parser.add_argument("--tanks", type=int, default=100)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--loop-tanks", type=int, default=20)
+    parser.add_argument("--loop-hours", type=float, default=6)
+    args = parser.parse_args(argv)
+
+    fert_control.logger.setLevel(logging.ERROR)
+    bench_replay(args.tanks, args.days)
+    bench_closed_loop(args.loop_tanks, args.loop_hours)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# bench_timeseries.py - Chunked (Gorilla) storage vs one row per sample
+#
+# Usage (from the repository root):
+#     python -m benchmarks.bench_timeseries [--samples 200000] [--channels 4]
+import argparse
+import math
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, select, Column, Integer, String, Float, DateTime, Index
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from benchmarks.common import use_sqlite
+
+WORKDIR = use_sqlite("package.db")
+
+from packages.db import Base, SensorChunk, crud  # noqa: E402
+
+RowBase = declarative_base()
+
+class SensorSample(RowBase):
+    """Row-per-sample baseline"""
+    __tablename__ = "sensor_samples"
+
+    id = Column(Integer, primary_key=True)
+    channel = Column(String, nullable=False)
+    timestamp = Column(DateTime, nullable=False)
+    value = Column(Float, nullable=False)
+
+    __table_args__ = (Index("ix_sensor_samples_channel_ts", "channel", "timestamp"),)
+
+def generate(channel_index: int, count: int, start: datetime):
+    """1 Hz sensor-like signal: slow drift, small noise, 2-decimal resolution"""
+    rnd = random.Random(channel_index)
+    base = 5.5 + channel_index
+    return [
+        (start + timedelta(seconds=i), round(base + 0.3 * math.sin(i / 600) + rnd.gauss(0, 0.01), 2))
+        for i in range(count)
+    ]
+
+def file_size(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=200_000, help="samples per channel")
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--window", type=int, default=3600, help="query window in seconds")
+    args = parser.parse_args(argv)
+
+    start = datetime(2025, 1, 1)
+    data = {f"tank_1.ch{c}": generate(c, args.samples, start) for c in range(args.channels)}
+
+    chunk_path = os.path.join(WORKDIR, "chunks.db")
+    row_path = os.path.join(WORKDIR, "rows.db")
+    chunk_engine = create_engine(f"sqlite:///{chunk_path}")
+    row_engine = create_engine(f"sqlite:///{row_path}")
+    Base.metadata.create_all(chunk_engine)
+    RowBase.metadata.create_all(row_engine)
+    ChunkSession = sessionmaker(bind=chunk_engine)
+    RowSession = sessionmaker(bind=row_engine)
+
+    # --- write ---
+    t0 = time.perf_counter()
+    with ChunkSession() as db:
+        for channel, samples in data.items():
+            crud.record_sensor_samples(db, channel, samples)
+    chunk_write = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with RowSession() as db:
+        for channel, samples in data.items():
+            db.bulk_insert_mappings(SensorSample, [
+                {"channel": channel, "timestamp": ts, "value": value} for ts, value in samples
+            ])
+        db.commit()
+    row_write = time.perf_counter() - t0
+
+    # --- scan: random windows on one channel ---
+    channel = next(iter(data))
+    rnd = random.Random(42)
+    windows = []
+    for _ in range(20):
+        offset = rnd.randrange(0, max(1, args.samples - args.window))
+        windows.append((start + timedelta(seconds=offset), start + timedelta(seconds=offset + args.window)))
+
+    t0 = time.perf_counter()
+    with ChunkSession() as db:
+        chunk_points = sum(len(crud.get_sensor_samples(db, channel, a, b)) for a, b in windows)
+    chunk_scan = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with RowSession() as db:
+        row_points = sum(
+            len(db.query(SensorSample.timestamp, SensorSample.value).filter(
+                SensorSample.channel == channel,
+                SensorSample.timestamp >= a,
+                SensorSample.timestamp <= b
+            ).order_by(SensorSample.timestamp).all())
+            for a, b in windows
+        )
+    row_scan = time.perf_counter() - t0
+
+    total = args.samples * args.channels
+    with ChunkSession() as db:
+        payload = db.scalar(select(func.sum(func.length(SensorChunk.data))))
+    print(f"samples: {total} ({args.channels} channels x {args.samples})")
+    print(f"{'':14}{'chunked':>14}{'row/sample':>14}")
+    print(f"{'file size':14}{file_size(chunk_path) / 1e6:>12.2f}MB{file_size(row_path) / 1e6:>12.2f}MB")
+    print(f"{'bytes/sample':14}{file_size(chunk_path) / total:>14.2f}{file_size(row_path) / total:>14.2f}")
+    print(f"{'  encoded':14}{payload / total:>14.2f}{'':>14}  (Gorilla payload only, without row/index overhead)")
+    print(f"{'write':14}{total / chunk_write:>10.0f}/sec{total / row_write:>10.0f}/sec")
+    print(f"{'scan':14}{chunk_points / chunk_scan:>10.0f}/sec{row_points / row_scan:>10.0f}/sec")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# common.py - Shared helpers for the benchmark scripts
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def use_sqlite(name: str) -> str:
+    """Point packages.db at a throwaway SQLite file (unless DATABASE_URL is already set)"""
+    workdir = tempfile.mkdtemp(prefix="verdant-bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, name)}")
+    return workdir
+
+def add_service_path(*parts: str):
+    """Make a service directory importable (the services use flat, same-directory imports)"""
+    path = os.path.join(ROOT, *parts)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(name: str, latencies: List[float], elapsed: float) -> Dict[str, float]:
+    """Print and return p50/p99 latency (ms) and throughput for one scenario"""
+    ordered = sorted(latencies)
+    result = {
+        "ops": len(ordered),
+        "ops_per_sec": len(ordered) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(ordered, 50) * 1000,
+        "p99_ms": percentile(ordered, 99) * 1000,
+    }
+    print(f"{name:32} {result['ops']:>7} ops {result['ops_per_sec']:>10.0f} ops/s "
+          f"p50 {result['p50_ms']:>8.3f}ms p99 {result['p99_ms']:>8.3f}ms")
+    return result
+
+def timed(fn, *args, **kwargs):
+    """Run fn and return (result, elapsed seconds)"""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
@@ -0,0 +1,553 @@
+# fert_control.py - Closed-loop pH/EC dosing for the nutrient tanks
+#
+# Each tank is sampled on a fixed period. A PI(D) controller turns the pH or
+# EC error into a pump pulse length, which is run through the relay
+# (anything with activate/deactivate, e.g. pump_master.RelayController or the
+# Pi API client). After a dose the tank is left to mix for `mixing_seconds`
+# before the next reading is acted on, and each pump has an hourly run-time
+# budget so a bad sensor cannot empty a bottle into the tank.
+#
+# All tanks share one thread. Samples and pulse ends are events on a heap
+# keyed by absolute due time, so a pulse never blocks the loop and tick times
+# do not drift with processing time. Relay calls run on a worker per tank,
+# outside the loop's lock. A pump that fails to stop latches the tank into a
+# fault (no further doses) while the stop is retried with backoff. On
+# shutdown pumps are stopped synchronously; a failure there latches too.
+
+import abc
+import heapq
+import itertools
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+NUTRIENT_PUMPS = {
+    "calcium_nitrate": 1.0,
+    "magnesium_sulfate": 1.0,
+    "micronutrients": 0.5,
+    "potassium": 1.0,
+}
+
+# A pump that fails to stop is retried after this delay, doubling up to STOP_RETRY_MAX_SECONDS
+STOP_RETRY_SECONDS = float(os.environ.get("DOSING_STOP_RETRY_SECONDS", "1"))
+STOP_RETRY_MAX_SECONDS = float(os.environ.get("DOSING_STOP_RETRY_MAX_SECONDS", "30"))
+# How long all_off() waits for the relays when the loop stops
+SHUTDOWN_TIMEOUT_SECONDS = float(os.environ.get("DOSING_SHUTDOWN_TIMEOUT_SECONDS", "10"))
+
+# ----- Sensors -----
+
+@dataclass
+class Reading:
+    ph: float
+    ec: float  # mS/cm
+
+class SensorSource(abc.ABC):
+    """Source of pH/EC readings; read() should return quickly (cached/latest value)"""
+
+    @abc.abstractmethod
+    def read(self, tank: str) -> Reading:
+        """Latest reading for a tank"""
+
+# ----- Controller -----
+
+class PID:
+    """PID with clamped output, derivative on measurement and anti-windup"""
+
+    def __init__(self, kp: float, ki: float = 0.0, kd: float = 0.0,
+                 output_limits: Tuple[float, float] = (-math.inf, math.inf)):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.output_min, self.output_max = output_limits
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self._last_measurement: Optional[float] = None
+
+    def update(self, setpoint: float, measurement: float, dt: float) -> float:
+        error = setpoint - measurement
+        derivative = 0.0
+        if self._last_measurement is not None and dt > 0:
+            derivative = -(measurement - self._last_measurement) / dt
+        self._last_measurement = measurement
+
+        integral = self.integral + error * dt
+        output = self.kp * error + self.ki * integral + self.kd * derivative
+        clamped = min(max(output, self.output_min), self.output_max)
+        # Only integrate while unsaturated, or when the error pulls back out of saturation
+        if clamped == output or (output > clamped) != (error > 0):
+            self.integral = integral
+        return clamped
+
+@dataclass
+class DosingLimits:
+    min_pulse: float = 0.5  # s; smaller corrections are skipped
+    max_pulse: float = 5.0  # s per pulse
+    max_seconds_per_hour: float = 60.0  # Run-time budget per pump over a rolling hour
+    mixing_seconds: float = 120.0  # Dead time after a dose before readings are acted on
+    pulse_gap: float = 1.0  # s between consecutive pulses of one dose
+
+@dataclass
+class Tank:
+    name: str
+    relay: object  # activate(pump) / deactivate(pump)
+    ph_target: float = 6.0
+    ph_deadband: float = 0.1
+    ec_target: Optional[float] = 1.6  # None to control pH only
+    ec_deadband: float = 0.1
+    ph_up_pump: str = "ph_up"
+    ph_down_pump: str = "ph_down"
+    nutrient_pumps: Dict[str, float] = field(default_factory=lambda: dict(NUTRIENT_PUMPS))  # pump -> ratio
+    ph_pid: PID = field(default_factory=lambda: PID(kp=3.0, ki=0.005, output_limits=(-5.0, 5.0)))
+    ec_pid: PID = field(default_factory=lambda: PID(kp=8.0, ki=0.01, output_limits=(0.0, 10.0)))
+    limits: DosingLimits = field(default_factory=DosingLimits)
+
+class _InlineExecutor:
+    """Runs relay calls on the calling thread, for simulations where only the loop moves the clock"""
+
+    def submit(self, fn, *args) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait: bool = True):
+        pass
+
+@dataclass
+class _TankState:
+    tank: Tank
+    next_tick: float
+    io: object  # Executor for this tank's relay calls, so a slow relay only delays its own tank
+    last_control: Optional[float] = None
+    hold_until: float = 0.0
+    active_pump: Optional[str] = None
+    busy: bool = False  # A relay call is in flight
+    pending: Deque[Tuple[str, float]] = field(default_factory=deque)
+    history: Dict[str, Deque[Tuple[float, float]]] = field(default_factory=dict)  # pump -> (time, seconds)
+    last_reading: Optional[Reading] = None
+    fault: Optional[str] = None  # Latched when a pump fails to stop; blocks dosing until clear_fault()
+    stuck: Dict[str, int] = field(default_factory=dict)  # pump -> failed stop attempts
+    unresponsive: bool = False  # The relay didn't answer within all_off()'s timeout
+
+SAMPLE, PULSE_START, PULSE_END, RETRY_STOP = 0, 1, 2, 3
+
+class DosingLoop:
+    """Controls any number of tanks from a single thread.
+
+    Relay calls run on a one-thread executor per tank (or inline with
+    relay_threads=False, for simulations on a SimulatedClock), so a slow
+    relay never holds the loop or the other tanks.
+    """
+
+    def __init__(self, sensors: SensorSource, period: float = 5.0,
+                 clock: Callable[[], float] = time.monotonic, sleep: Optional[Callable[[float], None]] = None,
+                 relay_threads: bool = True):
+        self.sensors = sensors
+        self.period = period
+        self.clock = clock
+        self.relay_threads = relay_threads
+        self._stopping = threading.Event()
+        self._wakeup = threading.Event()
+        self._sleep = sleep or self._wait
+        self._events: List[Tuple[float, int, int, str]] = []
+        self._seq = itertools.count()
+        self._tanks: Dict[str, _TankState] = {}
+        self._lock = threading.RLock()  # Re-entered when an inline relay call completes
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"samples": 0, "pulses": 0, "rate_limited": 0, "missed_ticks": 0, "max_lateness": 0.0,
+                      "failed_stops": 0}
+
+    def _push(self, due: float, kind: int, name: str):
+        heapq.heappush(self._events, (due, next(self._seq), kind, name))
+        self._wakeup.set()
+
+    def _wait(self, seconds: float):
+        self._wakeup.wait(seconds)
+        self._wakeup.clear()
+
+    def add_tank(self, tank: Tank):
+        with self._lock:
+            if tank.name in self._tanks:
+                raise ValueError(f"Tank '{tank.name}' is already controlled")
+            # Spread first ticks across the period so tanks don't all sample at once
+            offset = self.period * len(self._tanks) / (len(self._tanks) + 1)
+            state = _TankState(tank, next_tick=self.clock() + offset, io=self._executor(tank.name))
+            self._tanks[tank.name] = state
+            self._push(state.next_tick, SAMPLE, tank.name)
+
+    def _executor(self, name: str):
+        # ThreadPoolExecutor only starts its thread on the first submit
+        return ThreadPoolExecutor(1, thread_name_prefix=f"relay-{name}") if self.relay_threads else _InlineExecutor()
+
+    def reading(self, name: str) -> Optional[Reading]:
+        """Last reading taken for a tank"""
+        return self._tanks[name].last_reading
+
+    def fault(self, name: str) -> Optional[str]:
+        """Why dosing of a tank is blocked (a pump failed to stop), or None"""
+        return self._tanks[name].fault
+
+    def clear_fault(self, name: str):
+        """Resume dosing a faulted tank once its pumps are confirmed stopped"""
+        with self._lock:
+            state = self._tanks[name]
+            if state.stuck:
+                raise ValueError(f"Tank {name}: {', '.join(state.stuck)} not stopped yet")
+            if state.fault is not None:
+                logger.warning(f"Tank {name}: fault cleared ({state.fault})")
+            state.fault = None
+            state.tank.ph_pid.reset()
+            state.tank.ec_pid.reset()
+            state.last_control = None
+            state.hold_until = self.clock() + state.tank.limits.mixing_seconds
+
+    # ----- Event handlers (lock held) -----
+
+    def _sample(self, state: _TankState, now: float):
+        # Next tick on the fixed grid; ticks that were missed under load are skipped, not bunched
+        state.next_tick += self.period
+        if state.next_tick <= now:
+            missed = math.floor((now - state.next_tick) / self.period) + 1
+            state.next_tick += missed * self.period
+            self.stats["missed_ticks"] += missed
+        self._push(state.next_tick, SAMPLE, state.tank.name)
+
+        try:
+            reading = self.sensors.read(state.tank.name)
+        except Exception as e:
+            logger.error(f"Reading tank {state.tank.name} failed: {e}")
+            return
+        state.last_reading = reading
+        self.stats["samples"] += 1
+
+        if state.fault is not None:
+            return
+        if state.busy or state.active_pump is not None or state.pending or now < state.hold_until:
+            return  # Dosing or still mixing: this reading doesn't reflect the last dose yet
+        dt = now - state.last_control if state.last_control is not None else self.period
+        state.last_control = now
+        tank = state.tank
+
+        if abs(tank.ph_target - reading.ph) > tank.ph_deadband:
+            seconds = tank.ph_pid.update(tank.ph_target, reading.ph, dt)
+            pump = tank.ph_up_pump if seconds > 0 else tank.ph_down_pump
+            self._queue(state, [(pump, abs(seconds))], now)
+            return  # Fix pH before feeding; nutrients shift pH
+        if tank.ec_target is not None and tank.ec_target - reading.ec > tank.ec_deadband:
+            seconds = tank.ec_pid.update(tank.ec_target, reading.ec, dt)
+            total = sum(tank.nutrient_pumps.values())
+            self._queue(state, [(pump, seconds * ratio / total) for pump, ratio in tank.nutrient_pumps.items()], now)
+
+    def _budget(self, state: _TankState, pump: str, now: float) -> float:
+        history = state.history.setdefault(pump, deque())
+        while history and history[0][0] <= now - 3600:
+            history.popleft()
+        return state.tank.limits.max_seconds_per_hour - sum(seconds for _, seconds in history)
+
+    def _queue(self, state: _TankState, pulses: List[Tuple[str, float]], now: float):
+        limits = state.tank.limits
+        for pump, seconds in pulses:
+            seconds = min(seconds, limits.max_pulse)
+            budget = self._budget(state, pump, now)
+            if seconds > budget:
+                self.stats["rate_limited"] += 1
+                logger.warning(f"Tank {state.tank.name}: {pump} limited to {max(budget, 0):.1f}s this hour")
+                seconds = budget
+            if seconds >= limits.min_pulse:
+                state.pending.append((pump, seconds))
+                state.history[pump].append((now, seconds))  # Reserve the budget now
+        if state.pending:
+            self._push(now, PULSE_START, state.tank.name)
+
+    def _relay(self, state: _TankState, method: str, pump: str, done: Callable[[Optional[BaseException]], None]):
+        """Call relay.<method>(pump) on the tank's executor; done(error) runs under the lock afterwards"""
+        def finished(future: Future):
+            with self._lock:
+                state.busy = False
+                done(future.exception())
+
+        state.busy = True
+        state.io.submit(getattr(state.tank.relay, method), pump).add_done_callback(finished)
+
+    def _pulse_start(self, state: _TankState, now: float):
+        if state.fault is not None or self._stopping.is_set():
+            state.pending.clear()
+            return
+        pump, seconds = state.pending.popleft()
+        self._relay(state, "activate", pump, lambda error: self._started(state, pump, seconds, error))
+
+    def _started(self, state: _TankState, pump: str, seconds: float, error: Optional[BaseException]):
+        now = self.clock()
+        if error is not None:
+            logger.error(f"Tank {state.tank.name}: starting {pump} failed, abandoning dose: {error}")
+            state.pending.clear()
+            state.hold_until = now + state.tank.limits.mixing_seconds
+            self._stop(state, pump)  # It may have switched on anyway
+            return
+        state.active_pump = pump
+        self.stats["pulses"] += 1
+        if self._stopping.is_set():
+            self._stop(state, pump)  # Stopped while the start was in flight
+            return
+        logger.info(f"Tank {state.tank.name}: dosing {pump} for {seconds:.1f}s")
+        self._push(now + seconds, PULSE_END, state.tank.name)
+
+    def _pulse_end(self, state: _TankState, now: float):
+        if state.active_pump is not None:
+            self._stop(state, state.active_pump)
+
+    def _stop(self, state: _TankState, pump: str):
+        if state.active_pump == pump:
+            state.active_pump = None
+        self._relay(state, "deactivate", pump, lambda error: self._stopped(state, pump, error))
+
+    def _stopped(self, state: _TankState, pump: str, error: Optional[BaseException]):
+        now = self.clock()
+        if error is not None:
+            self._stop_failed(state, pump, error, now)
+            return
+        if state.stuck.pop(pump, None) is not None:
+            logger.warning(f"Tank {state.tank.name}: {pump} stopped after retrying; "
+                           f"dosing stays blocked until clear_fault()")
+        if state.pending and state.fault is None and not self._stopping.is_set():
+            self._push(now + state.tank.limits.pulse_gap, PULSE_START, state.tank.name)
+        else:
+            state.pending.clear()
+            state.hold_until = now + state.tank.limits.mixing_seconds
+
+    def _stop_failed(self, state: _TankState, pump: str, error: BaseException, now: float):
+        """Latch the tank fault and retry the stop with backoff until it succeeds"""
+        attempts = state.stuck.get(pump, 0) + 1
+        state.stuck[pump] = attempts
+        state.pending.clear()
+        self.stats["failed_stops"] += 1
+        self._latch(state, pump, error)
+        delay = min(STOP_RETRY_SECONDS * 2 ** (attempts - 1), STOP_RETRY_MAX_SECONDS)
+        logger.error(f"Tank {state.tank.name}: stopping {pump} failed (attempt {attempts}), retrying in {delay:.0f}s")
+        self._push(now + delay, RETRY_STOP, state.tank.name)
+
+    def _latch(self, state: _TankState, pump: str, error: BaseException):
+        if state.fault is None:
+            state.fault = f"stopping {pump} failed: {error}"
+            logger.critical(f"Tank {state.tank.name}: {pump} may still be dosing ({error}); dosing blocked")
+
+    def _retry_stop(self, state: _TankState, now: float):
+        if not state.stuck:
+            return
+        if state.busy:
+            self._push(now + STOP_RETRY_SECONDS, RETRY_STOP, state.tank.name)
+            return
+        self._stop(state, next(iter(state.stuck)))
+
+    # ----- Running -----
+
+    def run_pending(self) -> Optional[float]:
+        """Handle every event that is due; returns when the next one is due"""
+        handlers = {SAMPLE: self._sample, PULSE_START: self._pulse_start, PULSE_END: self._pulse_end,
+                    RETRY_STOP: self._retry_stop}
+        with self._lock:
+            now = self.clock()
+            while self._events and self._events[0][0] <= now:
+                due, _, kind, name = heapq.heappop(self._events)
+                self.stats["max_lateness"] = max(self.stats["max_lateness"], now - due)
+                handlers[kind](self._tanks[name], now)
+            return self._events[0][0] if self._events else None
+
+    def run(self, until: Optional[float] = None):
+        """Run the loop until stop() is called or the clock passes `until`"""
+        try:
+            while not self._stopping.is_set():
+                due = self.run_pending()
+                if until is not None and (due is None or due > until):
+                    break
+                self._sleep(max((due if due is not None else self.clock() + self.period) - self.clock(), 0))
+        finally:
+            self.all_off()
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.run, name="dosing-loop", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            states = list(self._tanks.values())
+        for state in states:
+            # A relay stuck in a call would block shutdown(wait=True) forever
+            old, state.io = state.io, self._executor(state.tank.name)
+            old.shutdown(wait=not state.unresponsive)
+
+    def all_off(self, timeout: Optional[float] = None):
+        """Drop queued pulses and stop every running or stuck pump, waiting for the relays.
+
+        Stop retries are kept for a later run(), but nothing processes them
+        once the loop is stopped, so a pump that fails to stop here latches
+        its tank's fault (see fault()).
+        """
+        with self._lock:
+            for state in self._tanks.values():
+                state.pending.clear()
+            self._events = [event for event in self._events if event[2] in (SAMPLE, RETRY_STOP)]
+            heapq.heapify(self._events)
+            states = list(self._tanks.values())
+        timeout = SHUTDOWN_TIMEOUT_SECONDS if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        for state in states:
+            try:
+                self._settle(state, deadline)
+            except FutureTimeout:
+                with self._lock:
+                    state.unresponsive = True
+                    self._latch(state, state.active_pump or "relay", TimeoutError(f"no answer in {timeout:.0f}s"))
+                continue
+            with self._lock:
+                pumps = list(state.stuck)
+                if state.active_pump is not None and state.active_pump not in state.stuck:
+                    pumps.append(state.active_pump)
+                state.active_pump = None
+            for pump in pumps:
+                self._stop_now(state, pump, deadline)
+
+    def _settle(self, state: _TankState, deadline: float):
+        """Wait (lock released) until no relay call of the tank is in flight; completions may queue another"""
+        while True:
+            with self._lock:
+                if not state.busy:
+                    return
+            state.io.submit(lambda: None).result(max(deadline - time.monotonic(), 0))
+
+    def _stop_now(self, state: _TankState, pump: str, deadline: float):
+        try:
+            state.io.submit(state.tank.relay.deactivate, pump).result(max(deadline - time.monotonic(), 0))
+        except FutureTimeout:
+            error = TimeoutError("relay did not answer")
+            state.unresponsive = True
+        except Exception as e:
+            error = e
+        else:
+            with self._lock:
+                state.stuck.pop(pump, None)
+            return
+        with self._lock:
+            state.stuck[pump] = state.stuck.get(pump, 0) + 1
+            self.stats["failed_stops"] += 1
+            self._latch(state, pump, error)
+
+# ----- Simulation -----
+
+class SimulatedClock:
+    """Manually advanced clock, so simulations run faster than real time"""
+
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+@dataclass
+class TankModel:
+    volume_l: float = 100.0
+    ph: float = 6.0
+    ec: float = 1.6
+    mixing_seconds: float = 60.0  # Time constant for a dose to mix through the tank
+    ph_drift_per_hour: float = 0.15  # Uptake pushes pH up
+    ec_uptake_per_hour: float = 0.03
+    noise: float = 0.0
+    # Change per second of pump run time in 100 L
+    ph_per_second: Dict[str, float] = field(default_factory=lambda: {"ph_up": 0.04, "ph_down": -0.05})
+    ec_per_second: Dict[str, float] = field(default_factory=lambda: {pump: 0.02 for pump in NUTRIENT_PUMPS})
+    unmixed_ph: float = 0.0
+    unmixed_ec: float = 0.0
+    updated_at: Optional[float] = None
+
+    def advance(self, now: float):
+        if self.updated_at is not None and now > self.updated_at:
+            dt = now - self.updated_at
+            mixed = 1 - math.exp(-dt / self.mixing_seconds)
+            self.ph += self.unmixed_ph * mixed + self.ph_drift_per_hour * dt / 3600
+            self.ec += self.unmixed_ec * mixed - self.ec_uptake_per_hour * dt / 3600
+            self.unmixed_ph *= 1 - mixed
+            self.unmixed_ec *= 1 - mixed
+        self.updated_at = now
+
+    def dose(self, pump: str, seconds: float):
+        scale = seconds * 100.0 / self.volume_l
+        self.unmixed_ph += self.ph_per_second.get(pump, 0.0) * scale
+        self.unmixed_ec += self.ec_per_second.get(pump, 0.0) * scale
+
+class SimulatedSensorSource(SensorSource):
+    """Readings from TankModels, advanced to the current clock time"""
+
+    def __init__(self, tanks: Dict[str, TankModel], clock: Callable[[], float] = time.monotonic, seed: int = 0):
+        self.tanks = tanks
+        self.clock = clock
+        self._random = random.Random(seed)
+
+    def read(self, tank: str) -> Reading:
+        model = self.tanks[tank]
+        model.advance(self.clock())
+        return Reading(
+            ph=model.ph + self._random.gauss(0, model.noise),
+            ec=model.ec + self._random.gauss(0, model.noise / 10),
+        )
+
+class SimulatedRelay:
+    """Relay whose pulses dose a TankModel for as long as the pump was on"""
+
+    def __init__(self, model: TankModel, clock: Callable[[], float] = time.monotonic):
+        self.model = model
+        self.clock = clock
+        self._started: Dict[str, float] = {}
+
+    def activate(self, pump_name: str):
+        self._started.setdefault(pump_name, self.clock())
+
+    def deactivate(self, pump_name: str):
+        started = self._started.pop(pump_name, None)
+        if started is not None:
+            now = self.clock()
+            self.model.advance(now)
+            self.model.dose(pump_name, now - started)
+
+    def is_active(self, pump_name: str) -> bool:
+        return pump_name in self._started
+
+if __name__ == "__main__":
+    # Simulate a few hours of three tanks starting off target
+    clock = SimulatedClock()
+    models = {
+        "tank_1": TankModel(ph=7.2, ec=0.9, noise=0.02),
+        "tank_2": TankModel(ph=5.2, ec=1.5, noise=0.02, volume_l=200.0),
+        "tank_3": TankModel(ph=6.1, ec=1.1, noise=0.02),
+    }
+    loop = DosingLoop(SimulatedSensorSource(models, clock), period=10.0, clock=clock, sleep=clock.sleep,
+                      relay_threads=False)
+    for name, model in models.items():
+        loop.add_tank(Tank(name, SimulatedRelay(model, clock)))
+    loop.run(until=4 * 3600)
+    for name in models:
+        reading = loop.reading(name)
+        print(f"{name}: pH {reading.ph:.2f}, EC {reading.ec:.2f}")
+    print(loop.stats)
@@ -1,14 +1,25 @@
 # Initialize the database package
-from .connection import Base, engine, SessionLocal, get_db
-from .models import Pump, PumpActivity, PumpType, PumpAction
+from .connection import Base, engine, replicas, SessionLocal, get_db
+from .models import Pump, PumpActivity, PumpType, PumpAction, SensorChunk, DEFAULT_SITE_ID
+from .routing import use_primary
+from .profiling import profile_queries, QueryProfile, QueryProfilingMiddleware
 from . import crud
+from .crud import ALL_SITES
+from .sharding import ShardRouter, shards, mapping_resolver, hash_resolver
 
-# Create all tables in the database
-Base.metadata.create_all(bind=engine)
+def init_db():
+    """Create missing tables and indexes on every shard.
+
+    Called by services at startup (not at import), so importing the package
+    never needs a reachable database.
+    """
+    shards.create_all(Base.metadata)
 
 # Export commonly used components
 __all__ = [
-    "Base", "engine", "SessionLocal", "get_db",
-    "Pump", "PumpActivity", "PumpType", "PumpAction",
+    "Base", "engine", "init_db", "replicas", "SessionLocal", "get_db", "use_primary",
+    "Pump", "PumpActivity", "PumpType", "PumpAction", "SensorChunk", "DEFAULT_SITE_ID", "ALL_SITES",
+    "ShardRouter", "shards", "mapping_resolver", "hash_resolver",
+    "profile_queries", "QueryProfile", "QueryProfilingMiddleware",
     "crud"
 ]
@@ -4,7 +4,9 @@ import logging
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from packages.secrets import get_secret, DB_USER_SECRET, DB_PASSWORD_SECRET, DB_NAME_SECRET
+from packages.secrets import get_secret, DB_USER_SECRET, DB_PASSWORD_SECRET, DB_NAME_SECRET, DB_REPLICA_HOSTS_SECRET
+from .instrumentation import instrument_engine
+from .routing import ReplicaSet, RoutingSession
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -15,13 +17,17 @@ DB_USER = get_secret(DB_USER_SECRET, os.environ.get("DB_USER", "[username]"))  #
 DB_PASSWORD = get_secret(DB_PASSWORD_SECRET, "[password]")  # Fetch from secret manager with fallback
 DB_NAME = get_secret(DB_NAME_SECRET, os.environ.get("DB_NAME", "Byte-Algae"))  # Fetch from secret manager with fallback
 
+def cloud_sql_url(instance_connection_name: str) -> str:
+    """Unix socket URL for a Cloud SQL instance"""
+    return f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@/{DB_NAME}?host=/cloudsql/{instance_connection_name}"
+
 # Check if running in Cloud environment with Cloud SQL
 INSTANCE_CONNECTION_NAME = os.environ.get("INSTANCE_CONNECTION_NAME")
 if INSTANCE_CONNECTION_NAME:
     logger.info(f"Using Cloud SQL Unix socket connection for {INSTANCE_CONNECTION_NAME}")
     # Format for Unix socket connection to Cloud SQL
     DB_HOST = f"/cloudsql/{INSTANCE_CONNECTION_NAME}"
-    DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@/{DB_NAME}?host={DB_HOST}"
+    DATABASE_URL = cloud_sql_url(INSTANCE_CONNECTION_NAME)
 else:
     # Standard TCP connection
     DB_HOST = os.environ.get("DB_HOST", "localhost:1234")
@@ -31,14 +37,37 @@ else:
         f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
     )
 
+# Optional read replicas: full URLs in DATABASE_REPLICA_URLS, or a comma-separated
+# list of replica hosts (Cloud SQL instance connection names when running with
+# INSTANCE_CONNECTION_NAME) from Secret Manager / DB_REPLICA_HOSTS
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+# How often a background thread re-measures each replica's lag
+REPLICA_CHECK_SECONDS = float(os.environ.get("DB_REPLICA_CHECK_SECONDS", "5"))
+if os.environ.get("DATABASE_REPLICA_URLS"):
+    REPLICA_URLS = [url.strip() for url in os.environ["DATABASE_REPLICA_URLS"].split(",") if url.strip()]
+else:
+    replica_hosts = get_secret(DB_REPLICA_HOSTS_SECRET, os.environ.get("DB_REPLICA_HOSTS", ""))
+    REPLICA_URLS = [
+        cloud_sql_url(host) if INSTANCE_CONNECTION_NAME else f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{host}/{DB_NAME}"
+        for host in (h.strip() for h in (replica_hosts or "").split(",")) if host
+    ]
+
+def make_engine(url: str):
+    """Create an instrumented SQLAlchemy engine"""
+    return instrument_engine(create_engine(
+        url,
+        connect_args={"check_same_thread": False} if url.startswith("sqlite") else {}
+    ))
+
 # Create SQLAlchemy engine
-engine = create_engine(
-    DATABASE_URL, 
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-)
+engine = make_engine(DATABASE_URL)
+replicas = ReplicaSet([make_engine(url) for url in REPLICA_URLS], max_lag=REPLICA_MAX_LAG_SECONDS,
+                      check_interval=REPLICA_CHECK_SECONDS)
+if replicas:
+    logger.info(f"Routing read-only queries to {len(replicas.replicas)} replica(s)")
 
 # Create sessionmaker
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine, replicas=replicas)
 
 # Create Base class for declarative models
 Base = declarative_base()
@@ -1,31 +1,55 @@
 # basic create/read/update/delete functions
-from sqlalchemy.orm import Session
-from typing import List, Optional, Dict, Any
+import os
+import threading
+import time
+from sqlalchemy import case, func, select, update, and_, literal_column
+from sqlalchemy.orm import Session, aliased
+from typing import List, Optional, Dict, Any, Iterable, Tuple
 from datetime import datetime
 
-from .models import Pump, PumpActivity, PumpType, PumpAction
+from .models import Pump, PumpActivity, PumpType, PumpAction, SensorChunk, DEFAULT_SITE_ID
+from . import timeseries
+from .routing import reads, writes, use_primary
+
+# Pass as site_id to list rows of every site in the database
+ALL_SITES = "*"
+
+def resolve_site(db: Session, site_id: Optional[str]) -> str:
+    """The explicit site, else the session's site (see sharding.ShardRouter), else the default"""
+    return site_id if site_id is not None else db.info.get("site_id", DEFAULT_SITE_ID)
 
 # ----- Pump CRUD operations -----
 
+@reads
 def get_pump(db: Session, pump_id: int) -> Optional[Pump]:
     """Get a pump by ID"""
     return db.query(Pump).filter(Pump.id == pump_id).first()
 
-def get_pump_by_name(db: Session, name: str) -> Optional[Pump]:
-    """Get a pump by name"""
-    return db.query(Pump).filter(Pump.name == name).first()
-
-def get_pumps(db: Session, skip: int = 0, limit: int = 100) -> List[Pump]:
-    """Get all pumps with pagination"""
-    return db.query(Pump).offset(skip).limit(limit).all()
-
-def get_pumps_by_type(db: Session, pump_type: PumpType) -> List[Pump]:
-    """Get all pumps of a specific type"""
-    return db.query(Pump).filter(Pump.type == pump_type).all()
-
-def create_pump(db: Session, name: str, pin: int, pump_type: PumpType, description: Optional[str] = None) -> Pump:
+@reads
+def get_pump_by_name(db: Session, name: str, site_id: Optional[str] = None) -> Optional[Pump]:
+    """Get a pump by name within a site"""
+    return db.query(Pump).filter(Pump.site_id == resolve_site(db, site_id), Pump.name == name).first()
+
+@reads
+def get_pumps(db: Session, skip: int = 0, limit: int = 100, site_id: Optional[str] = None) -> List[Pump]:
+    """Get a site's pumps with pagination (ALL_SITES for every site)"""
+    query = db.query(Pump)
+    site_id = resolve_site(db, site_id)
+    if site_id != ALL_SITES:
+        query = query.filter(Pump.site_id == site_id)
+    return query.offset(skip).limit(limit).all()
+
+@reads
+def get_pumps_by_type(db: Session, pump_type: PumpType, site_id: Optional[str] = None) -> List[Pump]:
+    """Get a site's pumps of a specific type"""
+    return db.query(Pump).filter(Pump.site_id == resolve_site(db, site_id), Pump.type == pump_type).all()
+
+@writes
+def create_pump(db: Session, name: str, pin: int, pump_type: PumpType, description: Optional[str] = None,
+                site_id: Optional[str] = None) -> Pump:
     """Create a new pump"""
     db_pump = Pump(
+        site_id=resolve_site(db, site_id),
         name=name,
         pin=pin,
         type=pump_type,
@@ -35,28 +59,38 @@ def create_pump(db: Session, name: str, pin: int, pump_type: PumpType, descripti
     db.add(db_pump)
     db.commit()
     db.refresh(db_pump)
+    invalidate_pump_states(db_pump.site_id)
     return db_pump
 
+@writes
 def update_pump(db: Session, pump_id: int, data: Dict[str, Any]) -> Optional[Pump]:
     """Update a pump's details"""
     db_pump = get_pump(db, pump_id)
     if db_pump:
+        old_site = db_pump.site_id
         for key, value in data.items():
             if hasattr(db_pump, key):
                 setattr(db_pump, key, value)
         db.commit()
         db.refresh(db_pump)
+        invalidate_pump_states(old_site)
+        if db_pump.site_id != old_site:
+            invalidate_pump_states(db_pump.site_id)
     return db_pump
 
+@writes
 def delete_pump(db: Session, pump_id: int) -> bool:
     """Delete a pump"""
     db_pump = get_pump(db, pump_id)
     if db_pump:
+        site_id = db_pump.site_id
         db.delete(db_pump)
         db.commit()
+        invalidate_pump_states(site_id)
         return True
     return False
 
+@writes
 def set_pump_active(db: Session, pump_id: int, is_active: bool) -> Optional[Pump]:
     """Set a pump's active status"""
     db_pump = get_pump(db, pump_id)
@@ -65,26 +99,40 @@ def set_pump_active(db: Session, pump_id: int, is_active: bool) -> Optional[Pump
         db_pump.updated_at = datetime.utcnow()
         db.commit()
         db.refresh(db_pump)
+        invalidate_pump_states(db_pump.site_id)
     return db_pump
 
 # ----- PumpActivity CRUD operations -----
 
+@reads
 def get_pump_activity(db: Session, activity_id: int) -> Optional[PumpActivity]:
     """Get a pump activity by ID"""
     return db.query(PumpActivity).filter(PumpActivity.id == activity_id).first()
 
-def get_pump_activities(db: Session, skip: int = 0, limit: int = 100) -> List[PumpActivity]:
-    """Get all pump activities with pagination"""
-    return db.query(PumpActivity).order_by(PumpActivity.timestamp.desc()).offset(skip).limit(limit).all()
+@reads
+def get_pump_activities(db: Session, skip: int = 0, limit: int = 100, site_id: Optional[str] = None) -> List[PumpActivity]:
+    """Get a site's pump activities with pagination (ALL_SITES for every site)"""
+    query = db.query(PumpActivity)
+    site_id = resolve_site(db, site_id)
+    if site_id != ALL_SITES:
+        query = query.filter(PumpActivity.site_id == site_id)
+    return query.order_by(PumpActivity.timestamp.desc()).offset(skip).limit(limit).all()
 
+@reads
 def get_pump_activities_by_pump(db: Session, pump_id: int, skip: int = 0, limit: int = 100) -> List[PumpActivity]:
     """Get activities for a specific pump"""
     return db.query(PumpActivity).filter(PumpActivity.pump_id == pump_id).order_by(PumpActivity.timestamp.desc()).offset(skip).limit(limit).all()
 
-def create_pump_activity(db: Session, pump_id: int, action: PumpAction, duration: Optional[float] = None) -> PumpActivity:
-    """Create a new pump activity record"""
+@writes
+def create_pump_activity(db: Session, pump_id: int, action: PumpAction, duration: Optional[float] = None,
+                         site_id: Optional[str] = None) -> PumpActivity:
+    """Create a new pump activity record (site_id defaults to the pump's site)"""
+    if site_id is None:
+        db_pump = db.get(Pump, pump_id)
+        site_id = db_pump.site_id if db_pump is not None else resolve_site(db, None)
     db_activity = PumpActivity(
         pump_id=pump_id,
+        site_id=site_id,
         action=action,
         timestamp=datetime.utcnow(),
         duration=duration
@@ -92,8 +140,10 @@ def create_pump_activity(db: Session, pump_id: int, action: PumpAction, duration
     db.add(db_activity)
     db.commit()
     db.refresh(db_activity)
+    invalidate_pump_states(site_id)
     return db_activity
 
+@writes
 def update_pump_activity_duration(db: Session, activity_id: int, duration: float) -> Optional[PumpActivity]:
     """Update the duration of a pump activity (typically called when a pump is turned off)"""
     db_activity = get_pump_activity(db, activity_id)
@@ -101,73 +151,341 @@ def update_pump_activity_duration(db: Session, activity_id: int, duration: float
         db_activity.duration = duration
         db.commit()
         db.refresh(db_activity)
+        invalidate_pump_states(db_activity.site_id)
     return db_activity
 
+@writes
 def delete_pump_activity(db: Session, activity_id: int) -> bool:
     """Delete a pump activity record"""
     db_activity = get_pump_activity(db, activity_id)
     if db_activity:
+        site_id = db_activity.site_id
         db.delete(db_activity)
         db.commit()
+        invalidate_pump_states(site_id)
         return True
     return False
 
+# ----- Sensor time-series operations -----
+
+@writes
+def record_sensor_samples(db: Session, channel: str, samples: Iterable[Tuple[datetime, float]],
+                          chunk_size: int = timeseries.CHUNK_SIZE) -> List[SensorChunk]:
+    """Compress (timestamp, value) samples for a channel into chunk rows.
+
+    Callers should buffer samples and write them in batches; every call
+    creates new chunks, so tiny batches lose most of the compression.
+    """
+    chunks = []
+    for block in timeseries.split_chunks(samples, chunk_size):
+        values = [value for _, value in block]
+        chunks.append(SensorChunk(
+            channel=channel,
+            start_time=block[0][0],
+            end_time=block[-1][0],
+            count=len(block),
+            min_value=min(values),
+            max_value=max(values),
+            data=timeseries.encode_chunk(block)
+        ))
+    if chunks:
+        db.add_all(chunks)
+        db.commit()
+    return chunks
+
+@reads
+def get_sensor_samples(db: Session, channel: str, start: datetime, end: datetime,
+                       bucket_seconds: Optional[float] = None) -> List[Tuple[datetime, float]]:
+    """Get samples for a channel in [start, end], optionally averaged into buckets.
+
+    Only chunks overlapping the range are fetched, and each is decoded only
+    up to `end`. Bucketing works on epoch millis, before datetimes are built.
+    """
+    chunks = db.query(SensorChunk.data, SensorChunk.count).filter(
+        SensorChunk.channel == channel,
+        SensorChunk.start_time <= end,
+        SensorChunk.end_time >= start
+    ).order_by(SensorChunk.start_time).all()
+
+    start_ms, end_ms = timeseries.to_millis(start), timeseries.to_millis(end)
+    points = []
+    for data, count in chunks:
+        points.extend(timeseries.iter_chunk(data, count, start_ms, end_ms))
+    points.sort(key=lambda p: p[0])  # Only reorders when batches overlap in time
+
+    if bucket_seconds and bucket_seconds > 0:
+        return timeseries.downsample_millis(points, int(bucket_seconds * 1000), start_ms)
+    return [(timeseries.from_millis(ms), value) for ms, value in points]
+
+@writes
+def delete_sensor_samples_before(db: Session, channel: str, before: datetime) -> int:
+    """Delete whole chunks for a channel that end before a given time (retention)"""
+    deleted = db.query(SensorChunk).filter(
+        SensorChunk.channel == channel,
+        SensorChunk.end_time < before
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+# ----- Current state snapshot -----
+
+# Snapshot results are cached per process; writes through this module
+# invalidate it immediately, the TTL bounds staleness from other writers.
+PUMP_STATE_CACHE_TTL = float(os.environ.get("PUMP_STATE_CACHE_TTL", "10"))
+
+_state_lock = threading.Lock()
+# "entries" maps (database, site) to (rows, day_start, expires). "written" maps a
+# site to the generation of its last write, "synced" maps (database, site) to the
+# generation at which its rows were last read from the primary.
+_state_cache: Dict[str, Any] = {"entries": {}, "generation": 0, "written": {}, "synced": {}}
+
+def invalidate_pump_states(site_id: Optional[str] = None):
+    """Drop a site's cached pump state snapshots (called after every pump/activity write; None for every site)"""
+    site_id = ALL_SITES if site_id is None else site_id
+    with _state_lock:
+        _state_cache["generation"] += 1
+        # Its next refill reads from the primary, a replica may not have the write yet
+        _state_cache["written"][site_id] = _state_cache["generation"]
+        entries = _state_cache["entries"]
+        for key in [key for key in entries if site_id == ALL_SITES or key[1] in (site_id, ALL_SITES)]:
+            del entries[key]
+
+def _written_since_sync(key: Tuple[Any, str]) -> bool:
+    """Whether a site (any site, for ALL_SITES) was written since its rows were last read from the primary"""
+    written = _state_cache["written"]
+    if key[1] == ALL_SITES:
+        last_write = max(written.values(), default=0)
+    else:
+        last_write = max(written.get(key[1], 0), written.get(ALL_SITES, 0))
+    return last_write > _state_cache["synced"].get(key, 0)
+
+@reads
+def _query_pump_states(db: Session, day_start: datetime, site_id: str) -> List[Dict[str, Any]]:
+    """Every pump of a site with its latest activity and runtime since day_start, in one statement"""
+    activities = select(PumpActivity)
+    if site_id != ALL_SITES:
+        activities = activities.where(PumpActivity.site_id == site_id)
+    activities = activities.subquery()
+
+    latest = select(
+        activities.c.pump_id,
+        activities.c.action,
+        activities.c.timestamp,
+        func.row_number().over(
+            partition_by=activities.c.pump_id,
+            order_by=(activities.c.timestamp.desc(), activities.c.id.desc())
+        ).label("rank")
+    ).subquery()
+    # Runs don't overlap, so only a pump's first stop today can have started before day_start
+    stops = select(
+        activities.c.pump_id,
+        activities.c.timestamp,
+        activities.c.duration,
+        func.row_number().over(
+            partition_by=activities.c.pump_id,
+            order_by=(activities.c.timestamp, activities.c.id)
+        ).label("rank")
+    ).where(
+        activities.c.action == PumpAction.OFF,
+        activities.c.timestamp >= day_start
+    ).subquery()
+    today = select(
+        stops.c.pump_id,
+        func.sum(stops.c.duration).label("runtime"),
+        func.max(case((stops.c.rank == 1, stops.c.timestamp))).label("first_stop_at"),
+        func.max(case((stops.c.rank == 1, stops.c.duration))).label("first_duration"),
+    ).group_by(stops.c.pump_id).subquery()
+
+    stmt = select(
+        Pump.id, Pump.name, Pump.pin, Pump.type, Pump.is_active,
+        latest.c.action, latest.c.timestamp, today.c.runtime, today.c.first_stop_at, today.c.first_duration
+    ).outerjoin(
+        latest, and_(latest.c.pump_id == Pump.id, latest.c.rank == 1)
+    ).outerjoin(
+        today, today.c.pump_id == Pump.id
+    ).order_by(Pump.id)
+    if site_id != ALL_SITES:
+        stmt = stmt.where(Pump.site_id == site_id)
+
+    states = []
+    for pump_id, name, pin, pump_type, is_active, action, timestamp, runtime, first_stop_at, first_duration in db.execute(stmt):
+        runtime = runtime or 0.0
+        if first_duration:
+            # Drop the part of a run that crossed midnight from before day_start
+            since_midnight = (first_stop_at - day_start).total_seconds()
+            runtime -= max(first_duration - since_midnight, 0.0)
+        states.append({
+            "id": pump_id,
+            "name": name,
+            "pin": pin,
+            "type": pump_type.value if pump_type else None,
+            "is_active": bool(is_active),
+            "last_action": action.value if action else None,
+            "last_activity_at": timestamp,
+            # The open interval started with the latest ON activity
+            "active_since": timestamp if is_active and action == PumpAction.ON else None,
+            "completed_runtime_today": runtime,
+        })
+    return states
+
+def get_pump_states(db: Session, use_cache: bool = True, site_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get every pump's current state: is_active, open interval start, last activity and today's runtime.
+
+    Served from a short-lived in-process cache; runtime of running pumps is
+    computed at call time so it keeps counting between refreshes.
+    """
+    now = datetime.utcnow()
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    site_id = resolve_site(db, site_id)
+    key = (db.bind, site_id)  # Sites on different shards are different databases
+
+    with _state_lock:
+        rows, cached_day, expires = _state_cache["entries"].get(key, (None, None, 0.0))
+        fresh = use_cache and rows is not None and cached_day == day_start and expires > time.monotonic()
+        generation = _state_cache["generation"]
+        dirty = _written_since_sync(key)
+
+    if not fresh:
+        if dirty:
+            use_primary(db)
+        rows = _query_pump_states(db, day_start, site_id)
+        with _state_lock:
+            # Don't store a result that raced with a write
+            if _state_cache["generation"] == generation:
+                _state_cache["entries"][key] = (rows, day_start, time.monotonic() + PUMP_STATE_CACHE_TTL)
+                if dirty:
+                    _state_cache["synced"][key] = generation
+
+    states = []
+    for row in rows:
+        runtime = row["completed_runtime_today"]
+        if row["active_since"] is not None:
+            runtime += (now - max(row["active_since"], day_start)).total_seconds()
+        states.append({**row, "runtime_today": runtime})
+    return states
+
+# ----- Rollups and change tracking -----
+
+@reads
+def get_data_version(db: Session, site_id: Optional[str] = None) -> Tuple[Any, ...]:
+    """Cheap fingerprint of a site's pump data: (last activity id, last activity time, last pump update, pump count).
+
+    Changes whenever an activity is added or a pump is created/updated; used
+    to revalidate cached read responses without re-running their queries.
+    """
+    site_id = resolve_site(db, site_id)
+
+    def scalar(column, model):
+        query = select(column)
+        if site_id != ALL_SITES:
+            query = query.where(model.site_id == site_id)
+        return query.scalar_subquery()
+
+    stmt = select(
+        scalar(func.max(PumpActivity.id), PumpActivity),
+        scalar(func.max(PumpActivity.timestamp), PumpActivity),
+        scalar(func.max(Pump.updated_at), Pump),
+        scalar(func.count(Pump.id), Pump),
+    )
+    return tuple(db.execute(stmt).one())
+
+@reads
+def get_daily_runtime(db: Session, start: datetime, end: datetime, pump_id: Optional[int] = None,
+                      site_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Completed runs and runtime per pump per day (UTC) in [start, end) for a site"""
+    day = func.date(PumpActivity.timestamp).label("day")
+    stmt = select(
+        day, Pump.name, func.count(PumpActivity.id), func.coalesce(func.sum(PumpActivity.duration), 0.0)
+    ).join(Pump, Pump.id == PumpActivity.pump_id).where(
+        PumpActivity.action == PumpAction.OFF,
+        PumpActivity.timestamp >= start,
+        PumpActivity.timestamp < end
+    ).group_by(day, Pump.name).order_by(day, Pump.name)
+
+    site_id = resolve_site(db, site_id)
+    if site_id != ALL_SITES:
+        stmt = stmt.where(PumpActivity.site_id == site_id)
+    if pump_id is not None:
+        stmt = stmt.where(PumpActivity.pump_id == pump_id)
+
+    return [
+        {"day": str(row_day), "pump": name, "runs": runs, "runtime_seconds": float(runtime)}
+        for row_day, name, runs, runtime in db.execute(stmt)
+    ]
+
 # ----- Convenience functions -----
 
-def record_pump_on(db: Session, pump_name: str) -> Dict[str, Any]:
-    """Record that a pump has been turned on"""
-    db_pump = get_pump_by_name(db, pump_name)
-    if not db_pump:
+def _switch_pump(db: Session, pump_name: str, site_id: Optional[str], is_active: bool, now: datetime):
+    """Set a pump's state and return (id, name, site_id, last ON id, last ON time) in one UPDATE ... RETURNING"""
+    # SQLite renders RETURNING columns unqualified, so the subquery uses an
+    # alias and names the outer pumps.id explicitly to correlate correctly
+    activity = aliased(PumpActivity, name="last_on")
+    last_on = select(activity.id).where(
+        activity.pump_id == literal_column(f"{Pump.__tablename__}.id"),
+        activity.action == PumpAction.ON
+    ).order_by(activity.timestamp.desc(), activity.id.desc()).limit(1)
+    stmt = update(Pump).where(
+        Pump.site_id == resolve_site(db, site_id), Pump.name == pump_name
+    ).values(is_active=is_active, updated_at=now).returning(
+        Pump.id, Pump.name, Pump.site_id,
+        last_on.scalar_subquery(),
+        last_on.with_only_columns(activity.timestamp).scalar_subquery()
+    ).execution_options(synchronize_session=False)
+    return db.execute(stmt).first()
+
+@writes
+def record_pump_on(db: Session, pump_name: str, site_id: Optional[str] = None) -> Dict[str, Any]:
+    """Record that a pump has been turned on (2 statements)"""
+    now = datetime.utcnow()
+    row = _switch_pump(db, pump_name, site_id, True, now)
+    if row is None:
+        db.rollback()
         return {"success": False, "message": f"Pump '{pump_name}' not found"}
+    pump_id, name, pump_site, _, _ = row
 
-    # Set pump as active
-    db_pump = set_pump_active(db, db_pump.id, True)
-
-    # Create activity record
-    activity = create_pump_activity(db, db_pump.id, PumpAction.ON)
+    db.add(PumpActivity(pump_id=pump_id, site_id=pump_site, action=PumpAction.ON, timestamp=now))
+    db.commit()
+    invalidate_pump_states(pump_site)
 
     return {
         "success": True,
-        "pump": db_pump.name,
+        "pump": name,
         "action": "on",
-        "timestamp": activity.timestamp
+        "timestamp": now
     }
 
-def record_pump_off(db: Session, pump_name: str) -> Dict[str, Any]:
-    """Record that a pump has been turned off"""
-    db_pump = get_pump_by_name(db, pump_name)
-    if not db_pump:
+@writes
+def record_pump_off(db: Session, pump_name: str, site_id: Optional[str] = None) -> Dict[str, Any]:
+    """Record that a pump has been turned off, closing its last ON activity (at most 3 statements)"""
+    now = datetime.utcnow()
+    row = _switch_pump(db, pump_name, site_id, False, now)
+    if row is None:
+        db.rollback()
         return {"success": False, "message": f"Pump '{pump_name}' not found"}
-
-    # Find the most recent ON activity for this pump
-    last_on_activity = db.query(PumpActivity).filter(
-        PumpActivity.pump_id == db_pump.id,
-        PumpActivity.action == PumpAction.ON
-    ).order_by(PumpActivity.timestamp.desc()).first()
+    pump_id, name, pump_site, last_on_id, last_on_at = row
 
     # Calculate duration if we have a previous ON activity
     duration = None
-    if last_on_activity:
-        now = datetime.utcnow()
-        duration = (now - last_on_activity.timestamp).total_seconds()
-        update_pump_activity_duration(db, last_on_activity.id, duration)
-
-    # Set pump as inactive
-    db_pump = set_pump_active(db, db_pump.id, False)
+    if last_on_id is not None:
+        duration = (now - last_on_at).total_seconds()
+        db.execute(update(PumpActivity).where(PumpActivity.id == last_on_id).values(duration=duration)
+                   .execution_options(synchronize_session=False))
 
-    # Create activity record
-    activity = create_pump_activity(db, db_pump.id, PumpAction.OFF, duration)
+    db.add(PumpActivity(pump_id=pump_id, site_id=pump_site, action=PumpAction.OFF, timestamp=now, duration=duration))
+    db.commit()
+    invalidate_pump_states(pump_site)
 
     return {
         "success": True,
-        "pump": db_pump.name,
+        "pump": name,
         "action": "off",
         "duration": duration,
-        "timestamp": activity.timestamp
+        "timestamp": now
     }
 
-def initialize_pumps_from_config(db: Session, pump_config: Dict[str, int]) -> List[Pump]:
-    """Initialize pumps in the database from a configuration dictionary"""
+@writes
+def initialize_pumps_from_config(db: Session, pump_config: Dict[str, int], site_id: Optional[str] = None) -> List[Pump]:
+    """Initialize a site's pumps in the database from a configuration dictionary"""
     pumps = []
 
     for name, pin in pump_config.items():
@@ -178,7 +496,7 @@ def initialize_pumps_from_config(db: Session, pump_config: Dict[str, int]) -> Li
             pump_type = PumpType.NUTRIENT
 
         # Check if pump already exists
-        existing_pump = get_pump_by_name(db, name)
+        existing_pump = get_pump_by_name(db, name, site_id)
         if existing_pump:
             # Update pin if it changed
             if existing_pump.pin != pin:
@@ -186,7 +504,7 @@ def initialize_pumps_from_config(db: Session, pump_config: Dict[str, int]) -> Li
             pumps.append(existing_pump)
         else:
             # Create new pump
-            new_pump = create_pump(db, name, pin, pump_type)
+            new_pump = create_pump(db, name, pin, pump_type, site_id=site_id)
             pumps.append(new_pump)
 
     return pumps
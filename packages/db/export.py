@@ -0,0 +1,165 @@
+# Streaming bulk export of pump history
+#
+# Rows are read with a server-side cursor (yield_per) and encoded one batch
+# at a time, so memory use is bounded by the batch size no matter how many
+# rows are exported.
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .crud import ALL_SITES, resolve_site
+from .models import Pump, PumpActivity
+from .routing import reads
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet export is optional
+    pyarrow = None
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+COLUMNS = ("id", "pump_id", "pump", "action", "timestamp", "duration")
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+@reads
+def iter_pump_activity_batches(db: Session, pump_name: Optional[str] = None, start: Optional[datetime] = None,
+                               end: Optional[datetime] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                               site_id: Optional[str] = None) -> Iterator[List[tuple]]:
+    """Yield lists of (id, pump_id, pump, action, timestamp, duration) for a site in time order"""
+    stmt = select(
+        PumpActivity.id, PumpActivity.pump_id, Pump.name, PumpActivity.action,
+        PumpActivity.timestamp, PumpActivity.duration
+    ).join(Pump, Pump.id == PumpActivity.pump_id).order_by(PumpActivity.timestamp, PumpActivity.id)
+
+    site_id = resolve_site(db, site_id)
+    if site_id != ALL_SITES:
+        stmt = stmt.where(PumpActivity.site_id == site_id)
+    if pump_name is not None:
+        stmt = stmt.where(Pump.name == pump_name)
+    if start is not None:
+        stmt = stmt.where(PumpActivity.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(PumpActivity.timestamp < end)
+
+    result = db.execute(stmt.execution_options(yield_per=batch_size))
+    try:
+        for partition in result.partitions():
+            yield [
+                (row[0], row[1], row[2], row[3].value if row[3] is not None else None, row[4], row[5])
+                for row in partition
+            ]
+    finally:
+        result.close()
+
+
+def _csv_stream(batches) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for batch in batches:
+        writer.writerows(
+            (id_, pump_id, pump, action, ts.isoformat() if ts else "", "" if duration is None else duration)
+            for id_, pump_id, pump, action, ts, duration in batch
+        )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _ndjson_stream(batches) -> Iterator[bytes]:
+    for batch in batches:
+        yield "".join(
+            json.dumps({
+                "id": id_, "pump_id": pump_id, "pump": pump, "action": action,
+                "timestamp": ts.isoformat() if ts else None, "duration": duration
+            }) + "\n"
+            for id_, pump_id, pump, action, ts, duration in batch
+        ).encode()
+
+
+class _DrainableSink:
+    """Write-only file object whose contents can be taken out as they are produced"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_stream(batches) -> Iterator[bytes]:
+    schema = pyarrow.schema([
+        ("id", pyarrow.int64()),
+        ("pump_id", pyarrow.int64()),
+        ("pump", pyarrow.string()),
+        ("action", pyarrow.string()),
+        ("timestamp", pyarrow.timestamp("us")),
+        ("duration", pyarrow.float64()),
+    ])
+    sink = _DrainableSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    try:
+        for batch in batches:
+            # One row group per batch
+            columns = list(zip(*batch)) if batch else [[] for _ in COLUMNS]
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            ))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def check_format(fmt: str):
+    """Raise ValueError if `fmt` cannot be exported"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of {', '.join(FORMATS)}")
+    if fmt == "parquet" and pyarrow is None:
+        raise ValueError("Parquet export requires pyarrow to be installed")
+
+
+def stream_pump_activities(db: Session, fmt: str = "csv", pump_name: Optional[str] = None,
+                           start: Optional[datetime] = None, end: Optional[datetime] = None,
+                           batch_size: int = DEFAULT_BATCH_SIZE, site_id: Optional[str] = None) -> Iterator[bytes]:
+    """Encode a site's pump activity history as a stream of CSV, NDJSON or Parquet bytes"""
+    check_format(fmt)
+    batches = iter_pump_activity_batches(db, pump_name, start, end, batch_size, site_id)
+    if fmt == "csv":
+        return _csv_stream(batches)
+    if fmt == "ndjson":
+        return _ndjson_stream(batches)
+    return _parquet_stream(batches)
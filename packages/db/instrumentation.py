@@ -0,0 +1,44 @@
+# Query and commit timing for the SQLAlchemy engine/session
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from packages.metrics import Histogram
+
+QUERY_SECONDS = Histogram("db_query_seconds", "SQL statement execution time", ("statement",))
+COMMIT_SECONDS = Histogram("db_commit_seconds", "Session commit time (flush + COMMIT)")
+
+_STATEMENT_TYPES = {"select", "insert", "update", "delete"}
+
+
+def _statement_type(statement: str) -> str:
+    verb = statement.lstrip()[:6].lower()
+    return verb if verb in _STATEMENT_TYPES else "other"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"]
+    QUERY_SECONDS.labels(_statement_type(statement)).observe(elapsed)
+
+
+def instrument_engine(engine):
+    """Record execution time of every statement run through an engine"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    return engine
+
+
+class InstrumentedSession(Session):
+    """Session that records how long commits take"""
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            COMMIT_SECONDS.observe(time.perf_counter() - start)
@@ -0,0 +1,112 @@
+# Upgrade existing databases to the current schema
+#
+# init_db() only creates missing tables; it never alters existing ones. This
+# brings databases created before per-site data up to date:
+#   - site_id on pumps and pump_activities (existing rows get DEFAULT_SITE_ID,
+#     activities copy their pump's site)
+#   - pump names and pins unique per site instead of globally
+#   - the pumps and pump_activities indexes
+# Every step checks the live schema first, so running it again is a no-op.
+# SQLite can't drop constraints, so there the pumps table is rebuilt instead.
+#
+# Usage (from the repository root), for every shard in DATABASE_URL/DATABASE_SHARDS:
+#     python -m packages.db.migrate [--dry-run]
+import argparse
+from typing import List
+
+from sqlalchemy import MetaData, String, inspect, text
+from sqlalchemy.schema import AddConstraint, CreateIndex, CreateTable
+
+from .models import Pump, PumpActivity, DEFAULT_SITE_ID
+
+_SITE_CONSTRAINTS = ("uq_pumps_site_name", "uq_pumps_site_pin")
+
+
+def _plain_indexes(insp, table: str):
+    """A table's indexes, without the ones Postgres reports for its unique constraints"""
+    return [i for i in insp.get_indexes(table) if not i.get("duplicates_constraint")]
+
+
+def _unique_sets(insp, table: str):
+    """name -> columns of a table's unique constraints and unique indexes"""
+    found = {c["name"]: tuple(c["column_names"]) for c in insp.get_unique_constraints(table)}
+    found.update({i["name"]: tuple(i["column_names"]) for i in _plain_indexes(insp, table) if i["unique"]})
+    return found
+
+
+def migrate(engine, dry_run: bool = False) -> List[str]:
+    """Apply the missing steps to one database; returns the SQL that was (or would be) run"""
+    statements: List[str] = []
+    with engine.begin() as conn:
+        dialect = conn.dialect
+
+        def run(statement):
+            sql = str(statement.compile(dialect=dialect)) if not isinstance(statement, str) else statement
+            statements.append(sql.strip())
+            if not dry_run:
+                conn.execute(text(sql) if isinstance(statement, str) else statement)
+
+        insp = inspect(conn)
+        tables = set(insp.get_table_names())
+        if Pump.__tablename__ not in tables:
+            return statements  # A new database: init_db() creates everything
+        default_site = String().literal_processor(dialect)(DEFAULT_SITE_ID)
+
+        for table in (Pump.__table__, PumpActivity.__table__):
+            if table.name in tables and "site_id" not in {c["name"] for c in insp.get_columns(table.name)}:
+                run(f"ALTER TABLE {table.name} ADD COLUMN site_id VARCHAR NOT NULL DEFAULT {default_site}")
+                if table is PumpActivity.__table__:
+                    run("UPDATE pump_activities SET site_id = (SELECT pumps.site_id FROM pumps "
+                        "WHERE pumps.id = pump_activities.pump_id) WHERE pump_id IS NOT NULL")
+
+        insp = inspect(conn)  # Inspectors cache what they've read
+        uniques = _unique_sets(insp, Pump.__tablename__)
+        global_uniques = [name for name, columns in uniques.items() if columns in (("name",), ("pin",))]
+        missing = [name for name in _SITE_CONSTRAINTS if name not in uniques]
+        if dialect.name == "sqlite" and (global_uniques or missing):
+            _rebuild_sqlite_table(Pump.__table__, insp, run)
+        elif global_uniques or missing:
+            indexes = {i["name"] for i in _plain_indexes(insp, Pump.__tablename__)}
+            for name in global_uniques:
+                run(f"DROP INDEX {name}" if name in indexes else f"ALTER TABLE pumps DROP CONSTRAINT {name}")
+            for constraint in Pump.__table__.constraints:
+                if constraint.name in missing:
+                    run(AddConstraint(constraint))
+
+        insp = inspect(conn)
+        for table in (Pump.__table__, PumpActivity.__table__):
+            existing = {i["name"] for i in _plain_indexes(insp, table.name)} if table.name in tables else set()
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                if index.name not in existing:
+                    run(CreateIndex(index))
+    return statements
+
+
+def _rebuild_sqlite_table(table, insp, run):
+    """Recreate a table with its current definition, keeping its rows (SQLite can't alter constraints)"""
+    columns = ", ".join(c.name for c in table.columns if c.name in {c["name"] for c in insp.get_columns(table.name)})
+    rebuilt = table.to_metadata(MetaData(), name=f"{table.name}_migrating")
+    run(CreateTable(rebuilt))
+    run(f"INSERT INTO {rebuilt.name} ({columns}) SELECT {columns} FROM {table.name}")
+    run(f"DROP TABLE {table.name}")
+    run(f"ALTER TABLE {rebuilt.name} RENAME TO {table.name}")
+
+
+def main(argv=None):
+    from . import init_db, shards
+
+    parser = argparse.ArgumentParser(description="Upgrade every shard to the current schema")
+    parser.add_argument("--dry-run", action="store_true", help="print the SQL without running it")
+    args = parser.parse_args(argv)
+
+    for name, factory in shards.shards.items():
+        statements = migrate(factory.kw["bind"], dry_run=args.dry_run)
+        print(f"-- shard {name}: {len(statements)} statement(s)")
+        for sql in statements:
+            print(f"{sql};")
+    if not args.dry_run:
+        init_db()  # Tables added since (e.g. sensor_chunks)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,15 @@
 # SQLAlchemy models
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Enum, LargeBinary, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 import enum
+import os
 from datetime import datetime
 
 from .connection import Base
 
+# Site (greenhouse / Pi) that rows belong to when a caller doesn't say
+DEFAULT_SITE_ID = os.environ.get("SITE_ID", "default")
+
 # Enum for pump types
 class PumpType(enum.Enum):
     NUTRIENT = "nutrient"
@@ -20,8 +24,9 @@ class Pump(Base):
     __tablename__ = "pumps"
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, unique=True, index=True)
-    pin = Column(Integer, unique=True)
+    site_id = Column(String, nullable=False, default=DEFAULT_SITE_ID)
+    name = Column(String, nullable=False)
+    pin = Column(Integer)
     type = Column(Enum(PumpType))
     description = Column(String, nullable=True)
     is_active = Column(Boolean, default=False)
@@ -31,14 +36,47 @@ class Pump(Base):
     # Relationship to PumpActivity
     activities = relationship("PumpActivity", back_populates="pump")
 
+    __table_args__ = (
+        # Names and pins are unique within a site; also the index for site lookups
+        UniqueConstraint("site_id", "name", name="uq_pumps_site_name"),
+        UniqueConstraint("site_id", "pin", name="uq_pumps_site_pin"),
+    )
+
 class PumpActivity(Base):
     __tablename__ = "pump_activities"
 
     id = Column(Integer, primary_key=True, index=True)
     pump_id = Column(Integer, ForeignKey("pumps.id"))
+    site_id = Column(String, nullable=False, default=DEFAULT_SITE_ID)  # Copied from the pump for site-local scans
     action = Column(Enum(PumpAction))
     timestamp = Column(DateTime, default=datetime.utcnow)
     duration = Column(Float, nullable=True)  # Duration in seconds, if applicable
 
     # Relationship to Pump
     pump = relationship("Pump", back_populates="activities")
+
+    __table_args__ = (
+        # Latest activity per pump (status snapshot) and per-pump history pages
+        Index("ix_pump_activities_pump_time", "pump_id", "timestamp"),
+        # Site-wide history pages and rollups
+        Index("ix_pump_activities_site_time", "site_id", "timestamp"),
+        # Fleet-wide exports in time order
+        Index("ix_pump_activities_time", "timestamp", "id"),
+    )
+
+class SensorChunk(Base):
+    """A compressed block of samples for one sensor/flow channel (see timeseries.py)"""
+    __tablename__ = "sensor_chunks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    channel = Column(String, nullable=False)
+    start_time = Column(DateTime, nullable=False)  # First sample in the chunk
+    end_time = Column(DateTime, nullable=False)  # Last sample in the chunk
+    count = Column(Integer, nullable=False)
+    min_value = Column(Float)
+    max_value = Column(Float)
+    data = Column(LargeBinary, nullable=False)  # Delta-of-delta timestamps + XOR values
+
+    __table_args__ = (
+        Index("ix_sensor_chunks_channel_range", "channel", "start_time", "end_time"),
+    )
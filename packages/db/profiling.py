@@ -0,0 +1,168 @@
+# Opt-in per-request/per-block SQL statement profiling
+#
+# Usage:
+#     with profile_queries() as profile:
+#         crud.record_pump_off(db, "fill_1")
+#     profile.assert_max_statements(3)
+#
+# Hooks are installed once on the Engine and Session classes (so every engine,
+# including ones created later, is covered) and cost a single ContextVar
+# lookup per statement when no profile is active.
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+_current_profile: ContextVar[Optional["QueryProfile"]] = ContextVar("query_profile", default=None)
+_enabled = False
+
+
+class QueryRecord:
+    """One statement executed while a profile was active"""
+    __slots__ = ("statement", "parameters", "duration", "lazy_load")
+
+    def __init__(self, statement: str, parameters, duration: float, lazy_load: Optional[str] = None):
+        self.statement = statement
+        self.parameters = parameters
+        self.duration = duration
+        self.lazy_load = lazy_load  # "Class.attribute" if issued by a lazy relationship load
+
+
+class QueryProfile:
+    """Statements issued within a profile_queries() block"""
+
+    def __init__(self, name: str = "profile"):
+        self.name = name
+        self.records: List[QueryRecord] = []
+        self._pending_lazy_load: Optional[str] = None
+
+    @property
+    def count(self) -> int:
+        return len(self.records)
+
+    @property
+    def total_time(self) -> float:
+        return sum(r.duration for r in self.records)
+
+    @property
+    def lazy_loads(self) -> List[QueryRecord]:
+        return [r for r in self.records if r.lazy_load]
+
+    def duplicates(self) -> Dict[Tuple[str, str], int]:
+        """Identical statements (same SQL and parameters) issued more than once"""
+        counts = Counter((r.statement, repr(r.parameters)) for r in self.records)
+        return {key: n for key, n in counts.items() if n > 1}
+
+    def repeated_statements(self, threshold: int = 3) -> Dict[str, int]:
+        """Same SQL issued with different parameters at least `threshold` times (N+1 pattern)"""
+        counts = Counter(r.statement for r in self.records)
+        return {statement: n for statement, n in counts.items() if n >= threshold}
+
+    def report(self) -> str:
+        lines = [f"{self.name}: {self.count} statements in {self.total_time * 1000:.2f}ms"]
+        for (statement, params), n in self.duplicates().items():
+            lines.append(f"  duplicate x{n}: {statement} {params}")
+        for statement, n in self.repeated_statements().items():
+            lines.append(f"  repeated x{n}: {statement}")
+        for record in self.lazy_loads:
+            lines.append(f"  lazy load {record.lazy_load}: {record.statement}")
+        return "\n".join(lines)
+
+    def assert_max_statements(self, limit: int):
+        assert self.count <= limit, f"Expected at most {limit} statements\n{self.report()}"
+
+    def assert_no_duplicates(self):
+        assert not self.duplicates(), f"Duplicate statements issued\n{self.report()}"
+
+    def assert_no_lazy_loads(self):
+        assert not self.lazy_loads, f"Lazy relationship loads issued\n{self.report()}"
+
+    @property
+    def has_problems(self) -> bool:
+        return bool(self.duplicates() or self.repeated_statements() or self.lazy_loads)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile.get() is not None:
+        conn.info["profile_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    if profile is None or "profile_start" not in conn.info:
+        return
+    elapsed = time.perf_counter() - conn.info.pop("profile_start")
+    lazy_load, profile._pending_lazy_load = profile._pending_lazy_load, None
+    profile.records.append(QueryRecord(statement, parameters, elapsed, lazy_load))
+
+
+def _do_orm_execute(orm_execute_state):
+    profile = _current_profile.get()
+    if profile is None or not orm_execute_state.is_select or orm_execute_state.lazy_loaded_from is None:
+        return
+    path = orm_execute_state.loader_strategy_path
+    prop = path[-1] if path is not None and len(path) else None
+    profile._pending_lazy_load = str(prop) if prop is not None else orm_execute_state.lazy_loaded_from.class_.__name__
+
+
+def enable_profiling():
+    """Install the profiling hooks (idempotent)"""
+    global _enabled
+    if _enabled:
+        return
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Session, "do_orm_execute", _do_orm_execute)
+    _enabled = True
+
+
+@contextmanager
+def profile_queries(name: str = "profile"):
+    """Record every statement executed in this context (thread/task local)"""
+    enable_profiling()
+    profile = QueryProfile(name)
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+
+
+class QueryProfilingMiddleware:
+    """ASGI middleware profiling the statements issued by each HTTP request.
+
+    Logs a warning for requests that exceed `max_statements`, repeat an
+    identical query or trigger lazy loads, and reports the statement count
+    in an X-DB-Statements response header.
+    """
+
+    def __init__(self, app, max_statements: int = 20):
+        self.app = app
+        self.max_statements = max_statements
+        enable_profiling()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with profile_queries(f"{scope['method']} {scope['path']}") as profile:
+            async def send_with_header(message):
+                if message["type"] == "http.response.start":
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-db-statements", str(profile.count).encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_with_header)
+
+        if profile.count > self.max_statements or profile.has_problems:
+            logger.warning(profile.report())
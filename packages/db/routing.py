@@ -0,0 +1,168 @@
+# Read-replica routing for sessions
+#
+# crud read functions are decorated with @reads and write functions with
+# @writes. A RoutingSession sends SELECTs issued inside a @reads call to a
+# replica, and everything else to the primary. Once a session has written
+# (a @writes call, a flush or any non-SELECT statement) it stays on the
+# primary for the rest of its life, so a request always reads its own writes.
+import functools
+import inspect
+import itertools
+import logging
+import threading
+import time
+from typing import List, Optional
+
+from sqlalchemy import text
+
+from packages.metrics import Counter
+from .instrumentation import InstrumentedSession
+
+logger = logging.getLogger(__name__)
+
+ROUTED_QUERIES = Counter("db_routed_queries_total", "Statements routed by target", ("target",))
+REPLICA_FALLBACKS = Counter("db_replica_fallbacks_total", "Replica reads sent to the primary instead", ("reason",))
+
+_PG_LAG_SQL = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class Replica:
+    """A replica engine and its most recently measured replication lag"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lag: float = float("inf")  # Unknown until the first probe
+        self.checked_at: float = 0.0
+
+    def refresh_lag(self):
+        """Measure replication lag; an unreachable replica counts as infinitely behind"""
+        try:
+            if self.engine.dialect.name == "postgresql":
+                with self.engine.connect() as conn:
+                    self.lag = float(conn.execute(_PG_LAG_SQL).scalar() or 0)
+            else:
+                self.lag = 0.0  # No replication to measure (e.g. SQLite in tests)
+        except Exception as e:
+            logger.warning(f"Replica {self.engine.url.host} lag check failed: {e}")
+            self.lag = float("inf")
+        finally:
+            self.checked_at = time.monotonic()
+
+
+class ReplicaSet:
+    """Round-robin over replicas whose lag is within `max_lag` seconds.
+
+    Lag is probed every `check_interval` seconds on a background thread, started
+    by the first pick(), so a down replica never holds up a request.
+    """
+
+    def __init__(self, engines, max_lag: float = 5.0, check_interval: float = 5.0):
+        self.replicas: List[Replica] = [Replica(engine) for engine in engines]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._next = itertools.count()
+        self._prober: Optional[threading.Thread] = None
+        self._prober_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def refresh(self):
+        """Probe every replica once"""
+        for replica in self.replicas:
+            replica.refresh_lag()
+
+    def _probe(self):
+        while True:
+            self.refresh()
+            if self._stopping.wait(self.check_interval):
+                return
+
+    def start(self):
+        """Start the lag prober thread (if it isn't already running)"""
+        with self._prober_lock:
+            if self._prober is None and self.replicas:
+                self._stopping.clear()
+                self._prober = threading.Thread(target=self._probe, name="replica-lag", daemon=True)
+                self._prober.start()
+
+    def close(self, timeout: Optional[float] = None):
+        """Stop the lag prober thread"""
+        with self._prober_lock:
+            prober, self._prober = self._prober, None
+        self._stopping.set()
+        if prober is not None:
+            prober.join(timeout)
+
+    def pick(self):
+        """Engine of a healthy replica, or None if every replica is lagging, down or not yet probed"""
+        if self._prober is None:
+            self.start()
+        count = len(self.replicas)
+        start = next(self._next)
+        for i in range(count):
+            replica = self.replicas[(start + i) % count]
+            if replica.lag <= self.max_lag:
+                return replica.engine
+        return None
+
+
+class RoutingSession(InstrumentedSession):
+    """Session that sends SELECTs from @reads calls to a replica until it has written"""
+
+    def __init__(self, *args, replicas: Optional[ReplicaSet] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        info = self.info
+        if self._flushing or (clause is not None and not getattr(clause, "is_select", False)):
+            info["wrote"] = True
+        elif self.replicas and info.get("replica_reads") and not info.get("wrote"):
+            replica = self.replicas.pick()
+            if replica is not None:
+                ROUTED_QUERIES.labels("replica").inc()
+                return replica
+            REPLICA_FALLBACKS.labels("lag").inc()
+        ROUTED_QUERIES.labels("primary").inc()
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+
+def use_primary(db):
+    """Pin a session to the primary (e.g. when a read must see the latest commit)"""
+    db.info["wrote"] = True
+
+
+def reads(fn):
+    """Mark a crud function as read-only: its SELECTs may be served by a replica"""
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def generator_wrapper(db, *args, **kwargs):
+            db.info["replica_reads"] = db.info.get("replica_reads", 0) + 1
+            try:
+                yield from fn(db, *args, **kwargs)
+            finally:
+                db.info["replica_reads"] -= 1
+        return generator_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(db, *args, **kwargs):
+        db.info["replica_reads"] = db.info.get("replica_reads", 0) + 1
+        try:
+            return fn(db, *args, **kwargs)
+        finally:
+            db.info["replica_reads"] -= 1
+    return wrapper
+
+
+def writes(fn):
+    """Mark a crud function as writing: the session is pinned to the primary"""
+    @functools.wraps(fn)
+    def wrapper(db, *args, **kwargs):
+        use_primary(db)
+        return fn(db, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,93 @@
+# Site-to-database sharding
+#
+# Every site's pumps and activities live in exactly one database (shard). A
+# ShardRouter maps site ids to shards through a pluggable resolver and hands
+# out sessions bound to that shard. Sessions are tagged with their site, so
+# crud functions called on them default to it. Single-site queries touch one
+# database; fleet-wide reads go through for_each_shard().
+#
+# Configuration: DATABASE_SHARDS is a JSON object of extra shard name -> URL
+# (the main DATABASE_URL is always the "default" shard) and SITE_SHARDS maps
+# site id -> shard name. Unmapped sites live on the default shard.
+import json
+import logging
+import os
+import zlib
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from .connection import SessionLocal, make_engine
+from .crud import ALL_SITES
+from .routing import RoutingSession
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARD = "default"
+
+def mapping_resolver(site_shards: Dict[str, str], default: str = DEFAULT_SHARD) -> Callable[[str], str]:
+    """Explicit site -> shard assignments; sites can be moved one at a time"""
+    return lambda site_id: site_shards.get(site_id, default)
+
+def hash_resolver(shard_names: Sequence[str]) -> Callable[[str], str]:
+    """Spread sites evenly by hash; adding a shard moves most sites, so only use for a fixed shard count"""
+    names = sorted(shard_names)
+    return lambda site_id: names[zlib.crc32(site_id.encode()) % len(names)]
+
+class ShardRouter:
+    """Maps site ids to the sessionmaker of the database that holds them"""
+
+    def __init__(self, shards: Dict[str, sessionmaker], resolver: Optional[Callable[[str], str]] = None):
+        if DEFAULT_SHARD not in shards:
+            raise ValueError(f"Shards must include '{DEFAULT_SHARD}'")
+        self.shards = shards
+        self.resolver = resolver or mapping_resolver({})
+
+    def shard_for(self, site_id: str) -> str:
+        name = self.resolver(site_id)
+        if name not in self.shards:
+            raise KeyError(f"Site '{site_id}' maps to unknown shard '{name}'")
+        return name
+
+    def session(self, site_id: str) -> Session:
+        """A new session on the site's shard; crud calls on it default to the site"""
+        name = self.shard_for(site_id)
+        db = self.shards[name]()
+        db.info.update(site_id=site_id, shard=name)
+        return db
+
+    @contextmanager
+    def session_scope(self, site_id: str) -> Iterator[Session]:
+        db = self.session(site_id)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def for_each_shard(self) -> Iterator[Tuple[str, Session]]:
+        """(shard name, session) for every shard, for fleet-wide reads (crud calls default to ALL_SITES)"""
+        for name, factory in self.shards.items():
+            db = factory()
+            db.info.update(site_id=ALL_SITES, shard=name)
+            try:
+                yield name, db
+            finally:
+                db.close()
+
+    def create_all(self, metadata):
+        """Create tables on every shard"""
+        for factory in self.shards.values():
+            metadata.create_all(bind=factory.kw["bind"])
+
+def shards_from_env() -> ShardRouter:
+    urls = json.loads(os.environ.get("DATABASE_SHARDS") or "{}")
+    site_shards = json.loads(os.environ.get("SITE_SHARDS") or "{}")
+    factories = {DEFAULT_SHARD: SessionLocal}
+    for name, url in urls.items():
+        factories[name] = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=make_engine(url))
+    if len(factories) > 1:
+        logger.info(f"Sharding sites across {len(factories)} databases")
+    return ShardRouter(factories, mapping_resolver(site_shards))
+
+shards = shards_from_env()
@@ -0,0 +1,265 @@
+# timeseries.py - Gorilla-style compression for sensor/flow sample chunks
+#
+# Timestamps are stored as millisecond integers using delta-of-delta encoding
+# and values as 64-bit floats XOR'ed against the previous value, following
+# "Gorilla: A Fast, Scalable, In-Memory Time Series Database" (Facebook, 2015).
+# Size depends on how much values change: on 1 Hz samples, a constant or
+# slowly stepping value encodes to <0.5 bytes/sample, a noisy sensor reading
+# to ~4.8 (vs 16 raw). In SQLite, with row and index overhead, the
+# benchmark's noisy signal takes ~5.2 bytes/sample on disk vs ~109 for a row
+# per sample. Window scans decode at roughly the rate of row-per-sample reads,
+# not faster (see benchmarks/bench_timeseries.py).
+import struct
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+EPOCH = datetime(1970, 1, 1)
+
+# Default number of samples packed into one chunk row
+CHUNK_SIZE = 1024
+
+# (control bits, control length, value bits) buckets for delta-of-delta
+_DOD_BUCKETS = (
+    (0b10, 2, 7),
+    (0b110, 3, 9),
+    (0b1110, 4, 12),
+)
+_DOD_FALLBACK = (0b1111, 4, 64)
+
+Sample = Tuple[datetime, float]
+
+
+def to_millis(ts: datetime) -> int:
+    """Convert a naive UTC datetime to integer milliseconds since the epoch"""
+    return (ts - EPOCH) // timedelta(milliseconds=1)
+
+
+def from_millis(ms: int) -> datetime:
+    """Convert integer milliseconds since the epoch to a naive UTC datetime"""
+    return EPOCH + timedelta(0, 0, ms * 1000)  # Positional microseconds: cheapest timedelta to build
+
+
+_DOUBLE = struct.Struct(">d")
+_UINT64 = struct.Struct(">Q")
+
+
+def _float_bits(value: float) -> int:
+    return _UINT64.unpack(_DOUBLE.pack(value))[0]
+
+
+def _bits_float(bits: int) -> float:
+    return _DOUBLE.unpack(_UINT64.pack(bits))[0]
+
+
+class BitWriter:
+    """Append-only bit buffer"""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._acc = 0
+        self._nbits = 0
+
+    def write(self, value: int, nbits: int):
+        self._acc = (self._acc << nbits) | (value & ((1 << nbits) - 1))
+        self._nbits += nbits
+        while self._nbits >= 8:
+            self._nbits -= 8
+            self._buf.append((self._acc >> self._nbits) & 0xFF)
+        self._acc &= (1 << self._nbits) - 1
+
+    def getvalue(self) -> bytes:
+        if self._nbits:
+            return bytes(self._buf) + bytes([(self._acc << (8 - self._nbits)) & 0xFF])
+        return bytes(self._buf)
+
+
+class BitReader:
+    """Sequential reader over a bit buffer produced by BitWriter"""
+
+    def __init__(self, data: bytes):
+        self._data = bytes(data)
+        self._pos = 0
+
+    def read(self, nbits: int) -> int:
+        end = self._pos + nbits
+        first, last = self._pos >> 3, (end + 7) >> 3
+        if last > len(self._data):
+            raise ValueError("Read past the end of the chunk")
+        window = int.from_bytes(self._data[first:last], "big")
+        self._pos = end
+        return (window >> ((last << 3) - end)) & ((1 << nbits) - 1)
+
+    def read_bit(self) -> bool:
+        pos = self._pos
+        self._pos += 1
+        return bool((self._data[pos >> 3] >> (7 - (pos & 7))) & 1)
+
+
+def encode_chunk(samples: List[Sample]) -> bytes:
+    """Encode time-ordered (timestamp, value) samples into a compressed block"""
+    writer = BitWriter()
+    if not samples:
+        return writer.getvalue()
+
+    first_ts = to_millis(samples[0][0])
+    first_bits = _float_bits(samples[0][1])
+    writer.write(first_ts, 64)  # Two's complement, so pre-1970 timestamps round-trip
+    writer.write(first_bits, 64)
+
+    prev_ts, prev_delta = first_ts, 0
+    prev_bits = first_bits
+    prev_leading, prev_trailing = -1, -1
+
+    for ts, value in samples[1:]:
+        # --- timestamp: delta of delta ---
+        ts_ms = to_millis(ts)
+        delta = ts_ms - prev_ts
+        dod = delta - prev_delta
+        if dod == 0:
+            writer.write(0, 1)
+        else:
+            for control, control_len, nbits in _DOD_BUCKETS:
+                if -(1 << (nbits - 1)) < dod <= (1 << (nbits - 1)):
+                    break
+            else:
+                control, control_len, nbits = _DOD_FALLBACK
+            writer.write(control, control_len)
+            writer.write(dod, nbits)
+        prev_ts, prev_delta = ts_ms, delta
+
+        # --- value: XOR with previous ---
+        bits = _float_bits(value)
+        xor = bits ^ prev_bits
+        if xor == 0:
+            writer.write(0, 1)
+        else:
+            leading = min(64 - xor.bit_length(), 31)
+            trailing = (xor & -xor).bit_length() - 1
+            if prev_leading >= 0 and leading >= prev_leading and trailing >= prev_trailing:
+                # Meaningful bits fit in the previous window
+                writer.write(0b10, 2)
+                writer.write(xor >> prev_trailing, 64 - prev_leading - prev_trailing)
+            else:
+                meaningful = 64 - leading - trailing
+                writer.write(0b11, 2)
+                writer.write(leading, 5)
+                writer.write(meaningful - 1, 6)
+                writer.write(xor >> trailing, meaningful)
+                prev_leading, prev_trailing = leading, trailing
+        prev_bits = bits
+
+    return writer.getvalue()
+
+
+def iter_chunk(data: bytes, count: int, start_ms: Optional[int] = None,
+               end_ms: Optional[int] = None) -> Iterator[Tuple[int, float]]:
+    """Yield (epoch millis, value) from a block, keeping only [start_ms, end_ms].
+
+    Samples in a chunk are time-ordered, so decoding stops at the first
+    sample past `end_ms`. This is the scan hot path, so bits are read
+    inline with integer shifts instead of through BitReader.
+    """
+    if count <= 0:
+        return
+    if len(data) < 16:
+        raise ValueError("Chunk is too short")
+
+    ts_ms = int.from_bytes(data[:8], "big")
+    if ts_ms >= 1 << 63:
+        ts_ms -= 1 << 64
+    bits = int.from_bytes(data[8:16], "big")
+    pos = 128
+    from_bytes = int.from_bytes
+    unpack = _DOUBLE.unpack
+    pack = _UINT64.pack
+
+    def read(nbits):
+        end = pos + nbits
+        last = (end + 7) >> 3
+        return (from_bytes(data[pos >> 3:last], "big") >> ((last << 3) - end)) & ((1 << nbits) - 1)
+
+    delta = 0
+    leading, trailing = 0, 0
+    for i in range(count):
+        if i:
+            # --- timestamp: 0 | 10 + 7 bits | 110 + 9 | 1110 + 12 | 1111 + 64 ---
+            if (data[pos >> 3] >> (7 - (pos & 7))) & 1:
+                control = read(4)  # A leading 1 is always followed by at least 8 more bits
+                if control < 0b1100:
+                    nbits, pos = 7, pos + 2
+                elif control < 0b1110:
+                    nbits, pos = 9, pos + 3
+                elif control == 0b1110:
+                    nbits, pos = 12, pos + 4
+                else:
+                    nbits, pos = 64, pos + 4
+                dod = read(nbits)
+                pos += nbits
+                if dod > (1 << (nbits - 1)):
+                    dod -= 1 << nbits
+                delta += dod
+            else:
+                pos += 1
+            ts_ms += delta
+
+            # --- value: 0 | 10 + bits in previous window | 11 + 5 + 6 + bits ---
+            if (data[pos >> 3] >> (7 - (pos & 7))) & 1:
+                pos += 1
+                if (data[pos >> 3] >> (7 - (pos & 7))) & 1:
+                    pos += 1
+                    header = read(11)
+                    pos += 11
+                    leading = header >> 6
+                    trailing = 64 - leading - (header & 0x3F) - 1
+                else:
+                    pos += 1
+                nbits = 64 - leading - trailing
+                bits ^= read(nbits) << trailing
+                pos += nbits
+            else:
+                pos += 1
+
+        if end_ms is not None and ts_ms > end_ms:
+            return
+        if start_ms is None or ts_ms >= start_ms:
+            yield ts_ms, unpack(pack(bits))[0]
+
+
+def decode_chunk(data: bytes, count: int, start: Optional[datetime] = None,
+                 end: Optional[datetime] = None) -> List[Sample]:
+    """Decode `count` samples from a block produced by encode_chunk, optionally only [start, end]"""
+    start_ms = to_millis(start) if start is not None else None
+    end_ms = to_millis(end) if end is not None else None
+    return [(from_millis(ms), value) for ms, value in iter_chunk(data, count, start_ms, end_ms)]
+
+
+def split_chunks(samples: Iterable[Sample], chunk_size: int = CHUNK_SIZE) -> List[List[Sample]]:
+    """Sort samples by time and split them into chunk-sized lists"""
+    ordered = sorted(samples, key=lambda s: s[0])
+    return [ordered[i:i + chunk_size] for i in range(0, len(ordered), chunk_size)]
+
+
+def downsample_millis(points: Iterable[Tuple[int, float]], bucket_ms: int, origin_ms: int) -> List[Sample]:
+    """Average time-ordered (epoch millis, value) points into buckets aligned to `origin_ms`"""
+    result = []
+    current, total, n = None, 0.0, 0
+    for ms, value in points:
+        bucket = (ms - origin_ms) // bucket_ms
+        if bucket != current:
+            if n:
+                result.append((from_millis(origin_ms + current * bucket_ms), total / n))
+            current, total, n = bucket, 0.0, 0
+        total += value
+        n += 1
+    if n:
+        result.append((from_millis(origin_ms + current * bucket_ms), total / n))
+    return result
+
+
+def downsample(samples: List[Sample], bucket_seconds: float, start: Optional[datetime] = None) -> List[Sample]:
+    """Average samples into fixed-width time buckets aligned to `start`"""
+    if not samples or bucket_seconds <= 0:
+        return samples
+
+    origin = to_millis(start) if start is not None else to_millis(samples[0][0])
+    return downsample_millis(((to_millis(ts), value) for ts, value in samples), int(bucket_seconds * 1000), origin)
@@ -0,0 +1,8 @@
+# Initialize the metrics package
+from .registry import REGISTRY, Registry, Counter, Gauge, Histogram, DEFAULT_BUCKETS
+from .asgi import MetricsMiddleware, instrument_app
+
+__all__ = [
+    "REGISTRY", "Registry", "Counter", "Gauge", "Histogram", "DEFAULT_BUCKETS",
+    "MetricsMiddleware", "instrument_app"
+]
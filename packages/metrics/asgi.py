@@ -0,0 +1,57 @@
+# FastAPI/ASGI integration: per-route request latency and a /metrics endpoint
+import time
+
+from .registry import REGISTRY, Counter, Histogram, Registry
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route")
+)
+REQUESTS_TOTAL = Counter(
+    "http_requests_total", "HTTP requests by route and status code", ("method", "route", "status")
+)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware timing every HTTP request.
+
+    Requests are labelled with the matched route template (e.g.
+    /pump/{name}/on) rather than the raw path, keeping cardinality bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.labels(scope["method"], route).observe(time.perf_counter() - start)
+            REQUESTS_TOTAL.labels(scope["method"], route, str(status)).inc()
+
+
+def instrument_app(app, registry: Registry = REGISTRY):
+    """Add request timing middleware and a GET /metrics endpoint to a FastAPI app"""
+    from fastapi.responses import Response
+
+    def metrics():
+        return Response(registry.render(), media_type=CONTENT_TYPE)
+
+    app.add_middleware(MetricsMiddleware)
+    app.add_api_route("/metrics", metrics, methods=["GET"], include_in_schema=False)
+    return app
@@ -1,4 +1,6 @@
 # Initialize the secrets package
-from .manager import get_secret
+from .manager import get_secret, DB_USER_SECRET, DB_PASSWORD_SECRET, DB_NAME_SECRET, DB_REPLICA_HOSTS_SECRET
 
-__all__ = ["get_secret"]
\ No newline at end of file
+__all__ = [
+    "get_secret", "DB_USER_SECRET", "DB_PASSWORD_SECRET", "DB_NAME_SECRET", "DB_REPLICA_HOSTS_SECRET"
+]
\ No newline at end of file
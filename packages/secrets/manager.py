@@ -1,8 +1,11 @@
 # Secret management module
 import os
 import logging
-from google.cloud import secretmanager
-from google.api_core.exceptions import NotFound, PermissionDenied, ResourceExhausted
+try:
+    from google.cloud import secretmanager
+    from google.api_core.exceptions import NotFound, PermissionDenied, ResourceExhausted
+except ImportError:  # Local development/benchmarks without the Google Cloud SDK
+    secretmanager = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -12,6 +15,7 @@ logger = logging.getLogger(__name__)
 DB_USER_SECRET = "db-user"
 DB_PASSWORD_SECRET = "db-password"
 DB_NAME_SECRET = "db-name"
+DB_REPLICA_HOSTS_SECRET = "db-replica-hosts"
 
 def get_secret(secret_name, default=None):
     """Retrieve secret from Secret Manager.
@@ -28,6 +32,9 @@ def get_secret(secret_name, default=None):
     if not project_id:
         logger.warning("GOOGLE_CLOUD_PROJECT environment variable not set. Cannot access Secret Manager.")
         return default
+    if secretmanager is None:
+        logger.warning("google-cloud-secret-manager is not installed. Cannot access Secret Manager.")
+        return default
 
     try:
         client = secretmanager.SecretManagerServiceClient()
@@ -0,0 +1,4 @@
+# Initialize the web package: HTTP helpers shared by the services
+from .conditional import etag_matches
+
+__all__ = ["etag_matches"]
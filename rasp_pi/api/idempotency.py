@@ -0,0 +1,110 @@
+# idempotency.py - Idempotency-Key result cache and single-flight for pump commands
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+class _Call:
+    """A forwarded call that concurrent identical requests wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class IdempotencyConflict(Exception):
+    """An Idempotency-Key was reused for a different request"""
+
+class CommandTimeout(Exception):
+    """A duplicate command gave up waiting for the identical call in flight"""
+
+def _fresh(error: BaseException) -> BaseException:
+    """A copy of `error` for one waiter: an exception object must not be raised in several threads"""
+    try:
+        return copy.copy(error)
+    except Exception:
+        return RuntimeError(f"Shared call failed: {error!r}")
+
+class CommandDeduplicator:
+    """Collapses duplicate commands into one call.
+
+    - Single-flight: identical requests (same `request` key) that arrive
+      while one is in progress wait for it and share its result.
+    - Idempotency keys: successful results are remembered per
+      Idempotency-Key for `ttl` seconds (at most `max_entries`, least
+      recently used evicted first), so a client retrying a timed-out
+      request gets the original result instead of a second command.
+
+    Waiters give up with CommandTimeout after `wait_timeout` seconds.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0, wait_timeout: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._results: "OrderedDict[str, Tuple[float, Hashable, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, key: str, request: Hashable, now: float):
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        expires, cached_request, result = entry
+        if expires <= now:
+            del self._results[key]
+            return None
+        if cached_request != request:
+            raise IdempotencyConflict(f"Idempotency-Key {key!r} was already used for a different request")
+        self._results.move_to_end(key)
+        return entry
+
+    def run(self, request: Hashable, fn: Callable[[], Any], idempotency_key: Optional[str] = None) -> Tuple[Any, str]:
+        """Run fn once for concurrent/retried duplicates.
+
+        Returns (result, source) where source is "executed", "shared"
+        (joined an in-flight call) or "replayed" (from the key cache).
+        Exceptions are shared with waiters (each gets its own copy) but
+        never cached.
+        """
+        with self._lock:
+            if idempotency_key is not None:
+                entry = self._cached(idempotency_key, request, time.monotonic())
+                if entry is not None:
+                    return entry[2], "replayed"
+            call = self._inflight.get(request)
+            leader = call is None
+            if leader:
+                call = self._inflight[request] = _Call()
+
+        if not leader:
+            if not call.done.wait(self.wait_timeout):
+                raise CommandTimeout(f"An identical command is still in progress after {self.wait_timeout}s")
+            if call.error is not None:
+                raise _fresh(call.error)
+            self._remember(idempotency_key, request, call.result)
+            return call.result, "shared"
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[request]
+            call.done.set()
+
+        self._remember(idempotency_key, request, call.result)
+        return call.result, "executed"
+
+    def _remember(self, key: Optional[str], request: Hashable, result: Any):
+        if key is None:
+            return
+        with self._lock:
+            self._results[key] = (time.monotonic() + self.ttl, request, result)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
@@ -1,12 +1,48 @@
 import uvicorn
 import os
+import time
 import requests
-from fastapi import FastAPI, HTTPException
+from typing import Any, Dict, Optional
+from fastapi import Body, FastAPI, Header, HTTPException, Response
+from idempotency import CommandDeduplicator, CommandTimeout, IdempotencyConflict
+from packages.metrics import Counter, Histogram, instrument_app
 
 app = FastAPI()
+instrument_app(app)
 
 # Get the pump_api URL from environment variable or use default
 PUMP_API_URL = os.environ.get("PUMP_API_URL", "http://pump-master:8001")
+# Connect and read timeout for each request to pump_api
+PUMP_API_TIMEOUT_SECONDS = float(os.environ.get("PUMP_API_TIMEOUT_SECONDS", "5"))
+
+# How long results are replayed for a repeated Idempotency-Key, and how many are kept
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "300"))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get("IDEMPOTENCY_MAX_KEYS", "1024"))
+# How long a duplicate command waits for the identical one in flight before answering 504
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", str(PUMP_API_TIMEOUT_SECONDS)))
+
+commands = CommandDeduplicator(max_entries=IDEMPOTENCY_MAX_KEYS, ttl=IDEMPOTENCY_TTL_SECONDS,
+                               wait_timeout=IDEMPOTENCY_WAIT_SECONDS)
+
+COMMANDS_TOTAL = Counter(
+    "pump_commands_total", "Pump commands by how they were served", ("source",)
+)
+
+FORWARD_SECONDS = Histogram(
+    "pump_api_forward_seconds", "Latency of requests forwarded to pump_api", ("endpoint", "outcome")
+)
+
+def forward(method: str, path: str, endpoint: str, **kwargs) -> requests.Response:
+    """Send a request to pump_api, recording its latency"""
+    kwargs.setdefault("timeout", PUMP_API_TIMEOUT_SECONDS)
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        response = requests.request(method, f"{PUMP_API_URL}{path}", **kwargs)
+        outcome = str(response.status_code)
+        return response
+    finally:
+        FORWARD_SECONDS.labels(endpoint, outcome).observe(time.perf_counter() - start)
 
 @app.get("/health")
 def health():
@@ -17,7 +53,7 @@ def health_check():
     """Check if both pi_api and pump_api are healthy."""
     try:
         # Check pump_api health
-        response = requests.get(f"{PUMP_API_URL}/health")
+        response = forward("GET", "/health", "health")
         response.raise_for_status()
         pump_status = response.json()
 
@@ -32,25 +68,105 @@ def health_check():
             "pump_api": {"status": "error", "message": str(e)}
         }
 
+def forward_command(path: str, endpoint: str, idempotency_key: Optional[str], response: Response):
+    """Forward a pump command, collapsing retries and concurrent duplicates into one call"""
+    def call():
+        try:
+            result = forward("POST", path, endpoint)
+            result.raise_for_status()
+            return result.json()
+        except requests.Timeout as e:
+            raise HTTPException(status_code=504, detail=f"Pump service timed out: {str(e)}")
+        except requests.RequestException as e:
+            raise HTTPException(status_code=503, detail=f"Error communicating with pump service: {str(e)}")
+
+    try:
+        result, source = commands.run(("POST", path), call, idempotency_key)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except CommandTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    COMMANDS_TOTAL.labels(source).inc()
+    if source == "replayed":
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
 @app.post("/pump/{name}/on")
-def pump_on(name: str):
+def pump_on(name: str, response: Response, idempotency_key: Optional[str] = Header(None)):
     """Forward pump on request to pump_api."""
+    return forward_command(f"/pump/{name}/on", "pump_on", idempotency_key, response)
+
+@app.post("/pump/{name}/off")
+def pump_off(name: str, response: Response, idempotency_key: Optional[str] = Header(None)):
+    """Forward pump off request to pump_api."""
+    return forward_command(f"/pump/{name}/off", "pump_off", idempotency_key, response)
+
+def raise_for_client_error(response: requests.Response):
+    """Re-raise a pump_api error response with its status and detail"""
+    if response.status_code >= 400:
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        detail = body.get("detail", response.text) if isinstance(body, dict) else response.text
+        raise HTTPException(status_code=response.status_code, detail=detail)
+
+def forward_passthrough(method: str, path: str, endpoint: str, **kwargs):
+    """Forward to pump_api, passing its client errors (404/422) back unchanged"""
     try:
-        response = requests.post(f"{PUMP_API_URL}/pump/{name}/on")
-        response.raise_for_status()
-        return response.json()
+        response = forward(method, path, endpoint, **kwargs)
     except requests.RequestException as e:
         raise HTTPException(status_code=503, detail=f"Error communicating with pump service: {str(e)}")
+    raise_for_client_error(response)
+    return response.json()
 
-@app.post("/pump/{name}/off")
-def pump_off(name: str):
-    """Forward pump off request to pump_api."""
+@app.get("/schedules")
+def list_schedules():
+    """List the pump schedules stored on the Pi."""
+    return forward_passthrough("GET", "/schedules", "schedules")
+
+@app.get("/schedules/{schedule_id}")
+def get_schedule(schedule_id: int):
+    return forward_passthrough("GET", f"/schedules/{schedule_id}", "schedules")
+
+@app.post("/schedules", status_code=201)
+def create_schedule(body: Dict[str, Any] = Body(...)):
+    """Create a cron or interval schedule, e.g. {"pump": "flush_1", "cron": "0 6 * * *", "duration_seconds": 120}."""
+    return forward_passthrough("POST", "/schedules", "schedules", json=body)
+
+@app.put("/schedules/{schedule_id}")
+def update_schedule(schedule_id: int, body: Dict[str, Any] = Body(...)):
+    return forward_passthrough("PUT", f"/schedules/{schedule_id}", "schedules", json=body)
+
+@app.delete("/schedules/{schedule_id}")
+def delete_schedule(schedule_id: int):
+    return forward_passthrough("DELETE", f"/schedules/{schedule_id}", "schedules")
+
+@app.get("/pumps/config")
+def get_pump_config(response: Response, if_none_match: Optional[str] = Header(None)):
+    """The relay's versioned pump name -> pin map; If-None-Match gets a 304 when it hasn't changed."""
+    headers = {"If-None-Match": if_none_match} if if_none_match else {}
     try:
-        response = requests.post(f"{PUMP_API_URL}/pump/{name}/off")
-        response.raise_for_status()
-        return response.json()
+        result = forward("GET", "/pumps/config", "pump_config", headers=headers)
     except requests.RequestException as e:
         raise HTTPException(status_code=503, detail=f"Error communicating with pump service: {str(e)}")
+    etag = result.headers.get("ETag")
+    if result.status_code == 304:
+        return Response(status_code=304, headers={"ETag": etag} if etag else None)
+    raise_for_client_error(result)
+    if etag:
+        response.headers["ETag"] = etag
+    return result.json()
+
+@app.put("/pumps/config")
+def update_pump_config(body: Dict[str, Any] = Body(...)):
+    """Replace the pump map, e.g. {"version": 4, "pumps": {"ph_up": 12}}; the version must increase."""
+    return forward_passthrough("PUT", "/pumps/config", "pump_config", json=body)
+
+@app.post("/pumps/config/reload")
+def reload_pump_config():
+    """Re-read the pump map file on the Pi."""
+    return forward_passthrough("POST", "/pumps/config/reload", "pump_config")
 
 if __name__ == "__main__":
     uvicorn.run("pi_api:app", host="0.0.0.0", port=8000)
@@ -0,0 +1,81 @@
+# mcp_sim.py - Simulated MCP23017 for running the relay service off-device
+
+import threading
+import time
+
+class SimulatedMCP23017:
+    """In-memory stand-in for adafruit_mcp230xx.mcp23017.MCP23017.
+
+    Mirrors the parts of the Adafruit API the relay service uses (get_pin and
+    the 16-bit iodir/gpio registers). Every register read or write counts as
+    one I2C transaction and sleeps for `latency` seconds, so timings resemble
+    the real bus (~0.3ms per register access at 100kHz).
+    """
+
+    def __init__(self, latency: float = 0.0003):
+        self.latency = latency
+        self.transactions = 0
+        self._iodir = 0xFFFF  # Power-on default: all inputs
+        self._gpio = 0x0000
+        self._lock = threading.Lock()  # One transaction on the bus at a time
+
+    def _transaction(self):
+        with self._lock:
+            self.transactions += 1
+            if self.latency:
+                time.sleep(self.latency)
+
+    @property
+    def iodir(self) -> int:
+        self._transaction()
+        return self._iodir
+
+    @iodir.setter
+    def iodir(self, value: int):
+        self._transaction()
+        self._iodir = value & 0xFFFF
+
+    @property
+    def gpio(self) -> int:
+        self._transaction()
+        return self._gpio
+
+    @gpio.setter
+    def gpio(self, value: int):
+        self._transaction()
+        self._gpio = value & 0xFFFF
+
+    def get_pin(self, pin: int) -> "SimulatedPin":
+        if not 0 <= pin <= 15:
+            raise ValueError("Pin number must be 0-15.")
+        return SimulatedPin(self, pin)
+
+class SimulatedPin:
+    """Single pin; like the Adafruit DigitalInOut, each setter is a read-modify-write"""
+
+    def __init__(self, mcp: SimulatedMCP23017, pin: int):
+        self._mcp = mcp
+        self._mask = 1 << pin
+
+    @property
+    def direction(self) -> int:
+        return 0 if self._mcp.iodir & self._mask else 1
+
+    @direction.setter
+    def direction(self, value):
+        # Truthy = output, matching how RelayController configures pins
+        if value:
+            self._mcp.iodir = self._mcp.iodir & ~self._mask
+        else:
+            self._mcp.iodir = self._mcp.iodir | self._mask
+
+    @property
+    def value(self) -> bool:
+        return bool(self._mcp.gpio & self._mask)
+
+    @value.setter
+    def value(self, value: bool):
+        if value:
+            self._mcp.gpio = self._mcp.gpio | self._mask
+        else:
+            self._mcp.gpio = self._mcp.gpio & ~self._mask
@@ -1,18 +1,169 @@
+import time
+PROCESS_START = time.perf_counter()  # Before the heavier imports, for the startup budget
+
+import asyncio
+import logging
+import os
+import threading
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+from pump_map import PumpMap, PumpMapStore, StalePumpMap
 from pump_master import RelayController
+from scheduler import Schedule, Scheduler, ScheduleStore
+from packages.metrics import Gauge, instrument_app
+from packages.web import etag_matches
+
+logger = logging.getLogger(__name__)
+
+# Import-to-serving budget; exceeding it is logged so regressions get noticed
+STARTUP_BUDGET_MS = float(os.environ.get("STARTUP_BUDGET_MS", "500"))
+# Delay between hardware init attempts while the relay board is unavailable
+RELAY_INIT_RETRY_SECONDS = float(os.environ.get("RELAY_INIT_RETRY_SECONDS", "2"))
+# How long shutdown waits for the background threads before giving up on them
+SHUTDOWN_TIMEOUT_SECONDS = float(os.environ.get("SHUTDOWN_TIMEOUT_SECONDS", "5"))
+
+STARTUP_SECONDS = Gauge("pump_api_startup_seconds", "Time from process import to accepting requests")
+RELAY_INIT_SECONDS = Gauge("relay_init_seconds", "Time taken by the last successful relay initialization")
+READY = Gauge("pump_api_ready", "1 once the relay controller is initialized")
+
+relay: Optional[RelayController] = None
+relay_error: Optional[str] = None
+scheduler: Optional[Scheduler] = None
+pump_maps: Optional[PumpMapStore] = None
+stopping = threading.Event()
 
-app = FastAPI()
-relay = RelayController()
+def apply_pump_map(old: PumpMap, new: PumpMap):
+    """Reconfigure the relay board for a new pump map (before it is published)"""
+    if relay is not None:
+        relay.apply_pump_map(new.pumps)
+
+def in_daemon_thread(fn, *args) -> asyncio.Future:
+    """Run fn in a daemon thread and return a future for its result.
+
+    Unlike asyncio.to_thread, a call stuck on the I2C bus can't keep the
+    process from exiting (the default executor is joined at shutdown).
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(result=None, error=None):
+        if not future.done():
+            future.set_exception(error) if error is not None else future.set_result(result)
+
+    def run():
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            error, result = e, None
+        else:
+            error = None
+        try:
+            loop.call_soon_threadsafe(resolve, result, error)
+        except RuntimeError:
+            pass  # Loop already closed
+
+    threading.Thread(target=run, name=getattr(fn, "__name__", "worker"), daemon=True).start()
+    return future
+
+async def wait_background(name: str, future: asyncio.Future):
+    """Wait up to SHUTDOWN_TIMEOUT_SECONDS for a background thread to finish"""
+    try:
+        await asyncio.wait_for(future, SHUTDOWN_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.error(f"{name} did not stop within {SHUTDOWN_TIMEOUT_SECONDS}s, abandoning it")
+    except Exception as e:
+        logger.error(f"{name} failed: {e}")
+
+def init_relay():
+    """Initialize the relay board, retrying until it succeeds (runs in a worker thread)"""
+    global relay, relay_error
+    while relay is None and not stopping.is_set():
+        start = time.perf_counter()
+        try:
+            controller = RelayController(pump_maps.current.pumps)
+            # Publish under the map lock so a reload during init can't be lost
+            with pump_maps.lock:
+                controller.apply_pump_map(pump_maps.current.pumps)
+                relay = controller
+        except Exception as e:
+            relay_error = str(e)
+            logger.error(f"Relay init failed, retrying in {RELAY_INIT_RETRY_SECONDS}s: {e}")
+            stopping.wait(RELAY_INIT_RETRY_SECONDS)
+            continue
+        relay_error = None
+        RELAY_INIT_SECONDS.set(time.perf_counter() - start)
+        READY.set(1)
+        logger.info(f"Relay controller ready in {(time.perf_counter() - start) * 1000:.1f}ms")
+        if scheduler is not None:
+            scheduler.start(relay)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global relay, relay_error, scheduler, pump_maps
+    relay, relay_error = None, None
+    stopping.clear()
+    pump_maps = PumpMapStore(on_change=apply_pump_map)
+    scheduler = Scheduler(ScheduleStore(), valid_pumps=pump_maps)
+
+    # Hardware init runs in the background so the port binds immediately and
+    # /health answers while the I2C bus comes up; /ready reports when it is done.
+    init_task = in_daemon_thread(init_relay)
+    watch_task = in_daemon_thread(pump_maps.watch, stopping)
+
+    startup = time.perf_counter() - PROCESS_START
+    STARTUP_SECONDS.set(startup)
+    if startup * 1000 > STARTUP_BUDGET_MS:
+        logger.warning(f"Startup took {startup * 1000:.0f}ms, over the {STARTUP_BUDGET_MS:.0f}ms budget")
+    else:
+        logger.info(f"Serving after {startup * 1000:.0f}ms")
+
+    yield
+
+    stopping.set()
+    await wait_background("Relay init", init_task)
+    await wait_background("Pump map watcher", watch_task)
+    scheduler.stop(SHUTDOWN_TIMEOUT_SECONDS)
+    if relay is not None:
+        relay.cleanup()
+    READY.set(0)
+    scheduler.store.close()
+
+app = FastAPI(lifespan=lifespan)
+instrument_app(app)
+
+def get_relay() -> RelayController:
+    if relay is None:
+        raise HTTPException(503, "Relay controller is not ready")
+    return relay
 
 @app.get("/health")
 def health():
+    """Liveness: the process is up and serving requests"""
     return {"status": "ok"}
 
+@app.get("/ready")
+def ready():
+    """Readiness: the relay board is initialized and pumps can be switched"""
+    body = {
+        "status": "ready" if relay is not None else "starting",
+        "startup_ms": round(STARTUP_SECONDS.labels().value * 1000, 1),
+    }
+    if relay is None:
+        if relay_error:
+            body["error"] = relay_error
+        return JSONResponse(body, status_code=503)
+    body["relay_init_ms"] = round(RELAY_INIT_SECONDS.labels().value * 1000, 1)
+    return body
+
 @app.post("/pump/{name}/on")
 def pump_on(name: str):
     try:
-        relay.activate(name)
+        get_relay().activate(name)
         return {"pump": name, "state": "on"}
     except KeyError as e:
         raise HTTPException(404, str(e))
@@ -20,14 +171,113 @@ def pump_on(name: str):
 @app.post("/pump/{name}/off")
 def pump_off(name: str):
     try:
-        relay.deactivate(name)
+        get_relay().deactivate(name)
         return {"pump": name, "state": "off"}
     except KeyError as e:
         raise HTTPException(404, str(e))
 
-@app.on_event("shutdown")
-def cleanup():
-    relay.cleanup()
+# ----- Pump map -----
+
+class PumpMapIn(BaseModel):
+    version: int
+    pumps: Dict[str, int]
+
+def get_pump_maps() -> PumpMapStore:
+    if pump_maps is None:
+        raise HTTPException(503, "Pump map is not loaded")
+    return pump_maps
+
+def pump_map_response(pump_map: PumpMap, **extra) -> JSONResponse:
+    return JSONResponse({**pump_map.to_dict(), **extra}, headers={"ETag": pump_map.etag})
+
+@app.get("/pumps/config")
+def get_pump_config(if_none_match: Optional[str] = Header(None)):
+    """Current pump name -> pin map; send If-None-Match with the ETag to get a 304 if unchanged"""
+    pump_map = get_pump_maps().current
+    if etag_matches(if_none_match, pump_map.etag):
+        return Response(status_code=304, headers={"ETag": pump_map.etag})
+    return pump_map_response(pump_map)
+
+@app.put("/pumps/config")
+def put_pump_config(body: PumpMapIn):
+    """Replace the pump map; `version` must be higher than the current one"""
+    store = get_pump_maps()
+    try:
+        diff = store.update(PumpMap(body.pumps, body.version))
+    except StalePumpMap as e:
+        raise HTTPException(409, str(e))
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+    return pump_map_response(store.current, changes=diff)
+
+@app.post("/pumps/config/reload")
+def reload_pump_config():
+    """Re-read the pump map file now instead of waiting for the next poll"""
+    store = get_pump_maps()
+    try:
+        diff = store.reload()
+    except StalePumpMap as e:
+        raise HTTPException(409, str(e))
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+    return pump_map_response(store.current, changes=diff)
+
+# ----- Schedules -----
+
+class ScheduleIn(BaseModel):
+    pump: str
+    duration_seconds: float
+    cron: Optional[str] = None  # e.g. "0 6 * * *"
+    interval_seconds: Optional[float] = None
+    enabled: bool = True
+    catch_up: bool = True  # Run once after a reboot if a run was missed
+
+def get_scheduler() -> Scheduler:
+    if scheduler is None:
+        raise HTTPException(503, "Scheduler is not ready")
+    return scheduler
+
+def schedule_response(schedule: Schedule) -> dict:
+    scheduler = get_scheduler()
+    return {**schedule.to_dict(), "next_run": scheduler.next_run(schedule.id), "fault": scheduler.fault(schedule.pump)}
+
+@app.get("/schedules")
+def list_schedules():
+    return [schedule_response(s) for s in get_scheduler().all()]
+
+@app.get("/schedules/{schedule_id}")
+def get_schedule(schedule_id: int):
+    schedule = get_scheduler().get(schedule_id)
+    if schedule is None:
+        raise HTTPException(404, f"Schedule {schedule_id} not found")
+    return schedule_response(schedule)
+
+@app.post("/schedules", status_code=201)
+def create_schedule(body: ScheduleIn):
+    try:
+        return schedule_response(get_scheduler().add(Schedule(**dict(body))))
+    except KeyError as e:
+        raise HTTPException(404, str(e))
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+
+@app.put("/schedules/{schedule_id}")
+def update_schedule(schedule_id: int, body: ScheduleIn):
+    try:
+        schedule = get_scheduler().update(schedule_id, Schedule(**dict(body)))
+    except KeyError as e:
+        raise HTTPException(404, str(e))
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+    if schedule is None:
+        raise HTTPException(404, f"Schedule {schedule_id} not found")
+    return schedule_response(schedule)
+
+@app.delete("/schedules/{schedule_id}")
+def delete_schedule(schedule_id: int):
+    if not get_scheduler().remove(schedule_id):
+        raise HTTPException(404, f"Schedule {schedule_id} not found")
+    return {"deleted": schedule_id}
 
 if __name__ == "__main__":
-    uvicorn.run("pump_api:app", host="0.0.0.0", port=8001)
\ No newline at end of file
+    uvicorn.run("pump_api:app", host="0.0.0.0", port=8001)
@@ -0,0 +1,190 @@
+# pump_map.py - Versioned pump name -> MCP23017 pin map, reloadable at runtime
+#
+# The map is read from PUMP_CONFIG_PATH, a JSON file like
+#     {"version": 3, "pumps": {"calcium_nitrate": 0, "ph_down": 3}}
+# falling back to pump_config.PUMPS (version 0) when the file doesn't exist.
+# The file is polled for changes. A new map is only accepted with a higher
+# version (or any version over the builtin map), and it replaces the old one
+# in a single swap.
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from types import MappingProxyType
+from typing import Callable, Dict, List, Optional
+
+from pump_config import PUMPS
+
+logger = logging.getLogger(__name__)
+
+PUMP_CONFIG_PATH = os.environ.get("PUMP_CONFIG_PATH", "/data/pump_config.json")
+PUMP_CONFIG_POLL_SECONDS = float(os.environ.get("PUMP_CONFIG_POLL_SECONDS", "5"))
+
+def validate_pumps(pumps: Dict[str, int]):
+    """Raise ValueError unless every name is non-empty and every pin is a distinct 0-15"""
+    if not isinstance(pumps, dict):
+        raise ValueError("pumps must be an object of name -> pin")
+    seen = {}
+    for name, pin in pumps.items():
+        if not isinstance(name, str) or not name:
+            raise ValueError(f"Invalid pump name: {name!r}")
+        if not isinstance(pin, int) or isinstance(pin, bool) or not 0 <= pin <= 15:
+            raise ValueError(f"Pin for {name} must be 0-15, got {pin!r}")
+        if pin in seen:
+            raise ValueError(f"Pin {pin} is used by both {seen[pin]} and {name}")
+        seen[pin] = name
+
+class StalePumpMap(ValueError):
+    """A pump map whose version is not newer than the current one"""
+
+class PumpMap:
+    """Immutable snapshot of the pump map"""
+
+    def __init__(self, pumps: Dict[str, int], version: int = 0, source: str = "builtin"):
+        validate_pumps(pumps)
+        if not isinstance(version, int) or version < 0:
+            raise ValueError(f"version must be a non-negative integer, got {version!r}")
+        self.pumps = MappingProxyType(dict(pumps))
+        self.version = version
+        self.source = source
+        canonical = json.dumps({"version": version, "pumps": dict(sorted(pumps.items()))})
+        self.etag = f'"{version}-{hashlib.sha1(canonical.encode()).hexdigest()[:12]}"'
+
+    def to_dict(self) -> Dict:
+        return {"version": self.version, "pumps": dict(self.pumps), "source": self.source}
+
+    def diff(self, new: "PumpMap") -> Dict[str, List[str]]:
+        """Pump names added, removed or moved to another pin in `new`"""
+        return {
+            "added": sorted(new.pumps.keys() - self.pumps.keys()),
+            "removed": sorted(self.pumps.keys() - new.pumps.keys()),
+            "remapped": sorted(n for n in self.pumps.keys() & new.pumps.keys() if self.pumps[n] != new.pumps[n]),
+        }
+
+def load_pump_map(path: str = PUMP_CONFIG_PATH) -> PumpMap:
+    """The map in `path`, or pump_config.PUMPS if there is no file"""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return PumpMap(PUMPS)
+    if not isinstance(data, dict):
+        raise ValueError(f"{path} must contain an object with version and pumps")
+    return PumpMap(data.get("pumps"), data.get("version", 0), source=path)
+
+def write_pump_map_tmp(pump_map: PumpMap, path: str = PUMP_CONFIG_PATH) -> str:
+    """Write the map next to `path`; returns the temp file to os.replace() over it"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"version": pump_map.version, "pumps": dict(pump_map.pumps)}, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp
+
+def save_pump_map(pump_map: PumpMap, path: str = PUMP_CONFIG_PATH):
+    """Write the map atomically so a reader never sees a half-written file"""
+    tmp = write_pump_map_tmp(pump_map, path)
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        os.remove(tmp)
+        raise
+
+class PumpMapStore:
+    """The current pump map; `in` checks pump names against it.
+
+    on_change(old, new) is called with the lock held before the new map is
+    published, so it can reconfigure hardware; if it raises, the old map stays.
+    """
+
+    def __init__(self, path: str = PUMP_CONFIG_PATH, on_change: Optional[Callable[[PumpMap, PumpMap], None]] = None):
+        self.path = path
+        self.on_change = on_change
+        self.lock = threading.RLock()
+        self.current = load_pump_map(path)
+        self._mtime = self._stat()
+        logger.info(f"Pump map version {self.current.version} from {self.current.source}: {len(self.current.pumps)} pumps")
+
+    def __contains__(self, pump_name: str) -> bool:
+        return pump_name in self.current.pumps
+
+    def _stat(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def publish(self, new: PumpMap) -> Dict[str, List[str]]:
+        """Swap in `new` (which must have a higher version); returns the diff"""
+        with self.lock:
+            old = self.current
+            if new.etag == old.etag:
+                return {"added": [], "removed": [], "remapped": []}
+            # Same version, different pumps: only a file replacing the builtin map (both version 0) is newer
+            if new.version < old.version or (new.version == old.version and old.source != "builtin"):
+                raise StalePumpMap(f"Pump map version {new.version} is not newer than {old.version}")
+            if self.on_change is not None:
+                self.on_change(old, new)
+            self.current = new
+        diff = old.diff(new)
+        logger.info(f"Pump map updated to version {new.version}: {diff}")
+        return diff
+
+    def reload(self) -> Dict[str, List[str]]:
+        """Re-read the file; a missing file keeps the current map"""
+        with self.lock:
+            self._mtime = self._stat()
+            if self._mtime is None:
+                return {"added": [], "removed": [], "remapped": []}
+            return self.publish(load_pump_map(self.path))
+
+    def update(self, new: PumpMap) -> Dict[str, List[str]]:
+        """Persist `new` to the file, then publish it.
+
+        The file is replaced atomically before the relays are reconfigured, so
+        the hardware never runs a map that isn't on disk. If the write fails
+        nothing changes; if publishing fails (stale map, relay error) the old
+        file is put back.
+        """
+        with self.lock:
+            new = PumpMap(dict(new.pumps), new.version, source=self.path)
+            try:
+                with open(self.path, "rb") as f:
+                    previous = f.read()
+            except FileNotFoundError:
+                previous = None
+            save_pump_map(new, self.path)
+            try:
+                return self.publish(new)
+            except BaseException:
+                self._restore(previous)
+                raise
+            finally:
+                self._mtime = self._stat()  # Our own write isn't a change for watch()
+
+    def _restore(self, previous: Optional[bytes]):
+        """Put back the file contents update() replaced (None: there was no file)"""
+        try:
+            if previous is None:
+                os.remove(self.path)
+                return
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(previous)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.error(f"Restoring {self.path} after a failed update failed, it is ahead of the running map: {e}")
+
+    def watch(self, stopping: threading.Event, interval: float = PUMP_CONFIG_POLL_SECONDS):
+        """Reload whenever the file changes, until `stopping` is set (runs in a worker thread)"""
+        while not stopping.wait(interval):
+            if self._stat() == self._mtime:
+                continue
+            try:
+                self.reload()
+            except (OSError, ValueError) as e:
+                logger.error(f"Ignoring pump map change in {self.path}: {e}")
+            except Exception as e:
+                logger.error(f"Applying pump map from {self.path} failed: {e}")
@@ -1,38 +1,130 @@
 # relay_controller.py
 
-import board
-import busio
-from adafruit_mcp230xx.mcp23017 import MCP23017
+import logging
+import os
+import threading
+import time
 from pump_config import PUMPS
+from packages.metrics import Counter, Histogram
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# "mcp23017" drives the real board; "simulated" runs without hardware
+RELAY_BACKEND = os.environ.get("RELAY_BACKEND", "mcp23017")
+SIM_I2C_LATENCY_MS = float(os.environ.get("SIM_I2C_LATENCY_MS", "0.3"))
+
+I2C_WRITE_SECONDS = Histogram("relay_i2c_write_seconds", "MCP23017 I2C write duration", ("operation",))
+I2C_ERRORS = Counter("relay_i2c_errors_total", "Failed MCP23017 I2C writes", ("operation",))
+
+def create_mcp(backend: str = RELAY_BACKEND):
+    """Create the MCP23017 driver for the configured backend"""
+    if backend == "simulated":
+        from mcp_sim import SimulatedMCP23017
+        return SimulatedMCP23017(latency=SIM_I2C_LATENCY_MS / 1000)
+    if backend != "mcp23017":
+        raise ValueError(f"Unknown relay backend: {backend}")
+
+    # Hardware libraries are only importable on the Pi
+    import board
+    import busio
+    from adafruit_mcp230xx.mcp23017 import MCP23017
+
+    # Initialize I2C bus and MCP23017
+    i2c = busio.I2C(board.SCL, board.SDA)
+    return MCP23017(i2c)
+
+def pin_mask(pins) -> int:
+    """16-bit register mask with a bit set for every pin"""
+    mask = 0
+    for pin in pins:
+        mask |= 1 << pin
+    return mask
 
 class RelayController:
-    def __init__(self, pump_map=PUMPS):
-        self.pump_map = pump_map
+    """Drives active-LOW relays on an MCP23017.
 
-        # Initialize I2C bus and MCP23017
-        i2c = busio.I2C(board.SCL, board.SDA)
-        self.mcp = MCP23017(i2c)
+    The output latch for all 16 pins is shadowed in memory, so every state
+    change is a single 16-bit GPIO register write instead of a per-pin
+    read-modify-write.
+    """
 
-        # Configure all pins as outputs and set to HIGH (relays off)
-        for pin in pump_map.values():
-            self.mcp.get_pin(pin).direction = 1  # Set as output (1)
-            self.mcp.get_pin(pin).value = True   # Set HIGH (True) for active-LOW relays
+    def __init__(self, pump_map=PUMPS, mcp=None):
+        self.pump_map = dict(pump_map)
+        self.mcp = mcp if mcp is not None else create_mcp()
+        self._lock = threading.RLock()
+        self._relay_mask = pin_mask(pump_map.values())
 
-    def activate(self, pump_name: str):
+        # Latch every output HIGH (relays off) first, then switch the relay
+        # pins to outputs, so no relay can glitch on during init. Two
+        # register writes regardless of how many pumps are configured.
+        self._outputs = 0xFFFF
+        self._write_register("gpio", self._outputs, "init")
+        self._write_register("iodir", 0xFFFF & ~self._relay_mask, "init")  # 0 = output
+
+    def _write_register(self, register: str, value: int, operation: str):
+        start = time.perf_counter()
+        try:
+            setattr(self.mcp, register, value)
+        except Exception:
+            I2C_ERRORS.labels(operation).inc()
+            raise
+        finally:
+            I2C_WRITE_SECONDS.labels(operation).observe(time.perf_counter() - start)
+
+    def _update_outputs(self, clear: int = 0, set_: int = 0, operation: str = "write"):
+        """Clear then set bits in the output latch with one register write"""
+        with self._lock:
+            outputs = (self._outputs & ~clear) | set_
+            self._write_register("gpio", outputs, operation)
+            self._outputs = outputs
+
+    def _pin(self, pump_name: str) -> int:
         pin = self.pump_map.get(pump_name)
         if pin is None:
             raise KeyError(f"Unknown pump: {pump_name}")
-        self.mcp.get_pin(pin).value = False  # Set LOW (False) to activate relay
-        print(f"→ {pump_name} ON")
+        return pin
+
+    def activate(self, pump_name: str):
+        # Pin lookup under the lock so a pump map swap can't land in between
+        with self._lock:
+            self._update_outputs(clear=1 << self._pin(pump_name), operation="activate")  # Set LOW to activate relay
+        logger.info(f"→ {pump_name} ON")
 
     def deactivate(self, pump_name: str):
-        pin = self.pump_map.get(pump_name)
-        if pin is None:
-            raise KeyError(f"Unknown pump: {pump_name}")
-        self.mcp.get_pin(pin).value = True   # Set HIGH (True) to deactivate relay
-        print(f"→ {pump_name} OFF")
+        with self._lock:
+            self._update_outputs(set_=1 << self._pin(pump_name), operation="deactivate")  # Set HIGH to deactivate relay
+        logger.info(f"→ {pump_name} OFF")
+
+    def is_active(self, pump_name: str) -> bool:
+        return not self._outputs & (1 << self._pin(pump_name))
+
+    def apply_pump_map(self, pump_map):
+        """Switch to a new pump map, touching only pins whose assignment changed.
+
+        Pins that are added, removed or given to another pump are switched
+        off; pumps on unchanged pins keep running. At most one GPIO write
+        (only if a changed pin was on) and one IODIR write (only if the set
+        of relay pins changed), however many pumps changed.
+        """
+        new_mask = pin_mask(pump_map.values())
+        with self._lock:
+            old = self.pump_map
+            changed = {pin for name, pin in old.items() if pump_map.get(name) != pin}
+            changed |= {pin for name, pin in pump_map.items() if old.get(name) != pin}
+
+            outputs = self._outputs | pin_mask(changed)
+            if outputs != self._outputs:
+                self._write_register("gpio", outputs, "reconfigure")
+                self._outputs = outputs
+            if new_mask != self._relay_mask:
+                # Unused pins go back to inputs; new relay pins were latched HIGH above/at init
+                self._write_register("iodir", 0xFFFF & ~new_mask, "reconfigure")
+                self._relay_mask = new_mask
+            self.pump_map = dict(pump_map)
+        if changed:
+            logger.info(f"Reconfigured relay pins {sorted(changed)}")
 
     def cleanup(self):
         # Set all pins HIGH to ensure all relays are off
-        for pin in self.pump_map.values():
-            self.mcp.get_pin(pin).value = True
+        self._update_outputs(set_=self._relay_mask, operation="cleanup")
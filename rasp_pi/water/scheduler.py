@@ -0,0 +1,448 @@
+# scheduler.py - Persistent on-Pi pump schedules (cron and fixed-interval)
+#
+# Schedules live in a local SQLite file so flushes and fills keep running when
+# the master or the WAN is down. Due times are kept in a min-heap, so the
+# scheduler thread sleeps until the next event instead of scanning every
+# schedule on a tick; pump stops are heap events too, so no thread is held
+# while a pump runs.
+
+import heapq
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_DB_PATH = os.environ.get("SCHEDULE_DB_PATH", "/data/schedules.db")
+# Runs missed by more than this (e.g. a long power cut) are skipped, not caught up
+CATCH_UP_WINDOW_SECONDS = float(os.environ.get("SCHEDULE_CATCH_UP_WINDOW_SECONDS", "21600"))
+# Upper bound on a single sleep so wall-clock jumps (NTP sync after boot) are noticed
+MAX_SLEEP_SECONDS = 60.0
+# A failed pump stop is retried after this delay, doubling up to STOP_RETRY_MAX_SECONDS
+STOP_RETRY_SECONDS = float(os.environ.get("SCHEDULE_STOP_RETRY_SECONDS", "1"))
+STOP_RETRY_MAX_SECONDS = float(os.environ.get("SCHEDULE_STOP_RETRY_MAX_SECONDS", "30"))
+# After this many failed stops in a row the pump is faulted: its schedules stop starting it
+STOP_FAULT_AFTER = int(os.environ.get("SCHEDULE_STOP_FAULT_AFTER", "3"))
+
+# ----- Cron expressions -----
+
+_FIELDS = (
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 7),  # 0 and 7 are both Sunday
+)
+
+def _parse_field(spec: str, name: str, low: int, high: int) -> Set[int]:
+    values = set()
+    for part in spec.split(","):
+        step = 1
+        if "/" in part:
+            part, step_spec = part.split("/", 1)
+            step = int(step_spec)
+            if step <= 0:
+                raise ValueError(f"Invalid step in cron {name} field: {step_spec}")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(v) for v in part.split("-", 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if not low <= start <= end <= high:
+            raise ValueError(f"Cron {name} field out of range: {spec}")
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronExpression:
+    """Standard 5-field cron expression: minute hour day-of-month month day-of-week"""
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Cron expression needs 5 fields, got {len(parts)}: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(spec, name, low, high) for spec, (name, low, high) in zip(parts, _FIELDS)
+        )
+        self.weekdays = {day % 7 for day in weekdays}
+        self._sorted_minutes = sorted(self.minutes)
+        # Like Vixie cron: if both day fields are restricted, either may match
+        self._day_restricted = parts[2] != "*"
+        self._weekday_restricted = parts[4] != "*"
+
+    def _day_matches(self, t: datetime) -> bool:
+        day_ok = t.day in self.days
+        weekday_ok = (t.isoweekday() % 7) in self.weekdays
+        if self._day_restricted and self._weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, after: datetime) -> datetime:
+        """First matching minute strictly after `after` (naive local time)"""
+        t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = after.year + 5
+        while t.year <= limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            else:
+                later = [m for m in self._sorted_minutes if m >= t.minute]
+                if later:
+                    return t.replace(minute=later[0])
+                t = t.replace(minute=0) + timedelta(hours=1)
+        raise ValueError(f"Cron expression never fires: {self.expression!r}")
+
+@lru_cache(maxsize=4096)
+def parse_cron(expression: str) -> CronExpression:
+    return CronExpression(expression)
+
+# ----- Storage -----
+
+@dataclass
+class Schedule:
+    pump: str
+    duration_seconds: float
+    cron: Optional[str] = None
+    interval_seconds: Optional[float] = None
+    enabled: bool = True
+    catch_up: bool = True
+    last_run: Optional[float] = None  # Epoch seconds of the last scheduled start
+    created_at: float = 0.0
+    id: Optional[int] = None
+
+    def validate(self):
+        if (self.cron is None) == (self.interval_seconds is None):
+            raise ValueError("Exactly one of cron or interval_seconds must be set")
+        if self.cron is not None:
+            parse_cron(self.cron).next_after(datetime.now())
+        elif self.interval_seconds <= 0:
+            raise ValueError("interval_seconds must be positive")
+        if self.duration_seconds <= 0:
+            raise ValueError("duration_seconds must be positive")
+
+    def next_fire_after(self, after: float) -> float:
+        """Next start time (epoch seconds) strictly after `after`"""
+        if self.cron is not None:
+            return parse_cron(self.cron).next_after(datetime.fromtimestamp(after)).timestamp()
+        anchor = self.last_run if self.last_run is not None else self.created_at
+        if anchor > after:
+            return anchor
+        periods = int((after - anchor) // self.interval_seconds) + 1
+        return anchor + periods * self.interval_seconds
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+_COLUMNS = ("id", "pump", "duration_seconds", "cron", "interval_seconds", "enabled", "catch_up",
+            "last_run", "created_at")
+
+class ScheduleStore:
+    """SQLite-backed schedule persistence"""
+
+    def __init__(self, path: str = SCHEDULE_DB_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS schedules (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    pump TEXT NOT NULL,
+                    duration_seconds REAL NOT NULL,
+                    cron TEXT,
+                    interval_seconds REAL,
+                    enabled INTEGER NOT NULL DEFAULT 1,
+                    catch_up INTEGER NOT NULL DEFAULT 1,
+                    last_run REAL,
+                    created_at REAL NOT NULL
+                )
+            """)
+
+    @staticmethod
+    def _row_to_schedule(row) -> Schedule:
+        data = dict(zip(_COLUMNS, row))
+        data["enabled"] = bool(data["enabled"])
+        data["catch_up"] = bool(data["catch_up"])
+        return Schedule(**data)
+
+    def all(self) -> List[Schedule]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM schedules ORDER BY id").fetchall()
+        return [self._row_to_schedule(row) for row in rows]
+
+    def get(self, schedule_id: int) -> Optional[Schedule]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM schedules WHERE id = ?", (schedule_id,)
+            ).fetchone()
+        return self._row_to_schedule(row) if row else None
+
+    def save(self, schedule: Schedule) -> Schedule:
+        values = (schedule.pump, schedule.duration_seconds, schedule.cron, schedule.interval_seconds,
+                  int(schedule.enabled), int(schedule.catch_up), schedule.last_run, schedule.created_at)
+        with self._lock, self._conn:
+            if schedule.id is None:
+                cursor = self._conn.execute(
+                    "INSERT INTO schedules (pump, duration_seconds, cron, interval_seconds, enabled, catch_up, "
+                    "last_run, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", values
+                )
+                schedule.id = cursor.lastrowid
+            else:
+                self._conn.execute(
+                    "UPDATE schedules SET pump = ?, duration_seconds = ?, cron = ?, interval_seconds = ?, "
+                    "enabled = ?, catch_up = ?, last_run = ?, created_at = ? WHERE id = ?",
+                    values + (schedule.id,)
+                )
+        return schedule
+
+    def set_last_run(self, schedule_id: int, last_run: float):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE schedules SET last_run = ? WHERE id = ?", (last_run, schedule_id))
+
+    def delete(self, schedule_id: int) -> bool:
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM schedules WHERE id = ?", (schedule_id,)).rowcount > 0
+
+    def close(self):
+        self._conn.close()
+
+# ----- Scheduler -----
+
+_START, _STOP = 0, 1
+
+class Scheduler:
+    """Fires schedules through a RelayController-like object (activate/deactivate)"""
+
+    def __init__(self, store: ScheduleStore, valid_pumps=None, clock=time.time):
+        self.store = store
+        self.valid_pumps = valid_pumps
+        self.clock = clock
+        self._schedules: Dict[int, Schedule] = {}
+        # Heap entries: (due, seq, kind, schedule_id or pump, version)
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._versions: Dict[int, int] = {}
+        self._running_until: Dict[str, float] = {}
+        self._stop_failures: Dict[str, int] = {}
+        self._faults: Dict[str, str] = {}  # Pump -> reason; faulted pumps are not started
+        self._cond = threading.Condition()
+        self._relay = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+        for schedule in store.all():
+            self._schedules[schedule.id] = schedule
+
+    # --- CRUD ---
+
+    def all(self) -> List[Schedule]:
+        with self._cond:
+            return sorted(self._schedules.values(), key=lambda s: s.id)
+
+    def get(self, schedule_id: int) -> Optional[Schedule]:
+        with self._cond:
+            return self._schedules.get(schedule_id)
+
+    def fault(self, pump: str) -> Optional[str]:
+        """Why the pump's schedules are suspended (it could not be stopped), or None"""
+        with self._cond:
+            return self._faults.get(pump)
+
+    def next_run(self, schedule_id: int) -> Optional[float]:
+        schedule = self.get(schedule_id)
+        if schedule is None or not schedule.enabled:
+            return None
+        return schedule.next_fire_after(max(self.clock(), schedule.last_run or 0))
+
+    def add(self, schedule: Schedule) -> Schedule:
+        self._check(schedule)
+        schedule.id = None
+        schedule.last_run = None
+        schedule.created_at = self.clock()
+        self.store.save(schedule)
+        with self._cond:
+            self._schedules[schedule.id] = schedule
+            self._push_next(schedule, self.clock())
+            self._cond.notify()
+        return schedule
+
+    def update(self, schedule_id: int, schedule: Schedule) -> Optional[Schedule]:
+        self._check(schedule)
+        with self._cond:
+            existing = self._schedules.get(schedule_id)
+            if existing is None:
+                return None
+            schedule.id = schedule_id
+            schedule.last_run = existing.last_run
+            schedule.created_at = existing.created_at
+            self.store.save(schedule)
+            self._schedules[schedule_id] = schedule
+            self._push_next(schedule, self.clock())
+            self._cond.notify()
+        return schedule
+
+    def remove(self, schedule_id: int) -> bool:
+        with self._cond:
+            if self._schedules.pop(schedule_id, None) is None:
+                return False
+            self._versions[schedule_id] = self._versions.get(schedule_id, 0) + 1  # Invalidate heap entries
+            self.store.delete(schedule_id)
+            return True
+
+    def _check(self, schedule: Schedule):
+        schedule.validate()
+        if self.valid_pumps is not None and schedule.pump not in self.valid_pumps:
+            raise KeyError(f"Unknown pump: {schedule.pump}")
+
+    # --- heap ---
+
+    def _push_next(self, schedule: Schedule, after: float):
+        """Queue the schedule's next start, superseding any queued one (call with the lock held)"""
+        version = self._versions.get(schedule.id, 0) + 1
+        self._versions[schedule.id] = version
+        if schedule.enabled:
+            due = schedule.next_fire_after(after)
+            heapq.heappush(self._heap, (due, next(self._seq), _START, schedule.id, version))
+
+    def _catch_up(self, now: float):
+        """Queue schedules after a restart, firing each missed run at most once"""
+        with self._cond:
+            for schedule in self._schedules.values():
+                if not schedule.enabled:
+                    continue
+                if schedule.last_run is not None and schedule.catch_up:
+                    missed = schedule.next_fire_after(schedule.last_run)
+                    if missed <= now and now - missed <= CATCH_UP_WINDOW_SECONDS:
+                        logger.info(f"Catching up missed run of schedule {schedule.id} ({schedule.pump})")
+                        version = self._versions.get(schedule.id, 0) + 1
+                        self._versions[schedule.id] = version
+                        # Queued at the missed slot, so interval schedules stay on their grid
+                        heapq.heappush(self._heap, (missed, next(self._seq), _START, schedule.id, version))
+                        continue
+                self._push_next(schedule, now)
+
+    # --- running ---
+
+    def start(self, relay, thread: bool = True):
+        """Start firing schedules on `relay` (after catching up missed runs).
+
+        With thread=False nothing fires until run_pending() is called.
+        """
+        self._relay = relay
+        self._catch_up(self.clock())
+        if thread:
+            self._thread = threading.Thread(target=self._run, name="pump-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the scheduler thread, waiting at most `timeout` seconds for a relay call in progress"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.error("Scheduler thread did not stop in time")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    now = self.clock()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    timeout = self._heap[0][0] - now if self._heap else MAX_SLEEP_SECONDS
+                    self._cond.wait(min(timeout, MAX_SLEEP_SECONDS))
+                if self._stopping:
+                    return
+            self.run_pending()
+
+    def run_pending(self) -> int:
+        """Fire every heap entry that is due now; returns the number of relay calls made"""
+        calls = 0
+        while True:
+            with self._cond:
+                now = self.clock()
+                if self._stopping or not self._heap or self._heap[0][0] > now:
+                    return calls
+                due, _, kind, key, version = heapq.heappop(self._heap)
+                action = self._prepare(kind, key, version, due, now)
+            if action is not None:
+                self._execute(*action)
+                calls += 1
+
+    def _prepare(self, kind: int, key, version: int, due: float, now: float):
+        """Update scheduler state for a due heap entry (lock held); returns the relay call to make"""
+        if kind == _STOP:
+            pump = key
+            if self._running_until.get(pump, 0) > now:
+                return None  # A later start extended the run
+            self._running_until.pop(pump, None)
+            return ("deactivate", pump, None)
+
+        schedule = self._schedules.get(key)
+        if schedule is None or self._versions.get(key) != version or not schedule.enabled:
+            return None
+        # Record the slot, not the (possibly late) fire time, so intervals don't drift
+        schedule.last_run = due
+        self._push_next(schedule, now)
+        if schedule.pump in self._faults:
+            logger.error(f"Skipping schedule {schedule.id}: {schedule.pump} is faulted ({self._faults[schedule.pump]})")
+            return None
+        until = now + schedule.duration_seconds
+        self._running_until[schedule.pump] = max(self._running_until.get(schedule.pump, 0), until)
+        heapq.heappush(self._heap, (until, next(self._seq), _STOP, schedule.pump, 0))
+        return ("activate", schedule.pump, (schedule.id, due))
+
+    def _execute(self, method: str, pump: str, run: Optional[tuple]):
+        try:
+            getattr(self._relay, method)(pump)
+        except KeyError as e:
+            logger.error(f"Scheduled {method} of {pump} failed: {e}")  # No longer in the pump map
+            return
+        except Exception as e:
+            if method == "deactivate":
+                self._stop_failed(pump, e)
+            else:
+                logger.error(f"Scheduled {method} of {pump} failed: {e}")
+            return
+
+        if method == "deactivate":
+            with self._cond:
+                if self._faults.pop(pump, None) is not None:
+                    logger.warning(f"{pump} stopped after {self._stop_failures[pump]} failed attempts; fault cleared")
+                self._stop_failures.pop(pump, None)
+        if run is not None:
+            try:
+                self.store.set_last_run(*run)
+            except Exception as e:
+                logger.error(f"Saving last run of schedule {run[0]} failed: {e}")
+
+    def _stop_failed(self, pump: str, error: Exception):
+        """Re-queue a failed stop with backoff, faulting the pump after STOP_FAULT_AFTER failures"""
+        with self._cond:
+            failures = self._stop_failures.get(pump, 0) + 1
+            self._stop_failures[pump] = failures
+            delay = min(STOP_RETRY_SECONDS * 2 ** (failures - 1), STOP_RETRY_MAX_SECONDS)
+            heapq.heappush(self._heap, (self.clock() + delay, next(self._seq), _STOP, pump, 0))
+            if failures >= STOP_FAULT_AFTER and pump not in self._faults:
+                self._faults[pump] = f"stop failed {failures} times: {error}"
+                logger.critical(f"{pump} may still be running: {self._faults[pump]}; "
+                                f"its schedules are suspended until a stop succeeds")
+            else:
+                logger.error(f"Scheduled stop of {pump} failed (attempt {failures}), retrying in {delay:.0f}s: {error}")
+            self._cond.notify()
@@ -0,0 +1,42 @@
+# conftest.py - Shared fixtures for the test suite
+#
+# packages.db reads DATABASE_URL at import time, so it is pointed at a
+# throwaway SQLite file before anything imports it. The services use flat,
+# same-directory imports, so their directories are put on sys.path.
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="verdant-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(WORKDIR, 'package.db')}")
+# The relay service runs on the simulated MCP23017, with its files in WORKDIR
+os.environ.setdefault("RELAY_BACKEND", "simulated")
+os.environ.setdefault("SIM_I2C_LATENCY_MS", "0")
+os.environ.setdefault("SCHEDULE_DB_PATH", os.path.join(WORKDIR, "schedules.db"))
+os.environ.setdefault("PUMP_CONFIG_PATH", os.path.join(WORKDIR, "pump_config.json"))
+
+for path in (ROOT, os.path.join(ROOT, "rasp_pi", "water"), os.path.join(ROOT, "rasp_pi", "api"),
+             os.path.join(ROOT, "api", "main")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+@pytest.fixture
+def db():
+    """A session on a fresh in-memory SQLite database"""
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from sqlalchemy import create_engine
+    from packages.db import Base
+    from packages.db.routing import RoutingSession
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
@@ -0,0 +1,88 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+import export_api
+from packages.db import PumpAction, PumpActivity, ShardRouter, crud
+from packages.db.export import COLUMNS, iter_pump_activity_batches
+from packages.db.routing import RoutingSession
+
+START = datetime(2024, 5, 1, 6, 0)
+
+@pytest.fixture
+def history(db):
+    """fill_1 on/off and ph_up on, a minute apart from START"""
+    pumps = {p.name: p for p in crud.initialize_pumps_from_config(db, {"fill_1": 8, "ph_up": 4})}
+    for minute, (pump, action, duration) in enumerate(
+            [("fill_1", PumpAction.ON, None), ("fill_1", PumpAction.OFF, 60.0), ("ph_up", PumpAction.ON, None)]):
+        db.add(PumpActivity(pump_id=pumps[pump].id, site_id=pumps[pump].site_id, action=action,
+                            timestamp=START + timedelta(minutes=minute), duration=duration))
+    db.commit()
+    return pumps
+
+@pytest.fixture
+def client(db, monkeypatch):
+    factory = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=db.bind)
+    monkeypatch.setattr(export_api, "shards", ShardRouter({"default": factory}))
+    app = FastAPI()
+    app.include_router(export_api.router)
+    return TestClient(app)
+
+def test_csv_export(client, history):
+    response = client.get("/export/pump-activities", params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.headers["content-disposition"] == 'attachment; filename="pump_activities.csv"'
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert tuple(rows[0]) == COLUMNS
+    assert [(r[2], r[3], r[4], r[5]) for r in rows[1:]] == [
+        ("fill_1", "on", START.isoformat(), ""),
+        ("fill_1", "off", (START + timedelta(minutes=1)).isoformat(), "60.0"),
+        ("ph_up", "on", (START + timedelta(minutes=2)).isoformat(), ""),
+    ]
+
+def test_ndjson_export_filtered_by_pump(client, history):
+    response = client.get("/export/pump-activities", params={"format": "ndjson", "pump": "fill_1"})
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-disposition"] == 'attachment; filename="pump_activities_fill_1.ndjson"'
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [(r["pump"], r["action"], r["duration"]) for r in rows] == [("fill_1", "on", None), ("fill_1", "off", 60.0)]
+    assert set(rows[0]) == set(COLUMNS)
+
+def test_parquet_export(client, history):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    response = client.get("/export/pump-activities", params={"format": "parquet"})
+    assert response.headers["content-type"] == "application/vnd.apache.parquet"
+    table = pyarrow_parquet.read_table(io.BytesIO(response.content))
+    assert table.column_names == list(COLUMNS)
+    assert table.column("pump").to_pylist() == ["fill_1", "fill_1", "ph_up"]
+    assert table.column("timestamp").to_pylist()[0] == START
+
+def test_time_bounded_export(client, history):
+    params = {"format": "ndjson", "start": (START + timedelta(minutes=1)).isoformat(),
+              "end": (START + timedelta(minutes=2)).isoformat()}
+    rows = [json.loads(line) for line in client.get("/export/pump-activities", params=params).text.splitlines()]
+    assert [(r["pump"], r["action"]) for r in rows] == [("fill_1", "off")]  # start inclusive, end exclusive
+
+def test_unknown_format_is_422(client):
+    response = client.get("/export/pump-activities", params={"format": "xlsx"})
+    assert response.status_code == 422
+    assert "xlsx" in response.json()["detail"]
+
+def test_export_defaults_to_the_sessions_site(db):
+    crud.initialize_pumps_from_config(db, {"fill_1": 8})
+    crud.initialize_pumps_from_config(db, {"fill_1": 8}, site_id="greenhouse_2")
+    crud.record_pump_on(db, "fill_1")
+    crud.record_pump_on(db, "fill_1", site_id="greenhouse_2")
+    crud.record_pump_off(db, "fill_1", site_id="greenhouse_2")
+
+    db.info["site_id"] = "greenhouse_2"
+    rows = [row for batch in iter_pump_activity_batches(db, batch_size=1) for row in batch]
+    assert [(row[2], row[3]) for row in rows] == [("fill_1", "on"), ("fill_1", "off")]
+    assert sum(len(batch) for batch in iter_pump_activity_batches(db, site_id=crud.ALL_SITES)) == 3
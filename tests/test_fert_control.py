@@ -0,0 +1,209 @@
+import threading
+import time
+
+import pytest
+
+from models.water_para import fert_control
+from models.water_para.fert_control import (
+    PID, DosingLimits, DosingLoop, Reading, SensorSource, SimulatedClock, SimulatedRelay, SimulatedSensorSource,
+    Tank, TankModel,
+)
+
+class FixedSensors(SensorSource):
+    def __init__(self, ph=7.0, ec=1.6):
+        self.value = Reading(ph, ec)
+
+    def read(self, tank):
+        return self.value
+
+class RecordingRelay:
+    """Records calls; deactivate raises while `stop_errors` is positive"""
+
+    def __init__(self):
+        self.calls = []
+        self.stop_errors = 0
+
+    def activate(self, pump):
+        self.calls.append(("activate", pump))
+
+    def deactivate(self, pump):
+        self.calls.append(("deactivate", pump))
+        if self.stop_errors:
+            self.stop_errors -= 1
+            raise OSError("relay not responding")
+
+def simulated_loop(sensors, clock, period=10.0):
+    return DosingLoop(sensors, period=period, clock=clock, sleep=clock.sleep, relay_threads=False)
+
+def test_pid_clamps_and_does_not_wind_up():
+    pid = PID(kp=2.0, ki=1.0, output_limits=(-5.0, 5.0))
+    assert pid.update(6.0, 5.0, dt=1.0) == pytest.approx(3.0)  # 2*1 + 1*1
+    for _ in range(100):
+        assert pid.update(6.0, 0.0, dt=1.0) == 5.0  # Saturated
+    assert pid.integral < 10  # Didn't keep integrating while saturated
+    # Back near the setpoint the output recovers immediately
+    assert pid.update(6.0, 6.5, dt=1.0) < 5.0
+
+def test_pid_derivative_acts_on_measurement():
+    pid = PID(kp=0.0, kd=1.0)
+    pid.update(6.0, 6.0, dt=1.0)
+    assert pid.update(6.0, 6.5, dt=1.0) == pytest.approx(-0.5)
+    assert pid.update(7.0, 6.5, dt=1.0) == 0.0  # A setpoint change alone doesn't kick
+
+def test_closed_loop_reaches_targets():
+    clock = SimulatedClock()
+    models = {"tank_1": TankModel(ph=7.2, ec=0.9), "tank_2": TankModel(ph=5.2, ec=1.5, volume_l=200.0)}
+    loop = simulated_loop(SimulatedSensorSource(models, clock), clock)
+    for name, model in models.items():
+        loop.add_tank(Tank(name, SimulatedRelay(model, clock)))
+    loop.run(until=4 * 3600)
+    for name in models:
+        reading = loop.reading(name)
+        assert abs(reading.ph - 6.0) < 0.15
+        assert abs(reading.ec - 1.6) < 0.15
+
+def test_pulses_respect_max_pulse_and_hourly_budget():
+    clock = SimulatedClock()
+    relay = RecordingRelay()
+    loop = simulated_loop(FixedSensors(ph=9.0), clock)  # A stuck sensor: always far too alkaline
+    limits = DosingLimits(max_pulse=2.0, max_seconds_per_hour=5.0, mixing_seconds=30.0)
+    loop.add_tank(Tank("tank_1", relay, ec_target=None, limits=limits))
+    loop.run(until=3500)  # Within the first hour's budget
+    pulses = [pump for method, pump in relay.calls if method == "activate"]
+    assert pulses and set(pulses) == {"ph_down"}
+    assert len(pulses) == 3  # 2s + 2s + the 1s left of the budget
+    assert loop.stats["rate_limited"] > 0
+    assert not loop._tanks["tank_1"].pending
+
+def test_corrections_below_min_pulse_are_skipped():
+    clock = SimulatedClock()
+    relay = RecordingRelay()
+    loop = simulated_loop(FixedSensors(ph=6.15), clock)
+    tank = Tank("tank_1", relay, ec_target=None, ph_pid=PID(kp=1.0), limits=DosingLimits(min_pulse=0.5))
+    loop.add_tank(tank)
+    loop.run(until=600)
+    assert relay.calls == []
+
+def test_failed_stop_latches_fault_and_is_retried(monkeypatch):
+    monkeypatch.setattr(fert_control, "STOP_RETRY_SECONDS", 2.0)
+    clock = SimulatedClock()
+    relay = RecordingRelay()
+    relay.stop_errors = 3
+    loop = simulated_loop(FixedSensors(ph=7.0), clock, period=5.0)
+    loop.add_tank(Tank("tank_1", relay, ec_target=None))
+    loop.run(until=60)
+
+    assert relay.calls.count(("activate", "ph_down")) == 1  # No dose after the failed stop
+    assert relay.calls.count(("deactivate", "ph_down")) == 4  # Retried after 2s, 4s and 8s
+    assert "stopping ph_down failed" in loop.fault("tank_1")
+    assert loop.stats["failed_stops"] == 3
+
+    loop.clear_fault("tank_1")
+    assert loop.fault("tank_1") is None
+    loop.run(until=600)
+    assert relay.calls.count(("activate", "ph_down")) > 1
+
+def test_fault_cannot_be_cleared_while_a_pump_is_stuck():
+    clock = SimulatedClock()
+    relay = RecordingRelay()
+    relay.stop_errors = 1000
+    loop = simulated_loop(FixedSensors(ph=7.0), clock, period=5.0)
+    loop.add_tank(Tank("tank_1", relay, ec_target=None))
+    loop.run(until=120)
+    with pytest.raises(ValueError):
+        loop.clear_fault("tank_1")
+    assert relay.calls.count(("activate", "ph_down")) == 1
+
+class SlowRelay(RecordingRelay):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def activate(self, pump):
+        super().activate(pump)
+        self.release.wait(5)
+
+def test_a_slow_relay_only_delays_its_own_tank():
+    slow, fast = SlowRelay(), RecordingRelay()
+    loop = DosingLoop(FixedSensors(ph=7.0), period=0.02)
+    fast_limits = DosingLimits(min_pulse=0.01, max_pulse=0.02, mixing_seconds=0.02, pulse_gap=0.0)
+    loop.add_tank(Tank("slow", slow, ec_target=None))
+    loop.add_tank(Tank("fast", fast, ec_target=None, limits=fast_limits))
+    loop.start()
+    try:
+        deadline = time.monotonic() + 5
+        while fast.calls.count(("deactivate", "ph_down")) < 3:
+            assert time.monotonic() < deadline, "fast tank was held up by the slow relay"
+            time.sleep(0.01)
+        assert slow.calls == [("activate", "ph_down")]  # Still stuck in its first call
+        start = time.perf_counter()
+        loop.run_pending()
+        assert time.perf_counter() - start < 0.05
+    finally:
+        slow.release.set()
+        loop.stop()
+
+def start_dosing(relay, **kwargs):
+    """A threaded loop whose ph_down pulse (5s, the max) is running when this returns"""
+    loop = DosingLoop(FixedSensors(ph=7.0), period=0.02, **kwargs)
+    loop.add_tank(Tank("tank_1", relay, ec_target=None, limits=DosingLimits(max_pulse=5.0)))
+    loop.start()
+    deadline = time.monotonic() + 5
+    while ("activate", "ph_down") not in relay.calls:
+        assert time.monotonic() < deadline, "never dosed"
+        time.sleep(0.01)
+    return loop
+
+def test_stop_switches_running_pumps_off_before_returning():
+    relay = RecordingRelay()
+    loop = start_dosing(relay)
+    loop.stop()
+    assert relay.calls[-1] == ("deactivate", "ph_down")
+    assert loop.fault("tank_1") is None
+
+def test_failed_stop_during_shutdown_latches_the_fault():
+    relay = RecordingRelay()
+    relay.stop_errors = 1000
+    loop = start_dosing(relay)
+    loop.stop()
+    assert ("deactivate", "ph_down") in relay.calls
+    assert "stopping ph_down failed" in loop.fault("tank_1")
+    assert loop.stats["failed_stops"] >= 1
+    with pytest.raises(ValueError):
+        loop.clear_fault("tank_1")
+
+def test_hung_relay_does_not_hang_shutdown(monkeypatch):
+    monkeypatch.setattr(fert_control, "SHUTDOWN_TIMEOUT_SECONDS", 0.1)
+    relay = SlowRelay()
+    loop = DosingLoop(FixedSensors(ph=7.0), period=0.02)
+    loop.add_tank(Tank("hung", relay, ec_target=None))
+    loop.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not relay.calls:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        start = time.monotonic()
+        loop.stop()
+        assert time.monotonic() - start < 2
+        assert loop.fault("hung") is not None
+    finally:
+        relay.release.set()
+
+def test_start_stop_cycles_do_not_leak_relay_threads():
+    def relay_threads():
+        return [t for t in threading.enumerate() if t.name.startswith("relay-tank_1")]
+
+    relay = RecordingRelay()
+    loop = start_dosing(relay)
+    loop.stop()
+    assert relay_threads() == []
+    for _ in range(2):
+        loop.start()
+        time.sleep(0.1)
+        loop.stop()
+        assert relay_threads() == []
+
+def test_sensor_source_is_abstract():
+    with pytest.raises(TypeError):
+        SensorSource()
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+from fastapi.testclient import TestClient
+from sqlalchemy import inspect
+
+import health_api
+from packages.db import engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_importing_packages_db_does_not_connect(tmp_path):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path}/missing/dir/verdant.db", PYTHONPATH=ROOT)
+    result = subprocess.run([sys.executable, "-c", "import packages.db"], env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+def test_health_answers_while_the_database_is_down(monkeypatch):
+    def unreachable():
+        raise OSError("could not connect to server")
+    monkeypatch.setattr(health_api, "init_db", unreachable)
+    monkeypatch.setattr(health_api, "SCHEMA_INIT_RETRY_SECONDS", 0.01)
+    with TestClient(health_api.app) as client:
+        assert client.get("/health").json() == {"status": "healthy", "service": "verdant-api"}
+
+def test_schema_is_created_at_startup():
+    health_api.stopping.clear()
+    health_api.init_schema()
+    indexes = {index["name"] for index in inspect(engine).get_indexes("pump_activities")}
+    assert "ix_pump_activities_time" in indexes
@@ -0,0 +1,122 @@
+import threading
+import time
+
+import pytest
+import requests
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import pi_api
+from idempotency import CommandDeduplicator, CommandTimeout, IdempotencyConflict
+
+def wait_inflight(commands):
+    """Wait for a call to start, then give the other threads time to join it"""
+    while not commands._inflight:
+        time.sleep(0.001)
+    time.sleep(0.1)
+
+def run_in_threads(count, fn):
+    results, threads = [None] * count, []
+    for i in range(count):
+        def target(i=i):
+            try:
+                results[i] = fn()
+            except BaseException as e:
+                results[i] = e
+        threads.append(threading.Thread(target=target))
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+def test_concurrent_duplicates_share_one_call():
+    commands = CommandDeduplicator(wait_timeout=5)
+    release, calls = threading.Event(), []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return {"state": "on"}
+
+    threads, results = run_in_threads(4, lambda: commands.run(("POST", "/pump/fill_1/on"), fn))
+    wait_inflight(commands)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert sorted(source for _, source in results) == ["executed", "shared", "shared", "shared"]
+
+def test_idempotency_key_replays_and_rejects_reuse():
+    commands = CommandDeduplicator()
+    calls = []
+    request = ("POST", "/pump/fill_1/on")
+    assert commands.run(request, lambda: calls.append(1) or "ok", "key-1") == ("ok", "executed")
+    assert commands.run(request, lambda: calls.append(1) or "ok", "key-1") == ("ok", "replayed")
+    assert len(calls) == 1
+    with pytest.raises(IdempotencyConflict):
+        commands.run(("POST", "/pump/fill_1/off"), lambda: "ok", "key-1")
+
+def test_each_waiter_gets_its_own_error_and_errors_are_not_cached():
+    commands = CommandDeduplicator(wait_timeout=5)
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise HTTPException(503, "pump service down")
+
+    threads, results = run_in_threads(3, lambda: commands.run(("POST", "/pump/fill_1/on"), fn, "key-1"))
+    wait_inflight(commands)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert all(isinstance(e, HTTPException) and e.status_code == 503 for e in results)
+    assert len({id(e) for e in results}) == 3
+    assert commands.run(("POST", "/pump/fill_1/on"), lambda: "ok", "key-1") == ("ok", "executed")
+
+def test_waiter_gives_up_when_the_call_hangs():
+    commands = CommandDeduplicator(wait_timeout=0.05)
+    release = threading.Event()
+    threads, _ = run_in_threads(1, lambda: commands.run("cmd", lambda: release.wait(5)))
+    wait_inflight(commands)
+    with pytest.raises(CommandTimeout):
+        commands.run("cmd", lambda: "never runs")
+    release.set()
+    threads[0].join(5)
+
+def test_forward_sets_a_timeout(monkeypatch):
+    seen = {}
+
+    def request(method, url, **kwargs):
+        seen.update(kwargs)
+        raise requests.Timeout("read timed out")
+    monkeypatch.setattr(pi_api.requests, "request", request)
+    monkeypatch.setattr(pi_api, "commands", CommandDeduplicator())
+    response = TestClient(pi_api.app).post("/pump/fill_1/on")
+    assert seen["timeout"] == pi_api.PUMP_API_TIMEOUT_SECONDS
+    assert response.status_code == 504
+
+def test_duplicate_of_a_hung_command_gets_504(monkeypatch):
+    release, started = threading.Event(), threading.Event()
+
+    class Hung:
+        status_code = 200
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"pump": "fill_1", "state": "on"}
+
+    def forward(*args, **kwargs):
+        started.set()
+        release.wait(5)
+        return Hung()
+    monkeypatch.setattr(pi_api, "forward", forward)
+    monkeypatch.setattr(pi_api, "commands", CommandDeduplicator(wait_timeout=0.05))
+    client = TestClient(pi_api.app)
+
+    threads, results = run_in_threads(1, lambda: client.post("/pump/fill_1/on", headers={"Idempotency-Key": "a"}))
+    assert started.wait(5)
+    assert client.post("/pump/fill_1/on", headers={"Idempotency-Key": "b"}).status_code == 504
+    release.set()
+    threads[0].join(5)
+    assert results[0].status_code == 200
@@ -0,0 +1,90 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from packages.metrics import Counter, Gauge, Histogram, Registry, instrument_app
+
+def test_render_exposition_format():
+    registry = Registry()
+    Counter("jobs_total", "Jobs run", ("result",), registry=registry).labels("ok").inc(2)
+    Gauge("queue_depth", "Queued jobs", registry=registry).set(3)
+    hist = Histogram("job_seconds", "Job time", buckets=(0.1, 1.0), registry=registry)
+    for value in (0.05, 0.5, 5.0):
+        hist.observe(value)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE jobs_total counter" in lines
+    assert 'jobs_total{result="ok"} 2.0' in lines
+    assert "queue_depth 3" in lines
+    assert 'job_seconds_bucket{le="0.1"} 1' in lines
+    assert 'job_seconds_bucket{le="1.0"} 2' in lines
+    assert 'job_seconds_bucket{le="+Inf"} 3' in lines
+    assert "job_seconds_count 3" in lines
+    assert "job_seconds_sum 5.55" in lines
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    Counter("odd_total", "", ("path",), registry=registry).labels('a"b\\c\n').inc()
+    assert 'odd_total{path="a\\"b\\\\c\\n"} 1.0' in registry.render()
+
+def test_labels_must_match_labelnames():
+    counter = Counter("pairs_total", "", ("a", "b"), registry=Registry())
+    with pytest.raises(ValueError):
+        counter.labels("only-one")
+
+def test_reregistering_a_metric_shares_its_values():
+    registry = Registry()
+    first = Counter("reloads_total", "", ("source",), registry=registry)
+    second = Counter("reloads_total", "", ("source",), registry=registry)
+    first.labels("file").inc()
+    second.labels("file").inc()
+    assert registry.get("reloads_total") is first
+    assert registry.render().count('reloads_total{source="file"} 2.0') == 1
+
+@pytest.mark.parametrize("conflict", [
+    lambda r: Gauge("things", "", registry=r),
+    lambda r: Counter("things", "", ("other",), registry=r),
+])
+def test_conflicting_registration_raises(conflict):
+    registry = Registry()
+    Counter("things", "", registry=registry)
+    with pytest.raises(ValueError):
+        conflict(registry)
+
+def test_histogram_with_different_buckets_conflicts():
+    registry = Registry()
+    Histogram("latency", "", buckets=(1.0,), registry=registry)
+    with pytest.raises(ValueError):
+        Histogram("latency", "", buckets=(2.0,), registry=registry)
+
+def test_timer_observes_block():
+    hist = Histogram("block_seconds", "", registry=Registry())
+    with hist.time():
+        pass
+    child = hist.labels()
+    assert sum(child.counts) == 1 and child.sum >= 0
+
+def test_instrumented_app_labels_requests_by_route_template():
+    app = FastAPI()
+
+    @app.get("/pump/{name}/on")
+    def on(name: str):
+        return {"name": name}
+
+    instrument_app(app)
+    client = TestClient(app)
+    client.get("/pump/ph_up/on")
+    client.get("/pump/ph_down/on")
+    body = client.get("/metrics").text
+    assert 'http_requests_total{method="GET",route="/pump/{name}/on",status="200"}' in body
+    assert "ph_up" not in body
+
+def test_metric_types_must_implement_children_and_samples():
+    from packages.metrics.registry import _Metric
+
+    class NoSamples(_Metric):
+        def _new_child(self):
+            return object()
+
+    with pytest.raises(TypeError):
+        NoSamples("incomplete", "Missing samples()", registry=Registry())
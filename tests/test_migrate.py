@@ -0,0 +1,70 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from packages.db import DEFAULT_SITE_ID, crud
+from packages.db.migrate import migrate
+from packages.db.routing import RoutingSession
+
+# The schema from before per-site data: names and pins unique across every site
+OLD_SCHEMA = [
+    """CREATE TABLE pumps (
+        id INTEGER NOT NULL PRIMARY KEY, name VARCHAR, pin INTEGER, type VARCHAR(11), description VARCHAR,
+        is_active BOOLEAN, created_at DATETIME, updated_at DATETIME, UNIQUE (pin))""",
+    "CREATE UNIQUE INDEX ix_pumps_name ON pumps (name)",
+    "CREATE INDEX ix_pumps_id ON pumps (id)",
+    """CREATE TABLE pump_activities (
+        id INTEGER NOT NULL PRIMARY KEY, pump_id INTEGER REFERENCES pumps (id), action VARCHAR(3),
+        timestamp DATETIME, duration FLOAT)""",
+    "CREATE INDEX ix_pump_activities_id ON pump_activities (id)",
+]
+
+@pytest.fixture
+def old_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    now = datetime(2024, 5, 1, 6, 0)
+    with engine.begin() as conn:
+        for statement in OLD_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO pumps (id, name, pin, type, is_active, created_at, updated_at) "
+                          "VALUES (1, 'fill_1', 8, 'HIGH_VOLUME', 0, :now, :now)"), {"now": now})
+        conn.execute(text("INSERT INTO pump_activities (pump_id, action, timestamp) VALUES (1, 'ON', :now)"),
+                     {"now": now})
+    yield engine
+    engine.dispose()
+
+def test_migrates_old_schema_and_keeps_rows(old_engine):
+    assert migrate(old_engine)
+    insp = inspect(old_engine)
+    assert "site_id" in {c["name"] for c in insp.get_columns("pumps")}
+    indexes = {i["name"] for i in insp.get_indexes("pump_activities")}
+    assert {"ix_pump_activities_pump_time", "ix_pump_activities_site_time", "ix_pump_activities_time"} <= indexes
+    with old_engine.connect() as conn:
+        assert conn.execute(text("SELECT name, pin, site_id FROM pumps")).all() == [("fill_1", 8, DEFAULT_SITE_ID)]
+        assert conn.execute(text("SELECT site_id FROM pump_activities")).scalar() == DEFAULT_SITE_ID
+
+def test_names_and_pins_become_unique_per_site(old_engine):
+    migrate(old_engine)
+    db = sessionmaker(class_=RoutingSession, bind=old_engine)()
+    try:
+        crud.create_pump(db, "fill_1", 8, crud.PumpType.HIGH_VOLUME, site_id="greenhouse_2")
+        assert crud.record_pump_on(db, "fill_1", site_id="greenhouse_2")["success"]
+        with pytest.raises(IntegrityError):
+            crud.create_pump(db, "fill_1", 9, crud.PumpType.HIGH_VOLUME, site_id="greenhouse_2")
+    finally:
+        db.close()
+
+def test_second_run_is_a_no_op(old_engine):
+    migrate(old_engine)
+    assert migrate(old_engine) == []
+
+def test_dry_run_changes_nothing(old_engine):
+    statements = migrate(old_engine, dry_run=True)
+    assert any("ADD COLUMN site_id" in sql for sql in statements)
+    assert "site_id" not in {c["name"] for c in inspect(old_engine).get_columns("pumps")}
+
+def test_new_database_is_left_to_init_db(tmp_path):
+    assert migrate(create_engine(f"sqlite:///{tmp_path / 'new.db'}")) == []
@@ -0,0 +1,80 @@
+import time
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from packages.db import PumpAction, QueryProfilingMiddleware, crud, profile_queries
+
+PUMPS = {"fill_1": 8, "ph_up": 4, "ph_down": 3}
+
+def test_record_pump_on_statement_budget(db):
+    crud.initialize_pumps_from_config(db, PUMPS)
+    with profile_queries() as profile:
+        assert crud.record_pump_on(db, "fill_1")["success"]
+    profile.assert_max_statements(2)
+    profile.assert_no_duplicates()
+
+def test_record_pump_off_statement_budget(db):
+    crud.initialize_pumps_from_config(db, PUMPS)
+    crud.record_pump_on(db, "fill_1")
+    with profile_queries() as profile:
+        assert crud.record_pump_off(db, "fill_1")["success"]
+    profile.assert_max_statements(3)
+    profile.assert_no_duplicates()
+    profile.assert_no_lazy_loads()
+
+def test_record_pump_off_closes_the_right_activity(db):
+    """Several pumps with interleaved activities, so ids don't line up by accident"""
+    crud.initialize_pumps_from_config(db, PUMPS)
+    crud.record_pump_on(db, "ph_down")
+    crud.record_pump_on(db, "ph_up")
+    crud.record_pump_off(db, "ph_down")
+    crud.record_pump_on(db, "ph_down")
+    time.sleep(0.02)
+    result = crud.record_pump_off(db, "ph_up")
+
+    ph_up = crud.get_pump_by_name(db, "ph_up")
+    activities = crud.get_pump_activities_by_pump(db, ph_up.id)
+    on = [a for a in activities if a.action == PumpAction.ON]
+    assert len(on) == 1 and on[0].duration == result["duration"] >= 0.02
+    assert not ph_up.is_active
+    assert crud.get_pump_by_name(db, "ph_down").is_active
+
+def test_record_pump_off_without_on_and_unknown_pump(db):
+    crud.initialize_pumps_from_config(db, PUMPS)
+    assert crud.record_pump_off(db, "fill_1")["duration"] is None
+    with profile_queries() as profile:
+        assert not crud.record_pump_off(db, "missing")["success"]
+    profile.assert_max_statements(1)
+
+def test_flags_lazy_loads_and_repeated_statements(db):
+    crud.initialize_pumps_from_config(db, PUMPS)
+    for name in PUMPS:
+        crud.record_pump_on(db, name)
+    db.expire_all()
+    with profile_queries() as profile:
+        for pump in crud.get_pumps(db):
+            list(pump.activities)
+    assert len(profile.lazy_loads) == len(PUMPS)
+    assert profile.repeated_statements()
+    assert profile.has_problems and "lazy load" in profile.report()
+
+def test_profiles_are_isolated_per_block(db):
+    crud.initialize_pumps_from_config(db, PUMPS)
+    with profile_queries() as outer:
+        crud.get_pumps(db)
+    crud.get_pumps(db)
+    assert outer.count == 1
+
+def test_middleware_reports_statement_count(db):
+    crud.initialize_pumps_from_config(db, PUMPS)
+    app = FastAPI()
+    app.add_middleware(QueryProfilingMiddleware, max_statements=5)
+
+    @app.get("/pumps")
+    def pumps(session=Depends(lambda: db)):
+        return [p.name for p in crud.get_pumps(session)]
+
+    response = TestClient(app).get("/pumps")
+    assert response.status_code == 200
+    assert response.headers["x-db-statements"] == "1"
@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import pump_api
+from mcp_sim import SimulatedMCP23017
+from pump_config import PUMPS
+from pump_map import PumpMapStore
+from pump_master import RelayController
+from scheduler import ScheduleStore
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    """pump_api with its pump map and schedules in tmp_path"""
+    monkeypatch.setattr(pump_api, "PumpMapStore",
+                        lambda **kwargs: PumpMapStore(path=str(tmp_path / "pump_config.json"), **kwargs))
+    monkeypatch.setattr(pump_api, "ScheduleStore", lambda: ScheduleStore(str(tmp_path / "schedules.db")))
+    return pump_api
+
+def wait_ready(client, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while client.get("/ready").status_code != 200:
+        assert time.monotonic() < deadline, "relay never became ready"
+        time.sleep(0.01)
+
+def test_health_then_ready_then_switch(service):
+    with TestClient(service.app) as client:
+        assert client.get("/health").json() == {"status": "ok"}
+        wait_ready(client)
+        assert client.post("/pump/fill_1/on").json() == {"pump": "fill_1", "state": "on"}
+        assert service.relay.is_active("fill_1")
+        assert client.post("/pump/nope/on").status_code == 404
+        relay = service.relay
+    # Shutdown switches every relay off
+    assert not relay.is_active("fill_1")
+
+def test_ready_reports_init_errors(service, monkeypatch):
+    monkeypatch.setattr(service, "RELAY_INIT_RETRY_SECONDS", 0.01)
+
+    def broken(*args, **kwargs):
+        raise OSError("No I2C device at 0x20")
+
+    monkeypatch.setattr(service, "RelayController", broken)
+    with TestClient(service.app) as client:
+        deadline = time.monotonic() + 5
+        while "error" not in client.get("/ready").json():
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        body = client.get("/ready")
+        assert body.status_code == 503 and "0x20" in body.json()["error"]
+        assert client.post("/pump/fill_1/on").status_code == 503
+
+def test_shutdown_is_bounded_when_init_hangs(service, monkeypatch):
+    release = threading.Event()
+
+    def hung(*args, **kwargs):
+        release.wait(30)  # e.g. stuck on the I2C bus
+        raise OSError("bus hung")
+
+    monkeypatch.setattr(service, "RelayController", hung)
+    monkeypatch.setattr(service, "SHUTDOWN_TIMEOUT_SECONDS", 0.2)
+    client = TestClient(service.app)
+    client.__enter__()
+    try:
+        start = time.monotonic()
+        client.__exit__(None, None, None)
+        assert time.monotonic() - start < 5
+    finally:
+        release.set()
+
+def test_lifespan_can_run_twice(service):
+    relays = []
+    for _ in range(2):
+        with TestClient(service.app) as client:
+            wait_ready(client)
+            relays.append(service.relay)
+    assert relays[0] is not relays[1]
+
+class FailingBus(SimulatedMCP23017):
+    @SimulatedMCP23017.gpio.setter
+    def gpio(self, value):
+        raise OSError("I2C timeout")
+
+def test_cleanup_updates_shadow_only_after_the_write():
+    mcp = SimulatedMCP23017(latency=0)
+    relay = RelayController(PUMPS, mcp=mcp)
+    relay.activate("fill_1")
+
+    relay.mcp = FailingBus(latency=0)
+    with pytest.raises(OSError):
+        relay.cleanup()
+    assert relay.is_active("fill_1")  # Still on as far as we know, so a retry writes again
+
+    relay.mcp = mcp
+    relay.cleanup()
+    assert not relay.is_active("fill_1") and mcp._gpio == 0xFFFF
+
+def test_pump_config_etag_and_conditional_get(service):
+    with TestClient(service.app) as client:
+        response = client.get("/pumps/config")
+        assert response.json()["version"] == 0 and response.json()["pumps"] == PUMPS
+        etag = response.headers["ETag"]
+        for header in (etag, f"W/{etag}", '"other", ' + etag, "*"):
+            assert client.get("/pumps/config", headers={"If-None-Match": header}).status_code == 304
+        assert client.get("/pumps/config", headers={"If-None-Match": '"other"'}).status_code == 200
+
+def test_put_pump_config_bumps_version_and_persists(service, tmp_path):
+    with TestClient(service.app) as client:
+        wait_ready(client)
+        etag = client.get("/pumps/config").headers["ETag"]
+        pumps = {**PUMPS, "fill_1": 10}
+        response = client.put("/pumps/config", json={"version": 1, "pumps": pumps})
+        assert response.status_code == 200
+        assert response.json()["changes"] == {"added": [], "removed": [], "remapped": ["fill_1"]}
+        assert response.headers["ETag"] != etag
+        assert client.get("/pumps/config", headers={"If-None-Match": etag}).status_code == 200
+        assert service.relay.pump_map["fill_1"] == 10
+
+        assert client.put("/pumps/config", json={"version": 1, "pumps": PUMPS}).status_code == 409
+        assert client.put("/pumps/config", json={"version": 2, "pumps": {"a": 1, "b": 1}}).status_code == 422
+        assert client.get("/pumps/config").json()["version"] == 1
+    saved = json.loads((tmp_path / "pump_config.json").read_text())
+    assert saved == {"version": 1, "pumps": pumps}
@@ -0,0 +1,93 @@
+import json
+import os
+
+import pytest
+
+import pump_map
+from pump_map import PumpMap, PumpMapStore, StalePumpMap, load_pump_map
+from pump_config import PUMPS
+
+class RecordingHardware:
+    """on_change hook: records applied maps, raises while `fail` is set"""
+
+    def __init__(self):
+        self.applied = []
+        self.fail = False
+
+    def __call__(self, old, new):
+        if self.fail:
+            raise OSError("i2c bus error")
+        self.applied.append(dict(new.pumps))
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "pump_config.json")
+
+def test_update_publishes_and_persists(path):
+    hardware = RecordingHardware()
+    store = PumpMapStore(path, on_change=hardware)
+    diff = store.update(PumpMap({"fill_1": 8, "ph_up": 5}, 1))
+    assert diff["removed"] == sorted(set(PUMPS) - {"fill_1", "ph_up"})
+    assert hardware.applied == [{"fill_1": 8, "ph_up": 5}]
+    assert load_pump_map(path).pumps == store.current.pumps
+
+def test_failed_save_leaves_hardware_and_map_unchanged(path, monkeypatch):
+    hardware = RecordingHardware()
+    store = PumpMapStore(path, on_change=hardware)
+    before = store.current
+
+    def disk_full(pump_map, path):
+        raise OSError("No space left on device")
+    monkeypatch.setattr(pump_map, "write_pump_map_tmp", disk_full)
+    with pytest.raises(OSError):
+        store.update(PumpMap({"fill_1": 8}, 1))
+    assert store.current is before
+    assert hardware.applied == []
+
+def test_failed_rename_leaves_hardware_and_map_unchanged(path, monkeypatch):
+    hardware = RecordingHardware()
+    store = PumpMapStore(path, on_change=hardware)
+    store.update(PumpMap({"fill_1": 8}, 1))
+
+    def read_only(src, dst):
+        raise PermissionError("Read-only file system")
+    monkeypatch.setattr(pump_map.os, "replace", read_only)
+    with pytest.raises(OSError):
+        store.update(PumpMap({"fill_1": 9}, 2))
+    monkeypatch.undo()
+    assert not os.path.exists(f"{path}.tmp")
+    assert store.current.version == 1
+    assert hardware.applied == [{"fill_1": 8}]
+    assert store.reload() == {"added": [], "removed": [], "remapped": []}  # File and map still agree
+
+def test_failed_publish_leaves_the_file_unchanged(path):
+    hardware = RecordingHardware()
+    store = PumpMapStore(path, on_change=hardware)
+    store.update(PumpMap({"fill_1": 8}, 1))
+    with open(path) as f:
+        saved = f.read()
+
+    hardware.fail = True
+    with pytest.raises(OSError):
+        store.update(PumpMap({"fill_1": 9}, 2))
+    with pytest.raises(StalePumpMap):
+        store.update(PumpMap({"fill_1": 10}, 1))
+    with open(path) as f:
+        assert f.read() == saved
+    assert not os.path.exists(f"{path}.tmp")
+    assert store.current.version == 1
+    # A restart loads what the hardware is running
+    assert PumpMapStore(path).current.pumps == {"fill_1": 8}
+
+def test_version_0_file_replaces_the_builtin_map(path):
+    store = PumpMapStore(path)
+    assert store.current.source == "builtin" and store.current.version == 0
+    with open(path, "w") as f:
+        json.dump({"pumps": {"fill_1": 8}}, f)  # No version: 0
+    assert store.reload()["removed"] == sorted(set(PUMPS) - {"fill_1"})
+    assert store.current.pumps == {"fill_1": 8}
+
+    with open(path, "w") as f:
+        json.dump({"pumps": {"fill_1": 9}}, f)  # Same version as the file it replaces
+    with pytest.raises(StalePumpMap):
+        store.reload()
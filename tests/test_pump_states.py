@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from packages.db import PumpAction, PumpActivity, crud
+
+PUMPS = {"fill_1": 8, "ph_up": 4}
+
+@pytest.fixture
+def pumps(db):
+    crud.invalidate_pump_states()
+    return {pump.name: pump for pump in crud.initialize_pumps_from_config(db, PUMPS)}
+
+def add_run(db, pump, on: datetime, off: datetime):
+    db.add(PumpActivity(pump_id=pump.id, site_id=pump.site_id, action=PumpAction.ON, timestamp=on,
+                        duration=(off - on).total_seconds()))
+    db.add(PumpActivity(pump_id=pump.id, site_id=pump.site_id, action=PumpAction.OFF, timestamp=off,
+                        duration=(off - on).total_seconds()))
+    db.commit()
+    crud.invalidate_pump_states()
+
+def state(db, name):
+    return next(s for s in crud.get_pump_states(db, use_cache=False) if s["name"] == name)
+
+def test_runtime_today_sums_completed_runs(db, pumps):
+    midnight = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    add_run(db, pumps["fill_1"], midnight + timedelta(seconds=10), midnight + timedelta(seconds=70))
+    add_run(db, pumps["fill_1"], midnight + timedelta(seconds=100), midnight + timedelta(seconds=130))
+    add_run(db, pumps["fill_1"], midnight - timedelta(hours=2), midnight - timedelta(hours=1))  # Yesterday
+    assert state(db, "fill_1")["completed_runtime_today"] == pytest.approx(90)
+    assert state(db, "ph_up")["completed_runtime_today"] == 0.0
+
+def test_run_across_midnight_only_counts_todays_part(db, pumps):
+    midnight = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    add_run(db, pumps["fill_1"], midnight - timedelta(seconds=600), midnight + timedelta(seconds=5))
+    add_run(db, pumps["fill_1"], midnight + timedelta(seconds=20), midnight + timedelta(seconds=30))
+    fill = state(db, "fill_1")
+    assert fill["completed_runtime_today"] == pytest.approx(15)
+    assert fill["last_action"] == "off"
+
+def test_running_pump_counts_from_midnight(db, pumps):
+    crud.record_pump_on(db, "ph_up")
+    ph_up = state(db, "ph_up")
+    assert ph_up["is_active"] and ph_up["active_since"] is not None
+    assert 0 <= ph_up["runtime_today"] < 5
+
+def test_a_write_only_invalidates_its_own_site(db, pumps, monkeypatch):
+    crud.initialize_pumps_from_config(db, {"fill_1": 8}, site_id="greenhouse_2")
+    crud.get_pump_states(db, site_id="greenhouse_2")
+    crud.get_pump_states(db)
+    queries = []
+    query = crud._query_pump_states
+    monkeypatch.setattr(crud, "_query_pump_states", lambda db, day, site: queries.append(site) or query(db, day, site))
+
+    crud.record_pump_on(db, "fill_1")
+    assert not crud.get_pump_states(db, site_id="greenhouse_2")[0]["is_active"]  # Still cached
+    assert state(db, "fill_1")["is_active"]
+    assert queries == [pumps["fill_1"].site_id]
+
+def test_reads_after_a_write_go_to_the_primary_once(db, pumps):
+    site = pumps["fill_1"].site_id
+    crud.get_pump_states(db)
+    db.info.pop("wrote", None)
+    crud.record_pump_on(db, "fill_1")
+    db.info.pop("wrote", None)
+    crud.get_pump_states(db)
+    assert db.info.get("wrote")  # The refill after the write was pinned to the primary
+
+    db.info.pop("wrote", None)
+    crud.invalidate_pump_states("greenhouse_2")  # Another site's write
+    crud.get_pump_states(db, use_cache=False)
+    assert not db.info.get("wrote")
+    assert not crud._written_since_sync((db.bind, site))
@@ -0,0 +1,81 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import read_api
+from packages.db import ShardRouter, crud, mapping_resolver
+
+PUMPS = {"fill_1": 8, "ph_up": 4, "ph_down": 3}
+
+@pytest.fixture
+def client(db):
+    app = FastAPI()
+    app.include_router(read_api.router)
+    app.dependency_overrides[read_api.get_site_db] = lambda: db
+    read_api.cache.clear()
+    crud.initialize_pumps_from_config(db, PUMPS)
+    return TestClient(app)
+
+def test_lists_pumps_with_etag_and_304(client):
+    response = client.get("/pumps")
+    assert response.status_code == 200
+    assert sorted(p["name"] for p in response.json()) == sorted(PUMPS)
+    etag = response.headers["ETag"]
+    assert client.get("/pumps", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/pumps", headers={"If-None-Match": 'W/"other"'}).status_code == 200
+
+def test_unknown_pump_is_404(client):
+    assert client.get("/pumps/nope").status_code == 404
+    assert client.get("/pumps/fill_1").json()["pin"] == 8
+
+def test_expired_entry_is_revalidated_without_recomputing(client, monkeypatch):
+    monkeypatch.setattr(read_api, "READ_CACHE_TTL", 0)
+    calls = []
+    get_pumps = crud.get_pumps
+    monkeypatch.setattr(crud, "get_pumps", lambda *args, **kwargs: calls.append(1) or get_pumps(*args, **kwargs))
+
+    first = client.get("/pumps")
+    second = client.get("/pumps")
+    assert len(calls) == 1  # Version unchanged: the cached body was reused
+    assert first.headers["ETag"] == second.headers["ETag"]
+
+def test_writes_change_the_response_after_the_ttl(client, db, monkeypatch):
+    monkeypatch.setattr(read_api, "READ_CACHE_TTL", 0)
+    before = client.get("/activities").json()
+    crud.record_pump_on(db, "fill_1")
+    after = client.get("/activities").json()
+    assert before == [] and [a["action"] for a in after] == ["on"]
+    assert client.get("/pumps/fill_1/activities").json()[0]["pump_id"] == after[0]["pump_id"]
+
+def test_fresh_entries_are_served_from_the_cache(client, db):
+    client.get("/activities")
+    crud.record_pump_on(db, "fill_1")
+    assert client.get("/activities").json() == []  # Within READ_CACHE_TTL
+
+def test_large_responses_are_gzipped(client, db, monkeypatch):
+    monkeypatch.setattr(read_api, "READ_CACHE_TTL", 0)
+    for _ in range(20):
+        crud.record_pump_on(db, "fill_1")
+        crud.record_pump_off(db, "fill_1")
+    response = client.get("/activities", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert len(response.json()) == 40  # The client decompresses transparently
+    raw = client.get("/activities", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in raw.headers
+    assert len(raw.json()) == 40
+
+def test_state_and_rollups(client, db):
+    crud.record_pump_on(db, "ph_up")
+    crud.record_pump_off(db, "ph_up")
+    states = {s["name"]: s for s in client.get("/pumps/state").json()}
+    assert states["ph_up"]["last_action"] == "off"
+    rollup = client.get("/rollups/daily", params={"days": 1, "pump": "ph_up"})
+    assert rollup.status_code == 200
+    assert client.get("/rollups/daily", params={"pump": "nope"}).status_code == 404
+
+def test_site_on_unknown_shard_is_422(monkeypatch):
+    router = ShardRouter({"default": read_api.shards.shards["default"]}, mapping_resolver({"far": "eu"}))
+    monkeypatch.setattr(read_api, "shards", router)
+    app = FastAPI()
+    app.include_router(read_api.router)
+    assert TestClient(app).get("/pumps", params={"site": "far"}).status_code == 422
@@ -0,0 +1,96 @@
+import pytest
+
+from mcp_sim import SimulatedMCP23017
+from pump_config import PUMPS
+from pump_master import RelayController, create_mcp, pin_mask
+
+@pytest.fixture
+def mcp():
+    return SimulatedMCP23017(latency=0)
+
+def test_init_latches_off_before_enabling_outputs(mcp):
+    relay = RelayController(PUMPS, mcp=mcp)
+    assert mcp.transactions == 2
+    assert mcp._gpio == 0xFFFF  # Active-LOW: every relay off
+    assert mcp._iodir == 0xFFFF & ~pin_mask(PUMPS.values())
+    assert not any(relay.is_active(name) for name in PUMPS)
+
+def test_each_switch_is_one_register_write(mcp):
+    relay = RelayController(PUMPS, mcp=mcp)
+    before = mcp.transactions
+    relay.activate("fill_1")
+    relay.activate("ph_up")
+    relay.deactivate("fill_1")
+    assert mcp.transactions - before == 3
+    assert mcp._gpio == 0xFFFF & ~(1 << PUMPS["ph_up"])
+    assert relay.is_active("ph_up") and not relay.is_active("fill_1")
+
+def test_unknown_pump_raises_without_touching_the_bus(mcp):
+    relay = RelayController(PUMPS, mcp=mcp)
+    before = mcp.transactions
+    with pytest.raises(KeyError):
+        relay.activate("nope")
+    assert mcp.transactions == before
+
+def test_failed_write_keeps_the_shadow_latch(mcp):
+    relay = RelayController(PUMPS, mcp=mcp)
+
+    class FailingBus(SimulatedMCP23017):
+        @SimulatedMCP23017.gpio.setter
+        def gpio(self, value):
+            raise OSError("I2C timeout")
+
+    relay.mcp = FailingBus(latency=0)
+    with pytest.raises(OSError):
+        relay.activate("fill_1")
+    assert not relay.is_active("fill_1")
+
+def test_simulated_pin_api_read_modify_writes(mcp):
+    pin = mcp.get_pin(3)
+    pin.direction = True
+    pin.value = True
+    assert mcp._iodir == 0xFFFF & ~(1 << 3)
+    assert pin.value and mcp._gpio == 1 << 3
+    with pytest.raises(ValueError):
+        mcp.get_pin(16)
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        create_mcp("spi")
+
+def test_reload_keeps_pumps_on_unchanged_pins_running(mcp):
+    relay = RelayController(PUMPS, mcp=mcp)
+    relay.activate("fill_1")
+    before = mcp.transactions
+    relay.apply_pump_map({**PUMPS, "drain_1": 10})
+    assert mcp.transactions - before == 1  # IODIR only: no changed pin was on
+    assert relay.is_active("fill_1") and not relay.is_active("drain_1")
+    assert mcp._iodir == 0xFFFF & ~pin_mask([*PUMPS.values(), 10])
+
+    before = mcp.transactions
+    relay.apply_pump_map({**PUMPS, "drain_1": 10})
+    assert mcp.transactions == before  # Same map: no writes
+
+def test_reload_switches_off_a_remapped_pump(mcp):
+    relay = RelayController(PUMPS, mcp=mcp)
+    relay.activate("fill_1")
+    relay.activate("ph_up")
+    before = mcp.transactions
+    relay.apply_pump_map({**PUMPS, "fill_1": 10})
+    assert mcp.transactions - before == 2  # One GPIO write, one IODIR write
+    assert mcp._gpio & (1 << 8) and mcp._gpio & (1 << 10)  # Old and new pin both off
+    assert not relay.is_active("fill_1")
+    assert relay.is_active("ph_up")
+
+def test_reload_switches_off_a_removed_pump(mcp):
+    relay = RelayController(PUMPS, mcp=mcp)
+    relay.activate("ph_up")
+    relay.activate("ph_down")
+    before = mcp.transactions
+    relay.apply_pump_map({name: pin for name, pin in PUMPS.items() if name != "ph_up"})
+    assert mcp.transactions - before == 2
+    assert mcp._gpio & (1 << PUMPS["ph_up"])
+    assert mcp._iodir & (1 << PUMPS["ph_up"])  # Back to an input
+    assert relay.is_active("ph_down")
+    with pytest.raises(KeyError):
+        relay.is_active("ph_up")
@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from packages.db import Base, Pump
+from packages.db.routing import ReplicaSet, RoutingSession, reads, writes
+
+class HangingEngine:
+    """Stands in for a Postgres replica whose connect blocks until released"""
+
+    class dialect:
+        name = "postgresql"
+
+    class url:
+        host = "replica-down"
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.connects = 0
+
+    def connect(self):
+        self.connects += 1
+        self.release.wait(5)
+        raise OSError("connection timed out")
+
+def sqlite_engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return engine
+
+@pytest.fixture
+def databases():
+    primary, replica = sqlite_engine(), sqlite_engine()
+    with replica.begin() as conn:
+        conn.execute(Pump.__table__.insert().values(name="only_on_replica", type="fill"))
+    replicas = ReplicaSet([replica], check_interval=0.05)
+    yield primary, replica, replicas
+    replicas.close(1)
+
+@reads
+def pump_names(db):
+    return db.scalars(select(Pump.name)).all()
+
+@writes
+def add_pump(db, name):
+    db.add(Pump(name=name, type="fill"))
+    db.flush()
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_pick_never_waits_for_a_down_replica():
+    engine = HangingEngine()
+    replicas = ReplicaSet([engine], check_interval=0.05)
+    try:
+        start = time.perf_counter()
+        for _ in range(10):
+            assert replicas.pick() is None  # Not probed yet, so the primary is used
+        assert time.perf_counter() - start < 0.1
+        wait_for(lambda: engine.connects == 1)
+    finally:
+        engine.release.set()
+        replicas.close(1)
+    assert replicas.replicas[0].lag == float("inf")
+
+def test_reads_go_to_a_healthy_replica_until_the_session_writes(databases):
+    primary, replica, replicas = databases
+    replicas.start()
+    wait_for(lambda: replicas.pick() is replica)
+
+    db = sessionmaker(class_=RoutingSession, bind=primary, replicas=replicas)()
+    assert pump_names(db) == ["only_on_replica"]
+    add_pump(db, "fill_1")
+    assert pump_names(db) == ["fill_1"]  # Reads its own write from the primary
+    db.close()
+
+def test_lagging_replica_falls_back_to_primary(databases):
+    primary, replica, replicas = databases
+    replicas.max_lag = -1  # Every replica is too far behind
+    replicas.refresh()
+    db = sessionmaker(class_=RoutingSession, bind=primary, replicas=replicas)()
+    assert pump_names(db) == []
+    db.close()
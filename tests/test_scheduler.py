@@ -0,0 +1,149 @@
+from datetime import datetime
+
+import pytest
+import requests
+from fastapi.testclient import TestClient
+
+import pi_api
+import scheduler as scheduler_module
+from scheduler import CronExpression, Schedule, Scheduler, ScheduleStore
+
+class FakeClock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+class FakeRelay:
+    """Records relay calls; deactivate fails while `stop_errors` is positive"""
+
+    def __init__(self):
+        self.calls = []
+        self.stop_errors = 0
+
+    def activate(self, pump):
+        self.calls.append(("activate", pump))
+
+    def deactivate(self, pump):
+        self.calls.append(("deactivate", pump))
+        if self.stop_errors:
+            self.stop_errors -= 1
+            raise OSError("I2C bus error")
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def relay():
+    return FakeRelay()
+
+@pytest.fixture
+def scheduler(clock):
+    store = ScheduleStore(":memory:")
+    yield Scheduler(store, clock=clock)
+    store.close()
+
+def test_cron_next_after():
+    cron = CronExpression("30 6 * * 1-5")  # 06:30 on weekdays
+    assert cron.next_after(datetime(2024, 3, 1, 6, 0)) == datetime(2024, 3, 1, 6, 30)  # Friday
+    assert cron.next_after(datetime(2024, 3, 1, 6, 30)) == datetime(2024, 3, 4, 6, 30)  # Monday
+    with pytest.raises(ValueError):
+        CronExpression("61 * * * *")
+
+def test_interval_does_not_drift_when_fired_late(scheduler, clock, relay):
+    schedule = scheduler.add(Schedule(pump="flush_1", duration_seconds=10, interval_seconds=100))
+    scheduler.start(relay, thread=False)
+    clock.now += 107  # Fired 7s late
+    assert scheduler.run_pending() == 1
+    assert schedule.last_run == schedule.created_at + 100
+    assert scheduler.next_run(schedule.id) == schedule.created_at + 200
+
+def test_catch_up_runs_the_missed_slot_once(clock, relay, tmp_path):
+    store = ScheduleStore(str(tmp_path / "schedules.db"))
+    schedule = Scheduler(store, clock=clock).add(Schedule(pump="fill_1", duration_seconds=5, interval_seconds=60))
+    store.set_last_run(schedule.id, schedule.created_at)
+
+    clock.now += 60 * 3 + 20  # Down for three slots
+    restarted = Scheduler(store, clock=clock)
+    restarted.start(relay, thread=False)
+    assert restarted.run_pending() == 1
+    assert relay.calls == [("activate", "fill_1")]
+    assert restarted.get(schedule.id).last_run == schedule.created_at + 60
+    assert restarted.next_run(schedule.id) == schedule.created_at + 240
+    store.close()
+
+def test_stops_after_duration(scheduler, clock, relay):
+    scheduler.add(Schedule(pump="fill_1", duration_seconds=30, interval_seconds=3600))
+    scheduler.start(relay, thread=False)
+    clock.now += 3600
+    scheduler.run_pending()
+    clock.now += 29
+    assert scheduler.run_pending() == 0
+    clock.now += 1
+    assert scheduler.run_pending() == 1
+    assert relay.calls == [("activate", "fill_1"), ("deactivate", "fill_1")]
+
+def test_failed_stop_is_retried_with_backoff_then_faults(scheduler, clock, relay, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "STOP_RETRY_SECONDS", 2)
+    monkeypatch.setattr(scheduler_module, "STOP_FAULT_AFTER", 3)
+    schedule = scheduler.add(Schedule(pump="fill_1", duration_seconds=10, interval_seconds=60))
+    scheduler.start(relay, thread=False)
+    relay.stop_errors = 10
+
+    clock.now += 60
+    scheduler.run_pending()
+    clock.now += 10
+    scheduler.run_pending()
+    assert relay.calls.count(("deactivate", "fill_1")) == 1
+    for delay in (2, 4):
+        clock.now += delay - 0.5
+        assert scheduler.run_pending() == 0
+        clock.now += 0.5
+        assert scheduler.run_pending() == 1
+    assert relay.calls.count(("deactivate", "fill_1")) == 3
+    assert "stop failed 3 times" in scheduler.fault("fill_1")
+
+    # A faulted pump is not started again, but stopping it keeps being retried
+    clock.now = schedule.created_at + 120
+    scheduler.run_pending()
+    assert relay.calls.count(("activate", "fill_1")) == 1
+
+    relay.stop_errors = 0
+    clock.now = schedule.created_at + 170  # The next retry (backoff capped at 30s) succeeds
+    scheduler.run_pending()
+    assert scheduler.fault("fill_1") is None
+    clock.now = schedule.created_at + 180
+    scheduler.run_pending()
+    assert relay.calls.count(("activate", "fill_1")) == 2
+
+def test_stop_is_bounded(scheduler, relay):
+    scheduler.start(relay)
+    scheduler.stop(timeout=1)
+    assert not scheduler._thread.is_alive()
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+        self.text = str(body)
+
+    def json(self):
+        return self._body
+
+@pytest.mark.parametrize("body, detail", [
+    ({"detail": "Schedule 7 not found"}, "Schedule 7 not found"),
+    ([{"loc": ["body"], "msg": "bad"}], "[{'loc': ['body'], 'msg': 'bad'}]"),
+])
+def test_passthrough_keeps_error_detail(monkeypatch, body, detail):
+    monkeypatch.setattr(pi_api, "forward", lambda *args, **kwargs: FakeResponse(404, body))
+    response = TestClient(pi_api.app).get("/schedules/7")
+    assert response.status_code == 404
+    assert response.json() == {"detail": detail}
+
+def test_passthrough_unreachable_is_503(monkeypatch):
+    def unreachable(*args, **kwargs):
+        raise requests.ConnectionError("refused")
+    monkeypatch.setattr(pi_api, "forward", unreachable)
+    assert TestClient(pi_api.app).get("/schedules").status_code == 503
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from models.water_para.tank_sim import (
+    Command, TankSimulator, commands_from_activity_rows, load_pump_activities, pulse,
+)
+from packages.db import PumpAction, PumpActivity, crud
+
+def test_fill_adds_volume_at_the_pump_rate():
+    sim = TankSimulator(2, volume_l=100.0)
+    sim.replay(pulse(10.0, "tank_2", "fill_1", 100.0), until=200.0)
+    assert sim.volume == pytest.approx([100.0, 105.0])  # fill_1 runs at 0.05 L/s
+    assert sim.time == 200.0
+
+def test_dose_shifts_ph_by_the_buffered_amount():
+    sim = TankSimulator(1, volume_l=100.0, base_ph=6.5, buffer_mmol_per_ph=0.5)
+    sim.replay(pulse(0.0, 0, "ph_down", 10.0))
+    # 0.05 L of -400 mmol/L into 100.05 L, 0.5 mmol/L per pH unit
+    assert sim.ph()[0] == pytest.approx(6.5 - 20.0 / 100.05 / 0.5)
+
+def test_tank_does_not_overflow_or_go_negative():
+    sim = TankSimulator(1, volume_l=190.0, capacity_l=200.0)
+    sim.set_concentrations(0, N=0.2)
+    sim.replay(pulse(0.0, 0, "fill_1", 1000.0) + pulse(2000.0, 0, "flush_1", 10000.0))
+    assert sim.volume[0] == 0.0
+    assert sim.mass[0].sum() == 0.0
+
+def test_commands_are_applied_in_time_order_and_sampled():
+    sim = TankSimulator(1, volume_l=100.0)
+    commands = [Command(20.0, 0, "fill_1", False), Command(0.0, 0, "fill_1", True)]
+    trace = sim.replay(commands, until=40.0, sample_every=10.0)
+    assert list(trace.times) == [0.0, 10.0, 20.0, 30.0, 40.0]
+    assert trace.volume[:, 0] == pytest.approx([100.0, 100.5, 101.0, 101.0, 101.0])
+    assert trace.ph.shape == trace.ec.shape == (5, 1)
+
+def test_commands_from_activity_rows():
+    start = datetime(2024, 5, 1, 6, 0)
+    rows = [
+        (1, 7, "fill_1", "on", start, None),
+        (2, 7, "fill_1", "off", start + timedelta(seconds=90), 90.0),
+        (3, 8, "ph_up", "on", start + timedelta(minutes=5), None),
+    ]
+    assert list(commands_from_activity_rows(rows, tank="tank_1")) == [
+        Command(0.0, "tank_1", "fill_1", True),
+        Command(90.0, "tank_1", "fill_1", False),
+        Command(300.0, "tank_1", "ph_up", True),
+    ]
+    # Times relative to an explicit start
+    assert next(commands_from_activity_rows(rows, start=start - timedelta(seconds=30))).time == 30.0
+
+def test_replays_recorded_pump_history(db):
+    pumps = {p.name: p for p in crud.initialize_pumps_from_config(db, {"fill_1": 8, "ph_down": 3})}
+    start = datetime(2024, 5, 1, 6, 0)
+    for pump, on, seconds in (("fill_1", 0, 60), ("ph_down", 120, 5)):
+        pump = pumps[pump]
+        on_at = start + timedelta(seconds=on)
+        db.add(PumpActivity(pump_id=pump.id, site_id=pump.site_id, action=PumpAction.ON, timestamp=on_at))
+        db.add(PumpActivity(pump_id=pump.id, site_id=pump.site_id, action=PumpAction.OFF,
+                            timestamp=on_at + timedelta(seconds=seconds), duration=seconds))
+    db.commit()
+
+    commands = load_pump_activities(db, start=start)
+    assert [(c.time, c.pump, c.on) for c in commands] == [
+        (0.0, "fill_1", True), (60.0, "fill_1", False), (120.0, "ph_down", True), (125.0, "ph_down", False),
+    ]
+    sim = TankSimulator(1, volume_l=100.0, base_ph=6.5)
+    sim.replay(commands)
+    assert sim.volume[0] == pytest.approx(100.0 + 3.0 + 0.025)
+    assert sim.ph()[0] < 6.5
+    assert np.isfinite(sim.ec()).all()
+
+def test_unknown_pump_in_history_is_named_or_skipped(db, caplog):
+    pumps = {p.name: p for p in crud.initialize_pumps_from_config(db, {"fill_1": 8, "drain_pump_7": 9})}
+    start = datetime(2024, 5, 1, 6, 0)
+    for pump, on in (("drain_pump_7", 0), ("fill_1", 30)):
+        crud_pump = pumps[pump]
+        db.add(PumpActivity(pump_id=crud_pump.id, site_id=crud_pump.site_id, action=PumpAction.ON,
+                            timestamp=start + timedelta(seconds=on)))
+        db.add(PumpActivity(pump_id=crud_pump.id, site_id=crud_pump.site_id, action=PumpAction.OFF,
+                            timestamp=start + timedelta(seconds=on + 20), duration=20))
+    db.commit()
+    commands = load_pump_activities(db, start=start, pump_tanks={"fill_1": "tank_2"})
+    assert {(c.pump, c.tank) for c in commands} == {("drain_pump_7", 0), ("fill_1", "tank_2")}
+
+    sim = TankSimulator(2, volume_l=100.0)
+    with pytest.raises(ValueError, match="drain_pump_7"):
+        sim.replay(commands)
+    assert sim.time == 0.0  # Nothing was applied
+
+    with caplog.at_level("WARNING"):
+        sim.replay(commands, skip_unknown_pumps=True)
+    assert "drain_pump_7" in caplog.text
+    assert sim.volume == pytest.approx([100.0, 101.0])  # fill_1 ran 20s into tank_2
+    with pytest.raises(ValueError, match="drain_pump_7"):
+        sim.set_pump(0, "drain_pump_7", True)
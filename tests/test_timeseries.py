@@ -0,0 +1,83 @@
+import math
+from datetime import datetime, timedelta
+
+import pytest
+
+from packages.db import crud
+from packages.db.timeseries import (
+    BitReader, BitWriter, decode_chunk, downsample, encode_chunk, from_millis, iter_chunk, to_millis,
+)
+
+START = datetime(2025, 1, 1)
+
+def regular(count, start=START, step=1.0):
+    return [(start + timedelta(seconds=i * step), round(6.0 + 0.3 * math.sin(i / 50), 2)) for i in range(count)]
+
+def test_bit_reader_reads_what_writer_wrote():
+    writer = BitWriter()
+    fields = [(1, 1), (0b101, 3), (0x1234, 13), ((1 << 64) - 1, 64), (0, 7), (42, 9)]
+    for value, nbits in fields:
+        writer.write(value, nbits)
+    reader = BitReader(writer.getvalue())
+    assert [reader.read(nbits) for _, nbits in fields] == [value for value, _ in fields]
+
+def test_bit_reader_rejects_reads_past_end():
+    with pytest.raises(ValueError):
+        BitReader(b"\xff").read(9)
+
+@pytest.mark.parametrize("samples", [
+    [],
+    [(START, 1.5)],
+    regular(1000),
+    # Irregular gaps exercise every delta-of-delta bucket, including the 64-bit fallback
+    [(START, 1.0), (START + timedelta(milliseconds=1), 2.0), (START + timedelta(seconds=3), 2.0),
+     (START + timedelta(minutes=5), -7.25), (START + timedelta(days=400), 0.0),
+     (START + timedelta(days=400, milliseconds=2), 1e300)],
+    # Special floats
+    [(START + timedelta(seconds=i), v) for i, v in enumerate([0.0, -0.0, float("inf"), -float("inf"), 1e-310, 5.0])],
+])
+def test_round_trip(samples):
+    assert decode_chunk(encode_chunk(samples), len(samples)) == samples
+
+def test_nan_round_trips():
+    (ts, value), = decode_chunk(encode_chunk([(START, float("nan"))]), 1)
+    assert ts == START and math.isnan(value)
+
+def test_pre_epoch_timestamps_round_trip():
+    samples = regular(10, start=datetime(1969, 12, 31, 23, 59, 55))
+    assert decode_chunk(encode_chunk(samples), len(samples)) == samples
+    assert to_millis(samples[0][0]) < 0
+    assert from_millis(to_millis(samples[0][0])) == samples[0][0]
+
+def test_range_filter_stops_at_end():
+    samples = regular(100)
+    data = encode_chunk(samples)
+    assert decode_chunk(data, 100, START + timedelta(seconds=10), START + timedelta(seconds=19)) == samples[10:20]
+    points = list(iter_chunk(data, 100, None, to_millis(START + timedelta(seconds=4))))
+    assert [from_millis(ms) for ms, _ in points] == [ts for ts, _ in samples[:5]]
+
+def test_regular_samples_compress():
+    samples = regular(1024)
+    assert len(encode_chunk(samples)) / len(samples) < 3
+
+def test_downsample_averages_buckets():
+    samples = [(START + timedelta(seconds=i), float(i)) for i in range(10)]
+    assert downsample(samples, 5, START) == [(START, 2.0), (START + timedelta(seconds=5), 7.0)]
+    assert downsample(samples, 0) == samples
+
+def test_crud_range_across_chunks(db):
+    samples = regular(250)
+    crud.record_sensor_samples(db, "tank_1.ph", samples, chunk_size=64)
+    crud.record_sensor_samples(db, "tank_2.ph", regular(10), chunk_size=64)
+
+    got = crud.get_sensor_samples(db, "tank_1.ph", START + timedelta(seconds=60), START + timedelta(seconds=130))
+    assert got == samples[60:131]
+
+    buckets = crud.get_sensor_samples(db, "tank_1.ph", START, START + timedelta(seconds=99), bucket_seconds=50)
+    assert [ts for ts, _ in buckets] == [START, START + timedelta(seconds=50)]
+    assert buckets[0][1] == pytest.approx(sum(v for _, v in samples[:50]) / 50)
+
+def test_crud_retention_deletes_whole_chunks(db):
+    crud.record_sensor_samples(db, "tank_1.ec", regular(128), chunk_size=64)
+    assert crud.delete_sensor_samples_before(db, "tank_1.ec", START + timedelta(seconds=100)) == 1
+    assert crud.get_sensor_samples(db, "tank_1.ec", START, START + timedelta(hours=1)) == regular(128)[64:]